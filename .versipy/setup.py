@@ -40,5 +40,6 @@ setup(
         'console_scripts': [
             '__entry_point_1__',
             '__entry_point_2__',
-            '__entry_point_3__']}
+            '__entry_point_3__',
+            '__entry_point_4__']}
 )
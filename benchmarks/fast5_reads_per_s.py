@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the Fast5_to_seq_summary workers in reads/s.
+
+Synthetic multi-read fast5 files are generated in a temporary directory (or fast5_dir is used), then the files are parsed in
+process by a single worker with the current implementation (grouped attribute reads with per file caching) and with the
+previous implementation (one h5py lookup per field and one queue message per read). The outputs of both paths are compared.
+
+Usage:
+    python benchmarks/fast5_reads_per_s.py --n_files 8 --reads_per_file 1000 --repeats 3
+"""
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import argparse
+import os
+import queue
+import tempfile
+import traceback
+import uuid
+from collections import OrderedDict, Counter
+from time import time
+
+# Third party imports
+import numpy as np
+import h5py
+
+# Local imports
+from pycoQC.Fast5_to_seq_summary import Fast5_to_seq_summary
+from pycoQC.common import recursive_file_gen
+
+#~~~~~~~~~~~~~~SYNTHETIC FILES~~~~~~~~~~~~~~#
+# Extra tracking_id attributes found in MinKNOW files, not requested by Fast5_to_seq_summary
+TRACKING_EXTRA_ATTRS = [
+    "asic_id", "asic_id_eeprom", "asic_temp", "asic_version", "auto_update", "auto_update_source", "bream_is_standard",
+    "device_type", "distribution_status", "distribution_version", "exp_script_name", "exp_script_purpose", "exp_start_time",
+    "flow_cell_product_code", "guppy_version", "heatsink_temp", "hostname", "installation_type", "local_firmware_file",
+    "operating_system", "protocol_group_id", "protocols_version", "usb_config", "version"]
+
+def make_multi_read_fast5 (fn, n_reads, seed=0):
+    """
+    Write a multi-read fast5 file with the groups and attributes read by Fast5_to_seq_summary. As in MinKNOW files,
+    the tracking_id and context_tags groups of the first read are hard linked in all the other reads
+    """
+    rng = np.random.RandomState(seed)
+    run_id = uuid.UUID(int=rng.randint(2**31)).hex
+    with h5py.File(fn, "w") as fp:
+        fp.attrs["file_type"] = np.bytes_("multi-read")
+        fp.attrs["file_version"] = np.bytes_("2.0")
+        shared_grp = {}
+        for i in range(n_reads):
+            read_id = str(uuid.UUID(int=int(rng.randint(2**62))*2**64+i))
+            read_grp = fp.create_group("read_{}".format(read_id))
+
+            raw = read_grp.create_group("Raw")
+            raw.attrs["read_id"] = np.bytes_(read_id)
+            raw.attrs["start_time"] = np.uint64(rng.randint(0, 4000*3600*48))
+            raw.attrs["duration"] = np.uint32(rng.randint(1000, 100000))
+            raw.attrs["start_mux"] = np.uint8(rng.randint(1, 5))
+            raw.attrs["read_number"] = np.int32(i)
+
+            channel = read_grp.create_group("channel_id")
+            channel.attrs["channel_number"] = np.bytes_(str(rng.randint(1, 513)))
+            channel.attrs["digitisation"] = np.float64(8192)
+            channel.attrs["offset"] = np.float64(rng.randint(-20, 20))
+            channel.attrs["range"] = np.float64(1467.6)
+            channel.attrs["sampling_rate"] = np.float64(4000)
+
+            if not shared_grp:
+                tracking = read_grp.create_group("tracking_id")
+                tracking.attrs["run_id"] = np.bytes_(run_id)
+                tracking.attrs["sample_id"] = np.bytes_("synthetic_sample")
+                tracking.attrs["device_id"] = np.bytes_("MN00000")
+                tracking.attrs["flow_cell_id"] = np.bytes_("FAH00000")
+                tracking.attrs["protocol_run_id"] = np.bytes_(uuid.UUID(int=rng.randint(2**31)).hex)
+                for name in TRACKING_EXTRA_ATTRS:
+                    tracking.attrs[name] = np.bytes_("synthetic")
+                context = read_grp.create_group("context_tags")
+                context.attrs["sample_frequency"] = np.bytes_("4000")
+                shared_grp = {"tracking_id":tracking, "context_tags":context}
+            else:
+                for name, grp in shared_grp.items():
+                    read_grp[name] = grp
+
+            basecall = read_grp.create_group("Analyses/Basecall_1D_000/Summary/basecall_1d_template")
+            basecall.attrs["mean_qscore"] = np.float64(rng.uniform(2, 15))
+            basecall.attrs["sequence_length"] = np.int64(rng.lognormal(8, 1))
+            basecall.attrs["called_events"] = np.int64(rng.randint(1000, 100000))
+            basecall.attrs["strand_score"] = np.float64(rng.uniform(-1, 1))
+
+            barcoding = read_grp.create_group("Analyses/Barcoding_000/Summary/barcoding")
+            barcoding.attrs["barcode_arrangement"] = np.bytes_("barcode{:02}".format(rng.randint(1, 13)))
+            barcoding.attrs["barcode_score"] = np.float64(rng.uniform(0, 100))
+
+#~~~~~~~~~~~~~~PREVIOUS IMPLEMENTATION~~~~~~~~~~~~~~#
+def get_h5_attrs_previous (fp, grp, attrs):
+    try:
+        v = fp[grp].attrs[attrs]
+        if type(v) == np.bytes_:
+            v = v.decode("utf8")
+        return v
+    except KeyError :
+        return None
+
+def read_fast5_previous (self, in_q, out_q, error_q, counter_q, worker_id):
+    """Worker of Fast5_to_seq_summary before the batched messages and the grouped attribute reads, with one lookup per field"""
+    try:
+        c = {"overall":Counter (), "fields_found":Counter(), "fields_not_found":Counter()}
+
+        for fast5_fn in iter(in_q.get, None):
+
+            with h5py.File(fast5_fn, "r") as h5_fp:
+
+                multi_read = h5_fp.attrs.get('file_type') in (b'multi-read', 'multi-read')
+
+                if multi_read:
+                    read_ids =  list(h5_fp["/"].keys())
+                else:
+                    read_ids = list(h5_fp["/Raw/Reads"].keys())
+
+                for read_id in read_ids:
+                    d = OrderedDict()
+
+                    if multi_read:
+                        grp_dict = {
+                            "raw_read" : "/{}/Raw/".format(read_id),
+                            "summary_basecall" : "/{read_id}/Analyses/Basecall_1D_{bc_id:03}/Summary/basecall_1d_template/".format(read_id=read_id, bc_id=self.basecall_id),
+                            "summary_calibration" : "/{read_id}/Analyses/Calibration_Strand_Detection_{bc_id:03}/Summary/calibration_strand_template/".format(read_id=read_id, bc_id=self.basecall_id),
+                            "summary_barcoding" : "/{read_id}/Analyses/Barcoding_{bc_id:03}/Summary/barcoding/".format(read_id=read_id, bc_id=self.basecall_id),
+                            "tracking_id" : "/{}/tracking_id".format(read_id),
+                            "channel_id" : "/{}/channel_id".format(read_id)}
+                    else:
+                        grp_dict = {
+                            "raw_read" : "/Raw/Reads/{}/".format(read_id),
+                            "summary_basecall" : "/Analyses/Basecall_1D_{:03}/Summary/basecall_1d_template/".format(self.basecall_id),
+                            "summary_calibration" : "/Analyses/Calibration_Strand_Detection_{:03}/Summary/calibration_strand_template/".format(self.basecall_id),
+                            "summary_barcoding" : "/Analyses/Barcoding_{:03}/Summary/barcoding/".format(self.basecall_id),
+                            "tracking_id" : "UniqueGlobalKey/tracking_id",
+                            "channel_id" : "UniqueGlobalKey/channel_id"}
+
+                    for field in self.fields:
+                        if field == "start_time":
+                            start_time = get_h5_attrs_previous (fp=h5_fp,
+                                grp=grp_dict[self.attrs_grp_dict["start_time"]["grp"]],
+                                attrs=self.attrs_grp_dict["start_time"]["attrs"])
+                            sampling_rate = get_h5_attrs_previous (fp=h5_fp,
+                                grp=grp_dict[self.attrs_grp_dict["channel_sampling_rate"]["grp"]],
+                                attrs=self.attrs_grp_dict["channel_sampling_rate"]["attrs"])
+                            if start_time and sampling_rate:
+                                d[field] = int(start_time/sampling_rate)
+                                c["fields_found"][field] +=1
+                            else:
+                                c["fields_not_found"][field] +=1
+                        else:
+                            v = get_h5_attrs_previous (
+                                fp=h5_fp, grp=grp_dict[self.attrs_grp_dict[field]["grp"]], attrs=self.attrs_grp_dict[field]["attrs"])
+                            if v:
+                                d[field] = v
+                                c["fields_found"][field] +=1
+                            else:
+                                c["fields_not_found"][field] +=1
+
+                    if self.include_path:
+                        d["path"] = os.path.abspath(fast5_fn)
+
+                    if d:
+                        out_q.put(d)
+                        c["overall"]["valid files"] += 1
+                    else:
+                        c["overall"]["invalid files"] += 1
+
+        counter_q.put(c)
+
+    except Exception:
+        error_q.put (traceback.format_exc())
+    finally:
+        out_q.put(None)
+
+#~~~~~~~~~~~~~~BENCHMARK~~~~~~~~~~~~~~#
+def run_worker (worker, f2s, fast5_list):
+    """Run a worker in process on all the files and return the elapsed time and the rows extracted"""
+    in_q, out_q, error_q, counter_q = queue.Queue(), queue.Queue(), queue.Queue(), queue.Queue()
+    for fn in fast5_list:
+        in_q.put(fn)
+    in_q.put(None)
+
+    t = time()
+    worker(f2s, in_q, out_q, error_q, counter_q, 0)
+    elapsed = time()-t
+
+    if not error_q.empty():
+        raise RuntimeError(error_q.get())
+
+    # Messages are either one dict per read (previous) or one (file_info, column batch) tuple per file (current)
+    rows = []
+    for msg in iter(out_q.get, None):
+        if isinstance(msg, tuple):
+            _, batch = msg
+            rows.extend(zip(*batch.values()))
+        else:
+            rows.append(tuple(msg.get(field) for field in f2s.columns))
+    return elapsed, rows
+
+def normalise_rows (rows):
+    """Convert numpy scalars to python values so that the outputs of both paths can be compared"""
+    return sorted(tuple(v.item() if isinstance(v, np.generic) else v for v in row) for row in rows)
+
+def main ():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fast5_dir", default="", type=str,
+        help="Directory of fast5 files to use instead of synthetic multi-read files (default: %(default)s)")
+    parser.add_argument("--n_files", default=8, type=int,
+        help="Number of synthetic multi-read files (default: %(default)s)")
+    parser.add_argument("--reads_per_file", default=1000, type=int,
+        help="Number of reads per synthetic multi-read file (default: %(default)s)")
+    parser.add_argument("--repeats", default=3, type=int,
+        help="Number of timed runs of each path. The best run is reported (default: %(default)s)")
+    parser.add_argument("--fields", default="", type=str,
+        help="Comma separated list of fields to extract. Fast5_to_seq_summary defaults if not given (default: %(default)s)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.fast5_dir:
+            fast5_dir = args.fast5_dir
+        else:
+            fast5_dir = tmp_dir
+            print("Writing {} synthetic multi-read files of {} reads".format(args.n_files, args.reads_per_file))
+            for i in range(args.n_files):
+                make_multi_read_fast5(os.path.join(tmp_dir, "batch_{}.fast5".format(i)), args.reads_per_file, seed=i)
+        fast5_list = list(recursive_file_gen(fast5_dir, "fast5"))
+
+        # Without output file the instance is only configured and nothing is run
+        kwargs = {"fields":args.fields.split(",")} if args.fields else {}
+        f2s = Fast5_to_seq_summary(fast5_dir=fast5_dir, seq_summary_fn="", **kwargs)
+
+        results = OrderedDict()
+        for name, worker in (("previous", read_fast5_previous), ("current", Fast5_to_seq_summary._read_fast5)):
+            times = []
+            for _ in range(args.repeats):
+                elapsed, rows = run_worker(worker, f2s, fast5_list)
+                times.append(elapsed)
+            results[name] = (min(times), normalise_rows(rows))
+            print("{:<10} {:>8,} reads  best {:.3f} s  {:>10,.0f} reads/s".format(name, len(rows), min(times), len(rows)/min(times)))
+
+        identical = results["previous"][1] == results["current"][1]
+        print("Speedup: {:.2f}x / Identical output: {}".format(results["previous"][0]/results["current"][0], identical))
+        if not identical:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
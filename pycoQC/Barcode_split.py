@@ -5,23 +5,44 @@
 # Standard library imports
 from collections import *
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import os
+import io
+import gzip
+import json
+import importlib.util
 
 # Third party imports
+import numpy as np
 import pandas as pd
 
 # Local lib import
 from pycoQC import __name__ as package_name
 from pycoQC import __version__ as package_version
 from pycoQC.common import *
-from pycoQC.pycoQC_parse import pycoQC_parse
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~GLOBAL SETTINGS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
 # Silence futurewarnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+# Size of the write buffer of each per barcode output file
+WRITE_BUFFER_SIZE = 256*1024
+
+# Extensions of the output files for the supported output formats and of the partial aggregate files
+OUTPUT_EXT = OrderedDict([("tsv",".txt"), ("tsv.gz",".txt.gz"), ("tsv.zst",".txt.zst"), ("parquet",".parquet"), ("aggregate","_aggregate.json")])
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Maximal number of reads buffered per barcode while the type of some parquet columns is undetermined because they only contain
+# empty values. Undetermined columns are written as strings once the limit is reached
+PARQUET_TYPING_MAX_ROWS = 100000
+
+# Histogram bins of the partial aggregates
+READ_LEN_LOG10_BINS = np.linspace(0, 7, 351)
+QUAL_BINS = np.linspace(0, 50, 501)
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~MAIN CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 def Barcode_split (
     summary_file:str,
@@ -29,14 +50,21 @@ def Barcode_split (
     output_dir:str="",
     output_unclassified:bool=False,
     min_barcode_percent:float=0.1,
+    chunk_size:int=200000,
+    output_format:str="tsv",
+    output_aggregate:bool=False,
+    threads:int=4,
     verbose:bool=False,
     quiet:bool=False):
     """
     Parse Albacore sequencing_summary.txt file and split per barcode
     By default, data for low frequency barcodes and unclassified reads are not written in the output directory
+    Files are streamed by chunks and the rows are appended to the per barcode files as they are read, so the memory usage
+    does not depend on the number of reads. Only a compact read_id hash index is kept in memory when a barcode_file is given.
     * summary_file
         Path to a sequencing_summary generated by Albacore 1.0.0 + (read_fast5_basecaller.py) / Guppy 2.1.3+ (guppy_basecaller).
-        One can also pass multiple space separated file paths or a UNIX style regex matching multiple files
+        One can also pass multiple space separated file paths or a UNIX style regex matching multiple files.
+        Parquet, feather and arrow files are detected from their content and read natively
     * barcode_file
         Path to the barcode_file generated by Guppy 2.1.3+ (guppy_barcoder) or Deepbinner 0.2.0+. This is not a required file.
         One can also pass multiple space separated file paths or a UNIX style regex matching multiple files
@@ -46,6 +74,17 @@ def Barcode_split (
         If True unclassified barcodes are also written in a file. By default they are skiped
     * min_barcode_percent
         Minimal percent of total reads to write barcode reads in file.
+        Files of low frequency barcodes are removed once all the reads have been counted
+    * chunk_size
+        Number of lines read at once from the input files
+    * output_format
+        Format of the output files. One of `tsv`, `tsv.gz` (gzip compressed), `tsv.zst` (zstd compressed, requires the zstandard package)
+        or `parquet` (requires the pyarrow package)
+    * output_aggregate
+        If True a partial aggregate json file with the read counts, run_ids, channels and read length / quality histograms is also written
+        for each barcode (sequencing_summary_{barcode}_aggregate.json). Partial aggregates can be merged by summing their values
+    * threads
+        Number of threads used to format, compress and write the output files
     * verbose
         Increase verbosity
     * quiet
@@ -65,53 +104,379 @@ def Barcode_split (
     logger.debug("Runtime options")
     logger.debug(dict_to_str(options_d))
 
-    # Process data
-    logger.warning ("Import data from sequencing summary file(s) and cleanup")
-    logger.info ("\tRead files and import in a dataframe")
-    pps = pycoQC_parse(summary_file=summary_file, barcode_file=barcode_file, cleanup=False, verbose=verbose, quiet=quiet)
-    df = pps.reads_df
+    # Check options
+    if not output_format in OUTPUT_EXT or output_format == "aggregate":
+        raise pycoQCError ("Invalid output format {}. Valid formats: tsv, tsv.gz, tsv.zst or parquet".format(output_format))
+    if output_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise pycoQCError ("The pyarrow package is required to write parquet files")
+
+    # Check files
+    logger.warning ("Check input data files")
+    summary_files_list = expand_file_names(summary_file)
+    logger.debug ("\t\tSequencing summary files found: {}".format(" ".join(summary_files_list)))
+    barcode_files_list = expand_file_names(barcode_file) if barcode_file else []
+    logger.debug ("\t\tBarcode files found: {}".format(" ".join(barcode_files_list)))
+
+    # Only keep the columns shared by all summary files
+    columns = _common_columns(summary_files_list)
 
-    # Rename barcode field and check if present
-    df = df.rename(columns={"barcode_arrangement":"barcode"})
-    if not "barcode" in df:
+    # Index barcodes by read_id hash if barcode files were given, else use the barcode field of the summary
+    if barcode_files_list:
+        logger.warning ("Index barcodes from barcode file(s)")
+        barcode_index = _barcode_index(barcode_files_list, chunk_size)
+        logger.info ("\t{:,} reads indexed".format(len(barcode_index[0])))
+        barcode_field = None
+        if not "read_id" in columns:
+            raise pycoQCError ("No read_id field found in provided summary file(s)")
+    elif "barcode_arrangement" in columns:
+        barcode_field = "barcode_arrangement"
+    elif "barcode" in columns:
+        barcode_field = "barcode"
+    else:
         raise pycoQCError ("No barcode information found in provided file(s)")
 
-    # Quick data cleanup
-    logger.info ("\tCleanup missing barcodes values")
-    df = df.fillna({"barcode":"unclassified"})
+    # Remove any field containing barcode in it
+    out_columns = [i for i in columns if not i.startswith("barcode")]
+    if output_dir:
+        mkdir(output_dir, exist_ok=True)
+
+    # One single thread worker per writer slot so that the chunks of a given barcode are written in order
+    logger.warning ("Split data per barcode")
+    workers = [ThreadPoolExecutor(max_workers=1) for _ in range(max(threads, 1))]
+    barcode_counts = Counter()
+    writer_d = OrderedDict()
+    pending = []
+    try:
+        for fn in summary_files_list:
+            logger.info ("\tProcessing file {}".format(fn))
+            for df in _read_chunks(fn, columns, chunk_size):
+                if barcode_field:
+                    barcodes = df[barcode_field].replace("", "unclassified").values
+                else:
+                    barcodes = _lookup_barcodes(df["read_id"].values, *barcode_index)
+
+                futures = []
+                for barcode, idx in pd.Series(barcodes).groupby(barcodes, sort=False).indices.items():
+                    barcode_counts[barcode] += len(idx)
+
+                    # Skip unclassified if required
+                    if not output_unclassified and barcode == "unclassified":
+                        continue
+
+                    # Create a writer the first time the barcode is found
+                    if not barcode in writer_d:
+                        logger.debug ("\t\tCreate output writer for barcode {}".format(barcode))
+                        writer_d[barcode] = _Barcode_writer (
+                            fn = _barcode_fn(output_dir, barcode, output_format),
+                            columns = out_columns,
+                            output_format = output_format,
+                            aggregate_fn = _barcode_fn(output_dir, barcode, "aggregate") if output_aggregate else "")
+                        writer_d[barcode].worker = workers[(len(writer_d)-1)%len(workers)]
+
+                    writer = writer_d[barcode]
+                    futures.append(writer.worker.submit(writer.write, df.iloc[idx][out_columns]))
+
+                # Wait for the previous chunk to be written to bound the number of chunks in memory
+                for future in pending:
+                    future.result()
+                pending = futures
 
-    # List barcode with low frequency
+        for future in pending:
+            future.result()
+        for future in [writer.worker.submit(writer.close) for writer in writer_d.values()]:
+            future.result()
+    finally:
+        for worker in workers:
+            worker.shutdown(wait=True)
+        for writer in writer_d.values():
+            writer.close()
+
+    if not barcode_counts:
+        raise pycoQCError ("No valid read found in input file")
+
+    # Remove files of barcodes with low frequency
+    low_barcode = set()
     if min_barcode_percent:
         logger.info ("\tCleaning up low frequency barcodes")
-        barcode_counts = df["barcode"][df["barcode"]!="unclassified"].value_counts()
-        cutoff = int(barcode_counts.sum()*min_barcode_percent/100)
-        low_barcode = barcode_counts[barcode_counts<cutoff].index
-        # df.loc[df["barcode"].isin(low_barcode), "barcode"] = "unclassified"
+        cutoff = int(sum(v for k, v in barcode_counts.items() if k != "unclassified")*min_barcode_percent/100)
+        low_barcode = {k for k, v in barcode_counts.items() if k != "unclassified" and v < cutoff}
+        for barcode in low_barcode:
+            if barcode in writer_d:
+                writer_d[barcode].remove()
 
     bc = namedtuple ("bc", ["Counts", "Write"])
     bc_l = OrderedDict()
+    for barcode in sorted(barcode_counts):
+        bc_l[barcode] = bc(barcode_counts[barcode], barcode in writer_d and not barcode in low_barcode)
 
-    logger.warning ("Split data per barcode")
-    for barcode, barcode_df in df.groupby("barcode"):
-        logger.info ("\tProcessing data for Barcode {}".format(barcode))
+    logger.info("Barcode Counts")
+    bc_df = pd.DataFrame.from_dict(bc_l, orient="index")
+    logger.info(bc_df)
 
-        # Skip unclassified if required
-        if not output_unclassified and barcode == "unclassified":
-            bc_l[barcode] = bc(len(barcode_df), False)
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PRIVATE CLASSES~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
-        # Skip low frequency if required
-        elif min_barcode_percent and barcode in low_barcode:
-            bc_l[barcode] = bc(len(barcode_df), False)
+class _Barcode_writer ():
+    """
+    Append chunks of reads of a single barcode to an output file in one of the OUTPUT_EXT formats and optionally
+    update a partial aggregate of the reads. The file is only opened when the first chunk is written
+    """
+    def __init__ (self, fn, columns, output_format="tsv", aggregate_fn=""):
+        self.fn = fn
+        self.columns = columns
+        self.output_format = output_format
+        self.aggregate_fn = aggregate_fn
+        self.aggregate = _Partial_aggregate(columns) if aggregate_fn else None
+        self.worker = None
+        self._fp = None
+        self._parquet_writer = None
+        self._parquet_dtypes = OrderedDict((col, None) for col in columns)
+        self._parquet_buffer = []
+        self._parquet_buffer_rows = 0
+        self._closed = False
 
-        # Cleanup and write barcode to file
+    def write (self, df):
+        if self.aggregate:
+            self.aggregate.update(df)
+        if self.output_format == "parquet":
+            self._write_parquet(df)
         else:
-            bc_l[barcode] = bc(len(barcode_df), True)
-            # Remove any field containing barcode in it
-            barcode_df = barcode_df[[i for i in df.columns if not i.startswith("barcode")]]
-            # Write to file
-            file_name = os.path.join(output_dir, "sequencing_summary_{}.txt".format(barcode))
-            barcode_df.to_csv(file_name, sep="\t", index=False)
+            if self._fp is None:
+                self._fp = _open_text(self.fn, self.output_format)
+                self._fp.write("\t".join(self.columns)+"\n")
+            df.to_csv(self._fp, sep="\t", index=False, header=False)
 
-    logger.info("Barcode Counts")
-    bc_df = pd.DataFrame.from_dict(bc_l, orient="index")
-    logger.info(bc_df)
+    def close (self):
+        # Safe to call again from the cleanup code once the writer is closed
+        if self._closed:
+            return
+        self._closed = True
+        if self._parquet_buffer:
+            self._flush_parquet_buffer()
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        if self.aggregate is not None and self.aggregate.reads:
+            with open(self.aggregate_fn, "w") as fp:
+                json.dump(self.aggregate.to_dict(), fp)
+
+    def remove (self):
+        for fn in (self.fn, self.aggregate_fn):
+            if fn and os.path.isfile(fn):
+                os.remove(fn)
+
+    def _write_parquet (self, df):
+        """
+        Values are read as strings. Column types are inferred from the first non empty values of each column and enforced once the
+        parquet writer is open. Chunks are buffered until the type of every column is known or PARQUET_TYPING_MAX_ROWS is reached
+        """
+        if self._parquet_writer is not None:
+            self._write_parquet_table(df)
+            return
+
+        self._update_parquet_dtypes(df)
+        self._parquet_buffer.append(df)
+        self._parquet_buffer_rows += len(df)
+        if self._parquet_buffer_rows >= PARQUET_TYPING_MAX_ROWS or all(self._parquet_dtypes.values()):
+            self._flush_parquet_buffer()
+
+    def _update_parquet_dtypes (self, df):
+        """Infer the type of undetermined columns and widen the types of the columns not compatible with the values of df"""
+        for col, dtype in self._parquet_dtypes.items():
+            if dtype == "str":
+                continue
+            values = df[col][df[col] != ""]
+            if values.empty:
+                continue
+            values = pd.to_numeric(values, errors="coerce")
+            if values.isnull().any():
+                self._parquet_dtypes[col] = "str"
+            elif values.dtype.kind in "iu" and dtype != "float64":
+                self._parquet_dtypes[col] = "Int64"
+            else:
+                self._parquet_dtypes[col] = "float64"
+
+    def _flush_parquet_buffer (self):
+        """Write the buffered chunks. Columns without any value so far are written as strings"""
+        for col, dtype in self._parquet_dtypes.items():
+            if dtype is None:
+                self._parquet_dtypes[col] = "str"
+        buffer, self._parquet_buffer, self._parquet_buffer_rows = self._parquet_buffer, [], 0
+        for df in buffer:
+            self._write_parquet_table(df)
+
+    def _write_parquet_table (self, df):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise pycoQCError ("The pyarrow package is required to write parquet files")
+
+        df = df.copy()
+        for col, dtype in self._parquet_dtypes.items():
+            if dtype != "str":
+                # The types cannot be changed once the writer is open, so values not matching the type raise an error instead of being lost
+                values = pd.to_numeric(df[col], errors="coerce")
+                if values.notnull().sum() != (df[col] != "").sum():
+                    raise pycoQCError ("Field {} contains non numeric values after numeric values for file {}. Use a tsv output format".format(col, self.fn))
+                try:
+                    df[col] = values.astype(dtype)
+                except (ValueError, TypeError):
+                    raise pycoQCError ("Field {} cannot be converted to {} for file {}. Use a tsv output format".format(col, dtype, self.fn))
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.fn, table.schema)
+        self._parquet_writer.write_table(table)
+
+class _Partial_aggregate ():
+    """
+    Additive statistics of the reads of a barcode, updated chunk by chunk. Partial aggregates of several runs or files
+    can be merged by summing their counts and histograms
+    """
+    def __init__ (self, columns):
+        self.len_field = _first_field(columns, ["sequence_length_template", "sequence_length_2d", "sequence_length"])
+        self.qual_field = _first_field(columns, ["mean_qscore_template", "mean_qscore_2d"])
+        self.reads = 0
+        self.bases = 0
+        self.len_hist = np.zeros(len(READ_LEN_LOG10_BINS)-1, dtype=np.int64)
+        self.qual_hist = np.zeros(len(QUAL_BINS)-1, dtype=np.int64)
+        self.channels = Counter()
+        self.run_ids = Counter()
+        self.start_time = [None, None]
+
+    def update (self, df):
+        self.reads += len(df)
+        if self.len_field:
+            read_len = pd.to_numeric(df[self.len_field], errors="coerce").fillna(0).values
+            self.bases += int(read_len.sum())
+            log_len = np.log10(np.maximum(read_len, 1))
+            self.len_hist += np.histogram(np.clip(log_len, READ_LEN_LOG10_BINS[0], READ_LEN_LOG10_BINS[-1]), bins=READ_LEN_LOG10_BINS)[0]
+        if self.qual_field:
+            qual = pd.to_numeric(df[self.qual_field], errors="coerce").dropna().values
+            self.qual_hist += np.histogram(np.clip(qual, QUAL_BINS[0], QUAL_BINS[-1]), bins=QUAL_BINS)[0]
+        if "channel" in df:
+            self.channels.update(df["channel"].value_counts().to_dict())
+        if "run_id" in df:
+            self.run_ids.update(df["run_id"].value_counts().to_dict())
+        if "start_time" in df:
+            start_time = pd.to_numeric(df["start_time"], errors="coerce").dropna()
+            if len(start_time):
+                self.start_time[0] = min(v for v in (self.start_time[0], start_time.min()) if v is not None)
+                self.start_time[1] = max(v for v in (self.start_time[1], start_time.max()) if v is not None)
+
+    def to_dict (self):
+        d = OrderedDict()
+        d["package_name"] = package_name
+        d["package_version"] = package_version
+        d["reads"] = self.reads
+        d["bases"] = self.bases
+        d["run_ids"] = OrderedDict(sorted(self.run_ids.items()))
+        d["channels"] = OrderedDict(sorted(self.channels.items(), key=lambda x: int(x[0]) if x[0].isdigit() else x[0]))
+        d["start_time_range"] = [float(v) if v is not None else None for v in self.start_time]
+        d["read_len_log10_bins"] = READ_LEN_LOG10_BINS.round(3).tolist()
+        d["read_len_counts"] = self.len_hist.tolist()
+        d["mean_qscore_bins"] = QUAL_BINS.round(3).tolist()
+        d["mean_qscore_counts"] = self.qual_hist.tolist()
+        return d
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PRIVATE FUNCTIONS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+def _first_field (columns, candidates):
+    for field in candidates:
+        if field in columns:
+            return field
+    return None
+
+def _open_text (fn, output_format):
+    """Open a text file for writing with optional gzip or zstd compression"""
+    if output_format == "tsv.gz":
+        return gzip.open(fn, "wt", compresslevel=GZIP_LEVEL)
+    if output_format == "tsv.zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise pycoQCError ("The zstandard package is required to write zstd compressed files")
+        writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(fn, "wb"))
+        return io.TextIOWrapper(writer, encoding="utf-8")
+    return open(fn, "w", buffering=WRITE_BUFFER_SIZE)
+
+def _read_chunks (fn, columns, chunk_size):
+    """
+    Yield chunks of the selected columns of a text, parquet, feather or arrow file as DataFrames of strings, so that the values are
+    written back unchanged. Columnar files are read natively and their values are formatted as pandas would write them in a text file
+    """
+    if get_file_format(fn) == "text":
+        yield from pd.read_csv(fn, sep="\t", usecols=columns, dtype=str, keep_default_na=False, na_filter=False, chunksize=chunk_size)
+    else:
+        for table in iter_columnar_file(fn, columns=columns, batch_size=chunk_size):
+            yield pd.DataFrame(OrderedDict((col, _format_column(table.column(col)).to_numpy(zero_copy_only=False)) for col in columns))
+
+def _format_column (a):
+    """Vectorised conversion of an arrow column to strings. Missing values are converted to empty strings"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if pa.types.is_boolean(a.type):
+        s = pc.if_else(a, "True", "False")
+    else:
+        s = a.cast(pa.string())
+        # Integral floats are written with a decimal point by pandas
+        if pa.types.is_floating(a.type):
+            s = pc.if_else(pc.match_substring_regex(s, r"^-?[0-9]+$"), pc.binary_join_element_wise(s, ".0", ""), s)
+    return s.fill_null("")
+
+def _barcode_fn (output_dir, barcode, output_format="tsv"):
+    return os.path.join(output_dir, "sequencing_summary_{}{}".format(barcode, OUTPUT_EXT[output_format]))
+
+def _common_columns (fn_list):
+    """List the columns found in all the files, in the order of the first file"""
+    columns = None
+    for fn in fn_list:
+        fn_columns = get_file_columns(fn)
+        columns = fn_columns if columns is None else [i for i in columns if i in fn_columns]
+    return columns
+
+def _barcode_index (fn_list, chunk_size):
+    """
+    Read Guppy or Deepbinner barcode files by chunks and return a tuple of arrays (sorted read_id hashes, barcode codes,
+    barcode labels). About 12 bytes are used per read instead of the full read_id and barcode strings
+    """
+    hashes_l = []
+    codes_l = []
+    label_d = OrderedDict()
+
+    for fn in fn_list:
+        header = get_file_columns(fn)
+        if "read_id" in header and "barcode_arrangement" in header:
+            id_field, barcode_field, none_val = "read_id", "barcode_arrangement", ""
+        elif "read_ID" in header and "barcode_call" in header:
+            id_field, barcode_field, none_val = "read_ID", "barcode_call", "none"
+        else:
+            raise pycoQCError ("File {} does not contain required barcode information".format(fn))
+
+        for df in _read_chunks(fn, [id_field, barcode_field], chunk_size):
+            barcodes = df[barcode_field].replace({none_val:"unclassified", "":"unclassified"})
+            codes, labels = pd.factorize(barcodes)
+            # Translate chunk codes into global codes
+            label_codes = np.array([label_d.setdefault(label, len(label_d)) for label in labels], dtype=np.int32)
+            codes_l.append(label_codes[codes])
+            hashes_l.append(hash_read_ids(df[id_field].values))
+
+    hashes = np.concatenate(hashes_l)
+    codes = np.concatenate(codes_l)
+    # Stable sort so that the first occurence of duplicated read_ids is used
+    order = np.argsort(hashes, kind="stable")
+    return (hashes[order], codes[order], np.array(list(label_d.keys()), dtype=object))
+
+def _lookup_barcodes (read_ids, hashes, codes, labels):
+    """Return the barcode labels of read_ids from a barcode index. Reads missing from the index are unclassified"""
+    barcodes = np.full(len(read_ids), "unclassified", dtype=object)
+    if len(hashes):
+        read_hashes = hash_read_ids(read_ids)
+        pos = np.minimum(np.searchsorted(hashes, read_hashes), len(hashes)-1)
+        found = hashes[pos] == read_hashes
+        barcodes[found] = labels[codes[pos[found]]]
+    return barcodes
@@ -9,14 +9,16 @@ os.environ['OPENBLAS_NUM_THREADS'] = '1'
 #~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
 # Standard library imports
 import multiprocessing as mp
+import queue
 from time import time
 from collections import *
 import traceback
 import logging
+import gzip
+import importlib.util
 
 # Third party imports
 import numpy as np
-import pandas as pd
 import h5py
 from tqdm import tqdm
 
@@ -28,6 +30,48 @@ logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 logLevel_dict = logLevel_dict = {2:logging.DEBUG, 1:logging.INFO, 0:logging.WARNING}
 
+# Manifest of the processed fast5 files written next to the output file
+MANIFEST_EXT = ".manifest.tsv"
+MANIFEST_COLUMNS = ["path", "size", "mtime_ns", "reads", "output_offset"]
+
+# Columnar output formats selected from the extension of the output file. Both require the pyarrow package
+COLUMNAR_FORMATS = OrderedDict([(".parquet", "parquet"), (".feather", "feather")])
+
+# Minimal number of reads per parquet row group
+COLUMNAR_MIN_BATCH_SIZE = 65536
+
+# Types of the fields in columnar output files. Fields not listed are written as strings
+FIELD_TYPES = {
+    "mean_qscore_template": "float32",
+    "sequence_length_template": "uint32",
+    "called_events": "uint32",
+    "skip_prob": "float32",
+    "stay_prob": "float32",
+    "step_prob": "float32",
+    "strand_score": "float32",
+    "start_time": "float32",
+    "duration": "uint32",
+    "start_mux": "uint8",
+    "read_number": "uint32",
+    "channel": "uint16",
+    "channel_digitisation": "float32",
+    "channel_offset": "float32",
+    "channel_range": "float32",
+    "channel_sampling_rate": "float32",
+    "run_id": "category",
+    "sample_id": "category",
+    "device_id": "category",
+    "protocol_run_id": "category",
+    "flow_cell_id": "category",
+    "calibration_strand_genome_template": "category",
+    "calibration_strand_end": "uint32",
+    "calibration_strand_start": "uint32",
+    "calibration_strand_identity": "float32",
+    "barcode_arrangement": "category",
+    "barcode_full_arrangement": "category",
+    "barcode_score": "float32",
+    "path": "category"}
+
 #~~~~~~~~~~~~~~CLASS~~~~~~~~~~~~~~#
 class Fast5_to_seq_summary ():
     """
@@ -76,6 +120,11 @@ class Fast5_to_seq_summary ():
         basecall_id:int=0,
         verbose_level:int=0,
         include_path:bool=False,
+        write_batch_size:int=1000,
+        in_memory_max_size:int=0,
+        resume:bool=False,
+        scan_threads:int=4,
+        sort_by_size:bool=False,
         fields:list=[
             "read_id", "run_id", "channel", "start_time",
             "sequence_length_template", "mean_qscore_template",
@@ -84,7 +133,10 @@ class Fast5_to_seq_summary ():
         * fast5_dir
             Directory containing fast5 files. Can contain multiple subdirectories
         * seq_summary_fn
-            path of the summary sequencing file where to write the data extracted from the fast5 files
+            path of the summary sequencing file where to write the data extracted from the fast5 files.
+            The file is gzip compressed if the name ends with .gz. Files ending with .parquet or .feather are written in a columnar
+            format with typed columns (requires the pyarrow package) that pycoQC reads without any text parsing. If empty, nothing is written and the data can be consumed
+            in the calling process with iter_batches
         * max_fast5
             Maximum number of file to try to parse. 0 to deactivate
         * threads
@@ -100,6 +152,21 @@ class Fast5_to_seq_summary ():
             this can be used to indicate the corresponding group (1, 2 ...)
         * include_path
             If True the absolute path to the corresponding file is added in an extra column
+        * write_batch_size
+            Number of reads buffered before being written to the output file. Parquet row groups contain at least 65,536 reads.
+            Feather files are written once all the reads are collected
+        * in_memory_max_size
+            Fast5 files smaller than this size in MB are entirely loaded in memory (h5py core driver) before being parsed. 0 to deactivate
+        * resume
+            The processed fast5 files are recorded in a manifest (path, size, mtime, read count) next to the output file ({seq_summary_fn}.manifest.tsv).
+            If True, files already listed in the manifest of a previous run with the same size and mtime are skipped and only the reads of
+            new files are appended to the output file. Data written after the last manifest entry, for example by a crashed run, are discarded.
+            Not available for columnar output formats
+        * scan_threads
+            Number of threads used to scan the subdirectories of fast5_dir concurrently. Files are sent to the workers as soon as they are found
+        * sort_by_size
+            If True, files are processed by decreasing size for a better load balancing between workers. The whole directory tree
+            is scanned before the first file is processed
         * verbose_level
             Level of verbosity, from 2 (Chatty) to 0 (Nothing)
         """
@@ -110,27 +177,113 @@ class Fast5_to_seq_summary ():
         logger.info ("Check input data and options")
         if not os.access(fast5_dir, os.R_OK):
             raise pycoQCError ("Cannot read the indicated fast5 directory")
-        if not os.access(os.path.dirname(seq_summary_fn), os.W_OK):
+        if seq_summary_fn and not os.access(os.path.dirname(seq_summary_fn), os.W_OK):
             raise pycoQCError ("Cannot write the indicated seq_summary_fn")
         if threads < 3:
             raise pycoQCError ("At least 3 threads required")
         for field in fields:
             if not field in self.attrs_grp_dict:
                 raise pycoQCError ("Field {} is not valid, please choose among the following valid fields: {}".format(field, ",".join(self.attrs_grp_dict.keys())))
+        output_format = self._get_output_format(seq_summary_fn)
+        if output_format != "tsv":
+            if importlib.util.find_spec("pyarrow") is None:
+                raise pycoQCError ("The pyarrow package is required to write {} files".format(output_format))
+            if resume:
+                raise pycoQCError ("Resume is only available for tsv output files")
 
         # Save self args
         self.fast5_dir = fast5_dir
         self.seq_summary_fn = seq_summary_fn
+        self.output_format = output_format
         self.threads = threads-2
         self.max_fast5 = max_fast5
         self.fields = fields
         self.basecall_id = basecall_id
         self.include_path = include_path
+        self.columns = fields+["path"] if include_path else fields
+        self.in_memory_max_size = in_memory_max_size
+        self.scan_threads = scan_threads
+        self.sort_by_size = sort_by_size
+
+        # List the attributes to read in each group. start_time also requires the channel sampling rate
+        self.grp_attrs_dict = OrderedDict()
+        for field in (fields+["channel_sampling_rate"] if "start_time" in fields else fields):
+            grp, attrs = self.attrs_grp_dict[field]["grp"], self.attrs_grp_dict[field]["attrs"]
+            self.grp_attrs_dict.setdefault(grp, [])
+            if not attrs in self.grp_attrs_dict[grp]:
+                self.grp_attrs_dict[grp].append(attrs)
+        self.write_batch_size = max(write_batch_size, 1)
         self.verbose_level = verbose_level
 
+        # Load the manifest of the previous run if resuming
+        self.manifest_fn = seq_summary_fn+MANIFEST_EXT
+        self.manifest_dict = {}
+        self.resume_offset = None
+        self.counter = OrderedDict()
+        if resume and seq_summary_fn:
+            self._load_manifest()
+
+        if seq_summary_fn:
+            self._run()
+
+    def iter_batches (self):
+        """
+        Generator running the reader and worker processes and yielding the data of each fast5 file as a tuple (file_info, batch)
+        in the calling process, as soon as the file is parsed. file_info is a list [path, size, mtime_ns] and batch
+        an OrderedDict with a list of values per field. Missing values are None
+        """
+        in_q = mp.Queue (maxsize=1000)
+        out_q = mp.Queue (maxsize=self.threads*4)
+        error_q = mp.Queue ()
+        counter_q = mp.Queue ()
+
+        ps_list = []
+        ps_list.append (mp.Process (target=self._list_fast5, args=(in_q, error_q)))
+        for i in range (self.threads):
+            ps_list.append (mp.Process (target=self._read_fast5, args=(in_q, out_q, error_q, counter_q, i)))
+
+        logger.info ("Start processing fast5 files")
+        try:
+            for ps in ps_list:
+                ps.start ()
+
+            # Collect batches until all workers are done, checking regularly for errors
+            workers_done = 0
+            while workers_done < self.threads:
+                try:
+                    item = out_q.get(timeout=0.1)
+                except queue.Empty:
+                    if not error_q.empty():
+                        raise pycoQCError(error_q.get())
+                    continue
+                if item is None:
+                    workers_done += 1
+                else:
+                    yield item
+            if not error_q.empty():
+                raise pycoQCError(error_q.get())
+
+            # Collapse data from counters comming from workers
+            for _ in range (self.threads):
+                for k, v in counter_q.get().items():
+                    self.counter.setdefault(k, Counter())
+                    self.counter[k].update(v)
+
+            for ps in ps_list:
+                ps.join ()
+
+        # Kill processes if any error or if the generator is not exhausted
+        finally:
+            for ps in ps_list:
+                if ps.is_alive():
+                    ps.terminate ()
+
+    def _run (self):
+        """Run the reader, worker and writer processes"""
         # Init Multiprocessing variables
         in_q = mp.Queue (maxsize=1000)
-        out_q = mp.Queue (maxsize=1000)
+        # Messages contain all the reads of a fast5 file, so only a few are buffered per worker
+        out_q = mp.Queue (maxsize=self.threads*4)
         error_q = mp.Queue ()
         counter_q = mp.Queue ()
 
@@ -169,16 +322,29 @@ class Fast5_to_seq_summary ():
         logger.debug ("[READER] Start listing fast5 files")
         try:
             # Load an input queue with fast5 file path
-            for i, fast5_fn in enumerate(recursive_file_gen (dir=self.fast5_dir, ext="fast5")):
-                if self.max_fast5 and i == self.max_fast5:
+            n = skipped = 0
+            for fast5_fn in recursive_file_gen (dir=self.fast5_dir, ext="fast5", threads=self.scan_threads, sort_by_size=self.sort_by_size):
+                # Skip files already processed in a previous run
+                path = os.path.abspath(fast5_fn)
+                if path in self.manifest_dict:
+                    st = os.stat(fast5_fn)
+                    if self.manifest_dict[path] == (st.st_size, st.st_mtime_ns):
+                        skipped += 1
+                        continue
+                    logger.warning ("File {} changed since the previous run. Its reads may be duplicated in the output".format(fast5_fn))
+
+                if self.max_fast5 and n == self.max_fast5:
                     break
                 in_q.put(fast5_fn)
+                n += 1
 
             # Raise error is no file found
-            if i == 0:
+            if n == 0 and skipped == 0:
                 raise pycoQCError ("No valid fast5 files found in indicated folder")
 
-            logger.debug ("[READER] Add a total of {} files to input queue".format(i+1))
+            if skipped:
+                logger.info ("Skipped {} files already processed".format(skipped))
+            logger.debug ("[READER] Add a total of {} files to input queue".format(n))
 
         # Manage exceptions and deal poison pills
         except Exception:
@@ -190,6 +356,7 @@ class Fast5_to_seq_summary ():
     def _read_fast5 (self, in_q, out_q, error_q, counter_q, worker_id):
         """
         Multi-threaded workers in charge of parsing fast5 file.
+        The reads of each file are sent to the writer in a single column oriented batch (field name > list of values)
         """
         logger.debug ("[WORKER_{:02}] Start processing fast5 files".format(worker_id))
         try:
@@ -197,15 +364,21 @@ class Fast5_to_seq_summary ():
 
             for fast5_fn in iter(in_q.get, None):
 
-                with h5py.File(fast5_fn, "r") as h5_fp:
+                st = os.stat(fast5_fn)
+                file_info = [os.path.abspath(fast5_fn), st.st_size, st.st_mtime_ns]
 
-                    multi_read = 'file_type' in h5_fp.attrs.keys() and h5_fp.attrs['file_type'] == b'multi-read'
+                with self._open_fast5(fast5_fn) as h5_fp:
+
+                    # Recent h5py versions return variable length string attributes as str
+                    multi_read = h5_fp.attrs.get('file_type') in (b'multi-read', 'multi-read')
 
                     if multi_read:
                         read_ids =  list(h5_fp["/"].keys())
                     else: 
                         read_ids = list(h5_fp["/Raw/Reads"].keys())
 
+                    batch = OrderedDict((field, []) for field in self.columns)
+                    grp_cache = {}
                     for read_id in read_ids:
                         # Try to extract data from the fast5 file
                         d = OrderedDict()
@@ -229,17 +402,18 @@ class Fast5_to_seq_summary ():
                                 "tracking_id" : "UniqueGlobalKey/tracking_id",
                                 "channel_id" : "UniqueGlobalKey/channel_id"}
 
+                        # Open each required group once and read all its required attributes
+                        attrs_d = {}
+                        for grp, attrs_list in self.grp_attrs_dict.items():
+                            attrs_d[grp] = self._get_h5_grp_attrs (fp=h5_fp, grp=grp_dict[grp], attrs_list=attrs_list, cache=grp_cache)
+
                         # Fetch required fields is available
                         for field in self.fields:
 
                             # Special case for start time
                             if field == "start_time":
-                                start_time = self._get_h5_attrs (fp=h5_fp,
-                                    grp=grp_dict[self.attrs_grp_dict["start_time"]["grp"]],
-                                    attrs=self.attrs_grp_dict["start_time"]["attrs"])
-                                sampling_rate = self._get_h5_attrs (fp=h5_fp,
-                                    grp=grp_dict[self.attrs_grp_dict["channel_sampling_rate"]["grp"]],
-                                    attrs=self.attrs_grp_dict["channel_sampling_rate"]["attrs"])
+                                start_time = attrs_d["raw_read"].get("start_time")
+                                sampling_rate = attrs_d["channel_id"].get("sampling_rate")
                                 if start_time and sampling_rate:
                                     d[field] = int(start_time/sampling_rate)
                                     c["fields_found"][field] +=1
@@ -247,8 +421,7 @@ class Fast5_to_seq_summary ():
                                     c["fields_not_found"][field] +=1
                             # Everything else
                             else:
-                                v = self._get_h5_attrs (
-                                    fp=h5_fp, grp=grp_dict[self.attrs_grp_dict[field]["grp"]], attrs=self.attrs_grp_dict[field]["attrs"])
+                                v = attrs_d[self.attrs_grp_dict[field]["grp"]].get(self.attrs_grp_dict[field]["attrs"])
                                 if v:
                                     d[field] = v
                                     c["fields_found"][field] +=1
@@ -258,13 +431,17 @@ class Fast5_to_seq_summary ():
                         if self.include_path:
                             d["path"] = os.path.abspath(fast5_fn)
 
-                        # Put read data in queue
+                        # Add read data to the file batch
                         if d:
-                            out_q.put(d)
+                            for field in self.columns:
+                                batch[field].append(d.get(field))
                             c["overall"]["valid files"] += 1
                         else:
                             c["overall"]["invalid files"] += 1
 
+                    # Put file batch in queue. Files without valid reads are also sent to be recorded in the manifest
+                    out_q.put((file_info, batch))
+
             # Put counter in counter queue
             counter_q.put(c)
 
@@ -276,24 +453,17 @@ class Fast5_to_seq_summary ():
 
     def _write_seq_summary (self, out_q, error_q, counter_q):
         """
-        Mono-threaded Worker writing the sequencing summary file
+        Mono-threaded Worker writing the sequencing summary file. Reads are written by batches as they are received
+        so that the memory usage is constant and the file only contains complete lines if the run is interrupted
         """
-        logger.debug ("[WRITER] Start collecting summary data")
+        logger.debug ("[WRITER] Start writing summary data")
 
         t = time()
         try:
-            l = []
-            with tqdm (unit=" reads", mininterval=0.1, smoothing=0.1, disable=self.verbose_level==2) as pbar:
-                # Collect line data
-                for _ in range (self.threads):
-                    for d in iter (out_q.get, None):
-                        l.append(d)
-                        pbar.update(1)
-
-            # Transform collected data to dataframe and write to file
-            logger.debug ("[WRITER] Write data to file")
-            df = pd.DataFrame(l)
-            df.to_csv(self.seq_summary_fn, sep="\t", index=False)
+            if self.output_format == "tsv":
+                n = self._write_tsv (out_q)
+            else:
+                n = self._write_columnar (out_q)
 
             # Collapse data from counters comming from workers
             logger.debug ("[WRITER] Summarize counters")
@@ -309,7 +479,7 @@ class Fast5_to_seq_summary ():
             logger.info ("fields not found {}".format(dict_to_str(c["fields_not_found"])))
 
             # Print final
-            logger.warning ("Total reads: {} / Average speed: {} reads/s\n".format(len(df), round (len(df)/(time()-t), 2)))
+            logger.warning ("Total reads: {} / Average speed: {} reads/s\n".format(n, round (n/(time()-t), 2)))
 
         # Manage exceptions and deal poison pills
         except Exception:
@@ -317,12 +487,230 @@ class Fast5_to_seq_summary ():
         finally:
             error_q.put(None)
 
+    def _write_tsv (self, out_q):
+        """Write the file batches received from the workers in a tsv file and record the processed files in the manifest"""
+        n = 0
+        mode = "wb" if self.resume_offset is None else "ab"
+        with open (self.seq_summary_fn, mode) as fp, open (self.manifest_fn, mode[0]) as manifest_fp, tqdm (unit=" reads", mininterval=0.1, smoothing=0.1, disable=self.verbose_level==2) as pbar:
+            if self.resume_offset is None:
+                self._write_lines (fp, ["\t".join(self.columns)])
+                manifest_fp.write("\t".join(MANIFEST_COLUMNS)+"\n")
+
+            # Collect file batches and write by batches of lines. Files are only recorded in the manifest once their reads are written
+            l = []
+            files_l = []
+            for _ in range (self.threads):
+                for file_info, batch in iter (out_q.get, None):
+                    columns = [[self._format_value(v) for v in batch[field]] for field in self.columns]
+                    l.extend("\t".join(row) for row in zip(*columns))
+                    files_l.append(file_info+[len(columns[0])])
+                    pbar.update(len(columns[0]))
+                    if len(l) >= self.write_batch_size:
+                        n += self._write_lines (fp, l)
+                        self._write_manifest (manifest_fp, files_l, fp.tell())
+                        l = []
+                        files_l = []
+            n += self._write_lines (fp, l)
+            self._write_manifest (manifest_fp, files_l, fp.tell())
+        return n
+
+    def _write_columnar (self, out_q):
+        """
+        Write the file batches received from the workers in a parquet or feather file with typed columns. Categorical fields are
+        dictionary encoded. Parquet row groups are written as they are received, whereas feather files only allow a single dictionary
+        per column and are written once all the reads are collected
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+
+        schema = pa.schema([(field, self._get_arrow_type(pa, FIELD_TYPES.get(field, "str"))) for field in self.columns])
+        if self.output_format == "parquet":
+            writer = pq.ParquetWriter(self.seq_summary_fn, schema)
+            flush_size = max(self.write_batch_size, COLUMNAR_MIN_BATCH_SIZE)
+        else:
+            writer = None
+            flush_size = self.write_batch_size
+
+        # Reads are converted to arrow tables by batches, which are much more compact than python lists
+        tables = []
+        n = 0
+        try:
+            with tqdm (unit=" reads", mininterval=0.1, smoothing=0.1, disable=self.verbose_level==2) as pbar:
+                buffer = OrderedDict((field, []) for field in self.columns)
+                l = 0
+                for _ in range (self.threads):
+                    for file_info, batch in iter (out_q.get, None):
+                        for field in self.columns:
+                            buffer[field].extend(batch[field])
+                        l += len(batch[self.columns[0]])
+                        pbar.update(len(batch[self.columns[0]]))
+                        if l >= flush_size:
+                            tables.append(self._batch_to_table(pa, buffer, schema))
+                            buffer = OrderedDict((field, []) for field in self.columns)
+                            l = 0
+                            if writer:
+                                n += self._write_row_group(writer, tables.pop())
+                if l or not (n or tables):
+                    tables.append(self._batch_to_table(pa, buffer, schema))
+
+                if writer:
+                    for table in tables:
+                        n += self._write_row_group(writer, table)
+                else:
+                    table = pa.concat_tables(tables).unify_dictionaries().combine_chunks()
+                    feather.write_feather(table, self.seq_summary_fn)
+                    n = table.num_rows
+        finally:
+            if writer:
+                writer.close()
+        return n
+
+    @staticmethod
+    def _write_row_group (writer, table):
+        writer.write_table(table, row_group_size=table.num_rows)
+        return table.num_rows
+
+    @staticmethod
+    def _get_arrow_type (pa, field_type):
+        if field_type == "category":
+            return pa.dictionary(pa.int32(), pa.string())
+        if field_type == "str":
+            return pa.string()
+        return pa.from_numpy_dtype(np.dtype(field_type))
+
     @staticmethod
-    def _get_h5_attrs (fp, grp, attrs):
+    def _batch_to_table (pa, batch, schema):
+        """Convert a column oriented batch of values to an arrow table. Missing values are stored as nulls"""
+        arrays = []
+        for field in schema:
+            if pa.types.is_dictionary(field.type):
+                a = pa.array(batch[field.name], type=pa.string()).dictionary_encode()
+            else:
+                # Values are first converted to their inferred type, since attributes can be stored as strings in fast5 files
+                a = pa.array(batch[field.name], from_pandas=True)
+                if pa.types.is_null(a.type):
+                    a = pa.nulls(len(a), type=field.type)
+                else:
+                    a = a.cast(field.type, safe=False)
+            arrays.append(a)
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    def _write_lines (self, fp, lines):
+        """
+        Write and flush a batch of lines. If the output file name ends with .gz, each batch is written as a
+        complete gzip member, so the concatenated members always form a valid gzip file
+        """
+        if not lines:
+            return 0
+        data = ("\n".join(lines)+"\n").encode("utf8")
+        if self.seq_summary_fn.endswith(".gz"):
+            data = gzip.compress(data, compresslevel=6)
+        fp.write(data)
+        fp.flush()
+        return len(lines)
+
+    @staticmethod
+    def _write_manifest (fp, files_l, output_offset):
+        """Record processed files with the size of the output file once their reads are written"""
+        for file_info in files_l:
+            fp.write("\t".join([str(i) for i in file_info+[output_offset]])+"\n")
+        fp.flush()
+
+    def _load_manifest (self):
+        """
+        Load the files recorded in the manifest of a previous run and truncate the output file after the reads of the last
+        recorded file, which removes data written by an interrupted run after the last manifest update
+        """
+        if not os.path.isfile(self.seq_summary_fn) or not os.path.isfile(self.manifest_fn):
+            logger.info ("No output and manifest files found from a previous run. Starting from scratch")
+            return
+
+        output_offset = 0
+        lines = []
+        with open (self.manifest_fn) as fp:
+            if fp.readline().rstrip("\n").split("\t") != MANIFEST_COLUMNS:
+                raise pycoQCError ("Invalid manifest file {}".format(self.manifest_fn))
+            for line in fp:
+                ls = line.rstrip("\n").split("\t")
+                # Ignore incomplete lines from an interrupted run
+                if not line.endswith("\n") or len(ls) != len(MANIFEST_COLUMNS):
+                    continue
+                lines.append(line)
+                self.manifest_dict[ls[0]] = (int(ls[1]), int(ls[2]))
+                output_offset = max(output_offset, int(ls[4]))
+
+        if not self.manifest_dict:
+            logger.info ("No file recorded in the manifest of the previous run. Starting from scratch")
+            return
+
+        # Verify that the output file can be extended
+        opener = gzip.open if self.seq_summary_fn.endswith(".gz") else open
+        with opener (self.seq_summary_fn, "rt") as fp:
+            if fp.readline().rstrip("\n").split("\t") != self.columns:
+                raise pycoQCError ("The fields of the existing output file are different from the requested fields. Cannot resume")
+        output_size = os.path.getsize(self.seq_summary_fn)
+        if output_size < output_offset:
+            raise pycoQCError ("The output file is shorter than recorded in the manifest. Cannot resume")
+        if output_size > output_offset:
+            logger.info ("Discarding {} bytes written after the last manifest entry".format(output_size-output_offset))
+            os.truncate(self.seq_summary_fn, output_offset)
+
+        # Rewrite the manifest without incomplete lines
+        with open (self.manifest_fn+".tmp", "w") as fp:
+            fp.write("\t".join(MANIFEST_COLUMNS)+"\n")
+            fp.writelines(lines)
+        os.replace(self.manifest_fn+".tmp", self.manifest_fn)
+        self.resume_offset = output_offset
+
+    @staticmethod
+    def _get_output_format (seq_summary_fn):
+        for ext, output_format in COLUMNAR_FORMATS.items():
+            if seq_summary_fn.endswith(ext):
+                return output_format
+        return "tsv"
+
+    @staticmethod
+    def _format_value (v):
+        if v is None:
+            return ""
+        return str(v)
+
+    def _open_fast5 (self, fast5_fn):
+        """Open a fast5 file, entirely loaded in memory with the h5py core driver if smaller than in_memory_max_size"""
+        if self.in_memory_max_size and os.path.getsize(fast5_fn) <= self.in_memory_max_size*1024*1024:
+            return h5py.File(fast5_fn, "r", driver="core", backing_store=False)
+        return h5py.File(fast5_fn, "r")
+
+    @staticmethod
+    def _get_h5_grp_attrs (fp, grp, attrs_list, cache):
+        """
+        Return a dict of the attributes of attrs_list found in grp, using the low level h5py API to limit the overhead per attribute.
+        Values are cached by group path and by object address in the file, so that groups shared by all the reads (single read files)
+        or hard linked between reads (multi-read files) are only read once
+        """
+        if grp in cache:
+            return cache[grp]
         try:
-            v = fp[grp].attrs[attrs]
-            if type(v) == np.bytes_:
+            grp_id = h5py.h5o.open(fp.id, grp.encode())
+        except KeyError:
+            cache[grp] = {}
+            return {}
+        addr = h5py.h5o.get_info(grp_id).addr
+        if addr in cache:
+            return cache[addr]
+
+        d = {}
+        for name in attrs_list:
+            try:
+                attr_id = h5py.h5a.open(grp_id, name.encode())
+            except KeyError:
+                continue
+            a = np.empty(attr_id.shape, dtype=attr_id.dtype)
+            attr_id.read(a)
+            v = a[()]
+            if type(v) in (np.bytes_, bytes):
                 v = v.decode("utf8")
-            return v
-        except KeyError :
-            return None
+            d[name] = v
+        cache[addr] = d
+        return d
@@ -12,9 +12,7 @@ from pkg_resources import resource_filename
 from jinja2 import Environment, PackageLoader, Template
 
 # Local imports
-from pycoQC.pycoQC import pycoQC
-from pycoQC.Fast5_to_seq_summary import Fast5_to_seq_summary
-from pycoQC.Barcode_split import Barcode_split
+# Main functions are imported in the entry points so that each tool only loads the modules it needs
 from pycoQC.common import get_logger
 from pycoQC import __version__ as package_version
 from pycoQC import __name__ as package_name
@@ -36,24 +34,52 @@ def main_pycoQC (args=None):
             * Including Guppy barcoding file + html output + json output
                 pycoQC -f sequencing_summary.txt -b barcoding_sequencing.txt -o pycoQC_output.html -j pycoQC_output.json
             * Including Bam file + html output
-                pycoQC -f sequencing_summary.txt -a alignment.bam -o pycoQC_output.html"""))
+                pycoQC -f sequencing_summary.txt -a alignment.bam -o pycoQC_output.html
+            * Including html output + aggregate output to regenerate the report later with pycoQC_render
+                pycoQC -f sequencing_summary.txt -o pycoQC_output.html --aggregate_outfile pycoQC_aggregate.json.gz"""))
     parser.add_argument('--version', action='version', version="{} v{}".format(package_name, package_version))
 
     # Define arguments
     parser_io = parser.add_argument_group('Input/output options')
     parser_io.add_argument("--summary_file", "-f", default=[], nargs='*',
         help=textwrap.dedent("""Path to a sequencing_summary generated by Albacore 1.0.0 + (read_fast5_basecaller.py) / Guppy 2.1.3+ (guppy_basecaller).
-            One can also pass multiple space separated file paths or a UNIX style regex matching multiple files (Required)"""))
+            One can also pass multiple space separated file paths or a UNIX style regex matching multiple files.
+            One can also pass a directory containing basecalled fast5 files to extract the data directly from the fast5 files.
+            Parquet, feather and arrow files are also supported (requires pyarrow).
+            One can also pass a column store directory written with --store_dir to reload already parsed data (Required)"""))
+    parser_io.add_argument("--fast5_threads", default=4, type=int,
+        help="Total number of processes used to extract data if summary_file is a fast5 directory. Minimum 3 (default: %(default)s)")
     parser_io.add_argument("--barcode_file", "-b", default=[], nargs='*',
         help=textwrap.dedent("""Path to the barcode_file generated by Guppy 2.1.3+ (guppy_barcoder) or Deepbinner 0.2.0+. This is not a required file.
         One can also pass multiple space separated file paths or a UNIX style regex matching multiple files (optional)"""))
     parser_io.add_argument("--bam_file", "-a", default=[], nargs='*',
-        help=textwrap.dedent("""Path to a Bam file corresponding to reads in the summary_file. Preferably aligned with Minimap2
-          One can also pass multiple space separated file paths or a UNIX style regex matching multiple files (optional)"""))
+        help=textwrap.dedent("""Path to a Bam or Cram file corresponding to reads in the summary_file. Preferably aligned with Minimap2
+          One can also pass multiple space separated file paths or a UNIX style regex matching multiple files.
+          Files do not have to be sorted or indexed. Use - to stream sam, bam or cram alignments from stdin, for example from minimap2 (optional)"""))
+    parser_io.add_argument("--bam_threads", default=4, type=int,
+        help="Number of htslib threads used to decompress the bam and cram files, limited to the number of available CPUs (default: %(default)s)")
+    parser_io.add_argument("--reference_file", default="", type=str,
+        help=textwrap.dedent("""Path to the reference fasta file used to decode cram files. If not given htslib looks for the reference as defined
+        in the cram header or with the REF_PATH and REF_CACHE environment variables (optional)"""))
     parser_io.add_argument("--html_outfile", "-o", default="", type=str,
         help="Path to an output html file report (required if json_outfile not given)")
     parser_io.add_argument("--json_outfile", "-j", default="", type=str,
         help="Path to an output json file report (required if html_outfile not given)")
+    parser_io.add_argument("--store_dir", default="", type=str,
+        help=textwrap.dedent("""Directory where to save the parsed and cleaned data as a memory-mapped column store. The store can be passed
+        as --summary_file to generate new reports without parsing the input files again (optional)"""))
+    parser_io.add_argument("--out_of_core", default=False, action='store_true',
+        help=textwrap.dedent("""Parse and clean the reads by partitions spilled to disk and memory-map the cleaned data from a column store
+        (--store_dir or a temporary directory). For datasets larger than the memory (default: %(default)s)"""))
+    parser_io.add_argument("--max_memory", default=0, type=int,
+        help=textwrap.dedent("""Memory budget in MB for the summary data. The out-of-core engine is automatically used if the estimated
+        size of the data exceeds the budget. 0 disables the automatic selection (default: %(default)s)"""))
+    parser_io.add_argument("--backend", default="pandas", type=str, choices=["pandas", "polars"],
+        help=textwrap.dedent("""Library used to parse, merge and clean the data in memory. The polars backend (requires polars and pyarrow)
+        uses lazy scans and multithreaded execution (default: %(default)s)"""))
+    parser_io.add_argument("--aggregate_outfile", default="", type=str,
+        help=textwrap.dedent("""Path to an output aggregate file containing the plot ready data of all plots (gzip compressed if the name ends with .gz).
+        Reports can be regenerated from this file with pycoQC_render without the raw input files (optional)"""))
     parser_filt = parser.add_argument_group('Filtering options')
     parser_filt.add_argument("--min_pass_qual", default=7, type=float,
         help="Minimum quality to consider a read as 'pass' (default: %(default)s)")
@@ -76,12 +102,29 @@ def main_pycoQC (args=None):
             If not provided, looks for it in ~/.pycoQC and ~/.config/pycoQC/config. If it's still not found, falls back to default parameters.
             The first level keys are the names of the plots to be included.
             The second level keys are the parameters to pass to each plotting function (default: %(default)s)")"""))
+    parser_html.add_argument("--groupby", default="", type=str, choices=["", "barcode", "run_id"],
+        help=textwrap.dedent("""Group the reads by barcode or run_id in the report. Summary tables get one row per group and plots
+        a dropdown menu giving access to each group, without re-parsing the data (default: %(default)s)"""))
     parser_html.add_argument("--skip_coverage_plot", default=False, action='store_true',
         help="Skip the coverage plot in HTML report. Useful when using a reference file containing many sequences, i.e. transcriptome (default: %(default)s)")
+    parser_html.add_argument("--compact_report", default=False, action='store_true',
+        help=textwrap.dedent("""Embed plot data as base64 encoded typed arrays with quantised 2D matrices instead of full precision JSON text.
+        Considerably reduces the size and loading time of the report (default: %(default)s)"""))
+    parser_html.add_argument("--external_plotlyjs", default=False, action='store_true',
+        help=textwrap.dedent("""Write plotly.js once as a sidecar file next to the report (or in --plotlyjs_dir) and reference it from the report.
+        Useful when writing many reports in the same directory (default: %(default)s)"""))
+    parser_html.add_argument("--plotlyjs_dir", default="", type=str,
+        help="Shared directory where to write the plotly.js sidecar file. By default the report directory is used (default: %(default)s)")
+    parser_html.add_argument("--lazy_report", default=False, action='store_true',
+        help=textwrap.dedent("""Write the data of each plot in a separate file in a `<report name>_files` directory next to the report.
+        Plots are only loaded when they scroll into view. Recommended for very large reports (default: %(default)s)"""))
     parser_other = parser.add_argument_group('Other options')
     parser_other.add_argument("--sample", default=100000, type=int,
         help=textwrap.dedent("""If not None a n number of reads will be randomly selected instead of the entire dataset for ploting function
         (deterministic sampling) (default: %(default)s)"""))
+    parser_other.add_argument("--cache_dir", default="", type=str,
+        help=textwrap.dedent("""Directory where to cache the computed figures. Subsequent runs on the same data with the same plotting
+        parameters reuse the cached figures (default: %(default)s)"""))
     parser_other.add_argument("--default_config", "-d", action='store_true',
         help="Print default configuration file. Can be used to generate a template JSON file (default: %(default)s)")
     parser_verbosity = parser.add_mutually_exclusive_group()
@@ -106,12 +149,13 @@ def main_pycoQC (args=None):
         parser.print_help()
         sys.exit()
 
-    elif not args.html_outfile and not args.json_outfile:
-        logger.warning ("ERROR: At least one output file required `--html_outfile` or `--json_outfile`")
+    elif not args.html_outfile and not args.json_outfile and not args.aggregate_outfile:
+        logger.warning ("ERROR: At least one output file required `--html_outfile`, `--json_outfile` or `--aggregate_outfile`")
         parser.print_help()
         sys.exit()
 
     # Run pycoQC
+    from pycoQC.pycoQC import pycoQC
     pycoQC (
         summary_file = args.summary_file,
         barcode_file = args.barcode_file,
@@ -119,15 +163,29 @@ def main_pycoQC (args=None):
         filter_calibration = args.filter_calibration,
         filter_duplicated = args.filter_duplicated,
         min_barcode_percent = args.min_barcode_percent,
+        fast5_threads = args.fast5_threads,
+        bam_threads = args.bam_threads,
+        reference_file = args.reference_file,
+        store_dir = args.store_dir,
+        out_of_core = args.out_of_core,
+        max_memory = args.max_memory,
+        backend = args.backend,
         min_pass_qual = args.min_pass_qual,
         min_pass_len = args.min_pass_len,
         sample = args.sample,
+        cache_dir = args.cache_dir,
+        groupby = args.groupby,
         html_outfile = args.html_outfile,
         report_title = args.report_title,
         config_file = args.config_file,
         skip_coverage_plot = args.skip_coverage_plot,
+        compact_report = args.compact_report,
+        external_plotlyjs = args.external_plotlyjs,
+        plotlyjs_dir = args.plotlyjs_dir,
+        lazy_report = args.lazy_report,
         template_file = args.template_file,
         json_outfile = args.json_outfile,
+        aggregate_outfile = args.aggregate_outfile,
         verbose = args.verbose,
         quiet = args.quiet)
 
@@ -144,7 +202,8 @@ def main_Fast5_to_seq_summary (args=None):
     parser.add_argument("--fast5_dir", "-f", required=True, type=str,
         help="""Directory containing fast5 files. Can contain multiple subdirectories""")
     parser.add_argument("--seq_summary_fn", "-s", required=True, type=str,
-        help="""path of the summary sequencing file where to write the data extracted from the fast5 files""")
+        help=textwrap.dedent("""path of the summary sequencing file where to write the data extracted from the fast5 files. The file is gzip compressed if the name ends with .gz.
+        Files ending with .parquet or .feather are written in a columnar format with typed columns (requires pyarrow)"""))
     parser.add_argument("--max_fast5", type=int, default=0,
         help="Maximum number of file to try to parse. 0 to deactivate (default: %(default)s)")
     parser.add_argument("--threads", "-t", type=int, default=4,
@@ -158,6 +217,18 @@ def main_Fast5_to_seq_summary (args=None):
         help="list of field names corresponding to attributes to try to fetch from the fast5 files (default: %(default)s)")
     parser.add_argument("--include_path", action='store_true', default=False,
         help="If given, the absolute path to the corresponding file is added in an extra column (default: %(default)s)")
+    parser.add_argument("--write_batch_size", type=int, default=1000,
+        help="Number of reads buffered before being written to the output file. Parquet row groups contain at least 65536 reads (default: %(default)s)")
+    parser.add_argument("--in_memory_max_size", type=int, default=0,
+        help="Fast5 files smaller than this size in MB are entirely loaded in memory before being parsed. 0 to deactivate (default: %(default)s)")
+    parser.add_argument("--resume", action='store_true', default=False,
+        help=textwrap.dedent("""If given, fast5 files recorded in the manifest of a previous run ({seq_summary_fn}.manifest.tsv) are skipped and the reads
+        of new files are appended to the output file. Also recovers the output of an interrupted run. Only for tsv output files (default: %(default)s)"""))
+    parser.add_argument("--scan_threads", type=int, default=4,
+        help="Number of threads used to scan the subdirectories of fast5_dir concurrently (default: %(default)s)")
+    parser.add_argument("--sort_by_size", action='store_true', default=False,
+        help=textwrap.dedent("""If given, files are processed by decreasing size for a better load balancing between workers.
+        The whole directory tree is scanned before the first file is processed (default: %(default)s)"""))
     parser.add_argument("--verbose_level", type=int, default=0,
         help="Level of verbosity, from 2 (Chatty) to 0 (Nothing) (default: %(default)s)")
 
@@ -165,6 +236,7 @@ def main_Fast5_to_seq_summary (args=None):
     args = parser.parse_args()
 
     # Run main function
+    from pycoQC.Fast5_to_seq_summary import Fast5_to_seq_summary
     Fast5_to_seq_summary (
         fast5_dir = args.fast5_dir,
         seq_summary_fn = args.seq_summary_fn,
@@ -173,6 +245,11 @@ def main_Fast5_to_seq_summary (args=None):
         basecall_id = args.basecall_id,
         fields = args.fields,
         include_path = args.include_path,
+        write_batch_size = args.write_batch_size,
+        in_memory_max_size = args.in_memory_max_size,
+        resume = args.resume,
+        scan_threads = args.scan_threads,
+        sort_by_size = args.sort_by_size,
         verbose_level = args.verbose_level)
 
 #~~~~~~~~~~~~~~Barcode_split CLI ENTRY POINT~~~~~~~~~~~~~~#
@@ -197,6 +274,16 @@ def main_Barcode_split (args=None):
         help="If given, unclassified barcodes are also written in a file. By default they are skiped")
     parser.add_argument("--min_barcode_percent", "-p", default=0.1, type=float,
         help="Minimal percent of total reads to retain barcode label. If below, the barcode value is set as `unclassified` (default: %(default)s)")
+    parser.add_argument("--chunk_size", default=200000, type=int,
+        help="Number of lines read at once from the input files. Lower values reduce the memory usage (default: %(default)s)")
+    parser.add_argument("--output_format", default="tsv", type=str, choices=["tsv", "tsv.gz", "tsv.zst", "parquet"],
+        help=textwrap.dedent("""Format of the output files. tsv.gz and tsv.zst are gzip and zstd compressed tsv files. tsv.zst requires the zstandard package
+        and parquet requires the pyarrow package (default: %(default)s)"""))
+    parser.add_argument("--output_aggregate", action='store_true', default=False,
+        help=textwrap.dedent("""If given, a partial aggregate json file with the read counts, run_ids, channels and read length / quality histograms
+        is also written for each barcode file"""))
+    parser.add_argument("--threads", "-t", default=4, type=int,
+        help="Number of threads used to format, compress and write the output files (default: %(default)s)")
     parser_verbosity = parser.add_mutually_exclusive_group()
     parser_verbosity.add_argument("-v", "--verbose", action="store_true", default=False, help="Increase verbosity")
     parser_verbosity.add_argument("-q", "--quiet", action="store_true", default=False, help="Reduce verbosity")
@@ -205,11 +292,96 @@ def main_Barcode_split (args=None):
     args = parser.parse_args()
 
     # Run main function
+    from pycoQC.Barcode_split import Barcode_split
     Barcode_split (
         summary_file=args.summary_file,
         barcode_file=args.barcode_file,
         output_dir=args.output_dir,
         output_unclassified=args.output_unclassified,
         min_barcode_percent=args.min_barcode_percent,
+        chunk_size=args.chunk_size,
+        output_format=args.output_format,
+        output_aggregate=args.output_aggregate,
+        threads=args.threads,
         verbose=args.verbose,
         quiet=args.quiet)
+
+#~~~~~~~~~~~~~~pycoQC_render CLI ENTRY POINT~~~~~~~~~~~~~~#
+def main_pycoQC_render (args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    # Define parser object
+    parser = argparse.ArgumentParser(
+        formatter_class = argparse.RawDescriptionHelpFormatter,
+        description = textwrap.dedent("""
+            pycoQC_render regenerates pycoQC reports from an aggregate file saved by pycoQC (--aggregate_outfile),
+            without the raw summary, barcode and bam files\n
+            * Minimal usage
+                pycoQC_render -a pycoQC_aggregate.json.gz -o pycoQC_output.html"""))
+    parser.add_argument('--version', action='version', version="{} v{}".format(package_name, package_version))
+
+    # Define arguments
+    parser_io = parser.add_argument_group('Input/output options')
+    parser_io.add_argument("--aggregate_file", "-a", required=True, type=str,
+        help="Path to an aggregate file generated by pycoQC with --aggregate_outfile (required)")
+    parser_io.add_argument("--html_outfile", "-o", default="", type=str,
+        help="Path to an output html file report (required if json_outfile not given)")
+    parser_io.add_argument("--json_outfile", "-j", default="", type=str,
+        help="Path to an output json file report (required if html_outfile not given)")
+    parser_html = parser.add_argument_group('HTML report options')
+    parser_html.add_argument("--report_title", default="PycoQC report", type=str,
+        help="Title to use in the html report (default: %(default)s)")
+    parser_html.add_argument("--template_file", type=str, default="",
+        help="Jinja2 html template for the html report (default: %(default)s)")
+    parser_html.add_argument("--config_file", type=str, default="",
+        help=textwrap.dedent("""Path to a JSON configuration file for the html report. Defines the plots to include, their order and their parameters.
+            The parameters defining which data are saved (groupby, pass_threshold_sweep thresholds, time_bins of the over time plots
+            and of channels_activity) cannot be changed from the aggregate file (default: %(default)s)"""))
+    parser_html.add_argument("--skip_coverage_plot", default=False, action='store_true',
+        help="Skip the coverage plot in HTML report (default: %(default)s)")
+    parser_html.add_argument("--compact_report", default=False, action='store_true',
+        help="Embed plot data as base64 encoded typed arrays with quantised 2D matrices instead of full precision JSON text (default: %(default)s)")
+    parser_html.add_argument("--external_plotlyjs", default=False, action='store_true',
+        help="Write plotly.js once as a sidecar file next to the report (or in --plotlyjs_dir) and reference it from the report (default: %(default)s)")
+    parser_html.add_argument("--plotlyjs_dir", default="", type=str,
+        help="Shared directory where to write the plotly.js sidecar file. By default the report directory is used (default: %(default)s)")
+    parser_html.add_argument("--lazy_report", default=False, action='store_true',
+        help="Write the data of each plot in a separate file loaded when the plot scrolls into view (default: %(default)s)")
+    parser_verbosity = parser.add_mutually_exclusive_group()
+    parser_verbosity.add_argument("-v", "--verbose", action="store_true", default=False, help="Increase verbosity")
+    parser_verbosity.add_argument("-q", "--quiet", action="store_true", default=False, help="Reduce verbosity")
+
+    # Try to parse arguments
+    args = parser.parse_args()
+
+    # Set logging level
+    logger = get_logger (name=__name__, verbose=args.verbose, quiet=args.quiet)
+
+    if not args.html_outfile and not args.json_outfile:
+        logger.warning ("ERROR: At least one output file required `--html_outfile` or `--json_outfile`")
+        parser.print_help()
+        sys.exit()
+
+    # Run pycoQC_render
+    from pycoQC.pycoQC_render import pycoQC_render
+    renderer = pycoQC_render (
+        aggregate_file = args.aggregate_file,
+        verbose = args.verbose,
+        quiet = args.quiet)
+
+    if args.html_outfile:
+        renderer.html_report(
+            outfile = args.html_outfile,
+            config_file = args.config_file,
+            template_file = args.template_file,
+            report_title = args.report_title,
+            skip_coverage_plot = args.skip_coverage_plot,
+            compact = args.compact_report,
+            external_plotlyjs = args.external_plotlyjs,
+            plotlyjs_dir = args.plotlyjs_dir,
+            lazy = args.lazy_report)
+
+    if args.json_outfile:
+        renderer.json_report(
+            outfile = args.json_outfile)
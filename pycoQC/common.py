@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 
 # Standard library imports
-from os import access, R_OK, listdir, path, makedirs
+from os import access, R_OK, listdir, path, makedirs, scandir
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import inspect
-from glob import iglob, glob
+from glob import glob
 import sys
 import logging
 from collections import *
 
 # Third party imports
-import pandas as pd
-import pysam as ps
+# pandas and pysam imports are deferred to the functions requiring them to keep light modules (pycoQC_render) free of them
+import numpy as np
 
 #~~~~~~~~~~~~~~CUSTOM EXCEPTION AND WARN CLASSES~~~~~~~~~~~~~~#
 class pycoQCError (Exception):
@@ -60,6 +61,7 @@ def sequencing_summary_file_sample (infile, outfile=None, n_seq=10000):
     * n_seq: STR (default 10000)
         Overall number of sequence lines to sample
     """
+    import pandas as pd
     df = pd.read_csv(infile, sep ="\t")
     df.dropna (inplace=True)
     total = len(df)
@@ -96,25 +98,62 @@ def dict_to_str (c, prefix="\t", suffix="\n"):
             m += "{}{}: {}{}".format(prefix, i, j, suffix)
     return m
 
-def recursive_file_gen (dir, ext):
+def recursive_file_gen (dir, ext, threads=1, sort_by_size=False):
     """
     create a generator listing all files with a particular extension in a folder arborescence
     The recursivity is broken when at least 1 file with a particular extenssion is found.
+    * threads
+        Number of threads scanning subdirectories concurrently. Files are yielded as soon as their directory is scanned
+    * sort_by_size
+        Yield files by decreasing size. All the directories have to be scanned before the first file is yielded
     """
     # In the case where the folder is a file
-    if path.isdir(dir):
-
-        # If matching files in the folder
-        file_found=False
-        for fn in iglob (path.join(dir, "*."+ext)):
-            yield fn
-            file_found=True
-
-        # If no matching file go deeper until a leaf containing fast5 is found
-        if not file_found:
-            for item in listdir(dir):
-                for fn in recursive_file_gen (path.join(dir, item), ext):
-                    yield fn
+    if not path.isdir(dir):
+        return
+
+    file_gen = _scan_dir_tree (dir, ext, threads, with_size=sort_by_size)
+    if sort_by_size:
+        file_gen = sorted(file_gen, key=lambda x: x[1], reverse=True)
+    for fn, size in file_gen:
+        yield fn
+
+def _scan_dir_tree (dir, ext, threads=1, with_size=False):
+    """Generate (path, size) of matching files, scanning directories depth first or concurrently with a thread pool"""
+    if threads <= 1:
+        dir_stack = [dir]
+        while dir_stack:
+            files, subdirs = _scan_dir (dir_stack.pop(), ext, with_size)
+            yield from files
+            dir_stack.extend(reversed(subdirs))
+        return
+
+    executor = ThreadPoolExecutor(max_workers=threads)
+    pending = {executor.submit(_scan_dir, dir, ext, with_size)}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for subdir in subdirs:
+                    pending.add(executor.submit(_scan_dir, subdir, ext, with_size))
+                yield from files
+    # Cancel the remaining scans if the generator is not exhausted
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+def _scan_dir (dir, ext, with_size=False):
+    """Return the (path, size) of the matching files of a directory, or its subdirectories if none is found"""
+    files = []
+    subdirs = []
+    with scandir(dir) as it:
+        for entry in sorted(it, key=lambda x: x.name):
+            if entry.name.endswith("."+ext) and not entry.name.startswith(".") and entry.is_file():
+                files.append((entry.path, entry.stat().st_size if with_size else 0))
+            elif entry.is_dir():
+                subdirs.append(entry.path)
+    return (files, []) if files else (files, subdirs)
 
 def get_logger (name=None, verbose=False, quiet=False):
     """Set logger to appropriate log level"""
@@ -314,51 +353,320 @@ def ls (dir_path):
         print(f)
 
 def expand_file_names(fn, bam_check=False):
-    """"""
+    """
+    Expand a file path, a UNIX style regex or a list of them into a list of readable files
+    * bam_check
+        Verify that the files are valid alignment files (bam, cram or sam, sorted or not, with or without index).
+        "-" is also accepted to stream alignments from stdin
+    """
+    import pysam as ps
+
+    def _glob (f):
+        return ["-"] if bam_check and f == "-" else glob(f)
+
     # Try to expand file name to list
     if isinstance(fn, list):
         if len(fn) ==1:
-            fn_list=glob(fn[0])
+            fn_list=_glob(fn[0])
         else:
             fn_list = []
             for f in fn:
-                fn_list.extend(glob(f))
+                fn_list.extend(_glob(f))
     elif isinstance(fn, str):
-        fn_list=glob(fn)
+        fn_list=_glob(fn)
     else:
         raise pycoQCError ("{} has to be either a file or a regular expression or a list of files".format(fn))
 
     # Verify that files are readable
     if not fn_list:
         raise pycoQCError("No files found in {}".format(fn))
+    if fn_list.count("-") > 1:
+        raise pycoQCError("stdin (-) can only be given once")
     for f in fn_list:
+        # stdin cannot be checked without consuming the stream
+        if bam_check and f == "-":
+            continue
         if not is_readable_file (f):
             raise pycoQCError("Cannot read file {}".format(f))
-        # Extra checks for bam files
+        # Extra checks for alignment files. The index and the sort order are not required as the files are read linearly
         if bam_check:
-            with ps.AlignmentFile(f, "rb") as bam:
-                if not bam.has_index():
-                    raise pycoQCError("No index found for bam file: {}. Please index with samtools index".format(f))
-                if not bam.header['HD']['SO'] == 'coordinate':
-                    raise pycoQCError("Bam file not sorted: {}. Please sort with samtools sort".format(f))
+            # pysam always tries to load the index of cram files, htslib errors are silenced for unindexed files
+            verbosity = ps.set_verbosity(0)
+            try:
+                with ps.AlignmentFile(f, "r"):
+                    pass
+            except (ValueError, OSError) as E:
+                raise pycoQCError("Cannot read alignment file {}: {}".format(f, E))
+            finally:
+                ps.set_verbosity(verbosity)
     return fn_list
 
-def merge_files_to_df(fn_list):
-    """"""
-    if len(fn_list) == 1:
-        df =  pd.read_csv(fn_list[0], sep ="\t")
+# Magic bytes at the start of the columnar file formats. Arrow IPC files are also feather (v2) files
+COLUMNAR_MAGIC = [(b"PAR1", "parquet"), (b"ARROW1", "feather"), (b"FEA1", "feather"), (b"\xff\xff\xff\xff", "arrow")]
 
+def get_file_format (fn):
+    """
+    Return the format of a tabular file detected from its first bytes, whatever its extension: parquet, feather (Feather or Arrow IPC file),
+    arrow (Arrow IPC stream) or text for tab separated files, possibly compressed
+    """
+    with open(fn, "rb") as fp:
+        head = fp.read(8)
+    for magic, file_format in COLUMNAR_MAGIC:
+        if head.startswith(magic):
+            return file_format
+    return "text"
+
+def get_file_columns (fn):
+    """Return the list of columns of a tabular file without reading the data"""
+    file_format = get_file_format(fn)
+    if file_format == "text":
+        import pandas as pd
+        return list(pd.read_csv(fn, sep="\t", nrows=0).columns)
+    return _get_columnar_schema(fn, file_format).names
+
+def count_file_rows (fn):
+    """Return the number of rows of a parquet, feather or arrow file. Parquet and Arrow IPC files are counted from their metadata"""
+    file_format = get_file_format(fn)
+    _import_pyarrow(fn)
+    import pyarrow.dataset as ds
+
+    if file_format == "parquet" or (file_format == "feather" and _is_arrow_file(fn)):
+        return ds.dataset(fn, format="parquet" if file_format == "parquet" else "ipc").count_rows()
+    return read_columnar_file(fn)[0].num_rows
+
+def read_columnar_file (fn, columns=None, filters=None, discard=None, counter=None):
+    """
+    Read a parquet, feather or arrow file in a pyarrow Table. Return a tuple (table, number of rows before filtering)
+    * fn
+        Path to the file
+    * columns
+        If given, only read the columns of the list found in the file
+    * filters
+        List of (column, op, value) tuples combined with AND, with the ops of pyarrow.parquet.read_table (=, !=, <, >, <=, >=, in, not in).
+        Filters on columns missing from the file are ignored. For parquet files, row groups are skipped based on their statistics and
+        only the selected rows are decoded
+    * discard
+        Function called with the schema of the file and returning an OrderedDict of (name, pyarrow dataset expression) selecting rows to
+        discard. The rows matching any of the expressions are filtered out while reading. The expressions must only use the selected
+        columns and never evaluate to null
+    * counter
+        If given, the number of rows matching each discard expression is added to counter[name]
+    """
+    file_format = get_file_format(fn)
+    pa = _import_pyarrow(fn)
+    import pyarrow.dataset as ds
+
+    schema = _get_columnar_schema(fn, file_format)
+    if columns is not None:
+        columns = [i for i in columns if i in schema.names]
+    filters = [f for f in filters if f[0] in schema.names] if filters else []
+    expr = _filters_to_expression(filters) if filters else None
+    discard_d = discard(schema) if discard else {}
+    for discard_expr in discard_d.values():
+        expr = ~discard_expr if expr is None else expr & ~discard_expr
+
+    # Parquet and Arrow IPC files can be scanned as datasets, with column projection and filter pushdown
+    if file_format == "parquet" or (file_format == "feather" and _is_arrow_file(fn)):
+        dataset = ds.dataset(fn, format="parquet" if file_format == "parquet" else "ipc")
+        count_rows = lambda e: dataset.count_rows(filter=e)
+        table = dataset.to_table(columns=columns, filter=expr)
+        n = dataset.count_rows() if expr is not None else table.num_rows
+    else:
+        if file_format == "feather":
+            import pyarrow.feather as feather
+            table = feather.read_table(fn, columns=columns, memory_map=True)
+        else:
+            with pa.ipc.open_stream(fn) as reader:
+                table = reader.read_all()
+            if columns is not None:
+                table = table.select(columns)
+        count_rows = lambda e: table.filter(e).num_rows
+        n = table.num_rows
+        if expr is not None:
+            table = table.filter(expr)
+
+    if counter is not None:
+        for name, discard_expr in discard_d.items():
+            counter[name] = counter.get(name, 0)+count_rows(discard_expr)
+    return table, n
+
+def iter_columnar_file (fn, columns=None, batch_size=100000):
+    """
+    Read a parquet, feather or arrow file by batches and yield a pyarrow Table per batch
+    * fn
+        Path to the file
+    * columns
+        If given, only read the columns of the list found in the file
+    * batch_size
+        Maximal number of rows per batch
+    """
+    file_format = get_file_format(fn)
+    pa = _import_pyarrow(fn)
+    import pyarrow.dataset as ds
+
+    schema = _get_columnar_schema(fn, file_format)
+    if columns is not None:
+        columns = [i for i in columns if i in schema.names]
+
+    if file_format == "parquet" or (file_format == "feather" and _is_arrow_file(fn)):
+        dataset = ds.dataset(fn, format="parquet" if file_format == "parquet" else "ipc")
+        for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+            if batch.num_rows:
+                yield pa.Table.from_batches([batch])
+    else:
+        table, n = read_columnar_file(fn, columns=columns)
+        for i in range(0, table.num_rows, batch_size):
+            yield table.slice(i, batch_size)
+
+def columnar_to_df (table):
+    """
+    Convert a pyarrow Table to a pandas DataFrame with strings stored as objects as for text files. String columns with repeated
+    values, such as run_id or barcode, are dictionary encoded before the conversion so that each distinct value is only
+    converted once, whereas unique values such as read_id are converted directly without the cost of looking for duplicates
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            sample = table.column(i).slice(0, 10000)
+            if pc.count_distinct(sample).as_py() < len(sample)/2:
+                table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+
+    df = table.to_pandas(deduplicate_objects=False)
+    for col in df.select_dtypes("category"):
+        df[col] = df[col].astype(object)
+    return df
+
+def merge_files_to_df(fn_list, columns=None, discard=None, counter=None):
+    """
+    Read and concatenate tabular files. The format of each file is detected with get_file_format. Tab separated text files
+    are parsed with pandas whereas parquet, feather and arrow files are read natively with their column types
+    * fn_list
+        List of file paths
+    * columns
+        If given, only read the columns of the list found in columnar files
+    * discard
+        Function returning the expressions of the rows to discard while reading columnar files (see read_columnar_file).
+        Text files are not filtered
+    * counter
+        If given, the number of rows read from the files is added to counter["Initial reads"] and the number of rows discarded
+        by each discard expression to counter[name]
+    """
+    import pandas as pd
+
+    df_list = []
+    n_initial = 0
+    for fn in fn_list:
+        if get_file_format(fn) == "text":
+            df = pd.read_csv(fn, sep ="\t")
+            n_initial += len(df)
+        else:
+            table, n = read_columnar_file(fn, columns=columns, discard=discard, counter=counter)
+            df = columnar_to_df(table)
+            n_initial += n
+        df_list.append (df)
+
+    if len(df_list) == 1:
+        df = df_list[0]
     else:
-        df_list = []
-        for fn in fn_list:
-            df_list.append (pd.read_csv(fn, sep ="\t"))
         df = pd.concat(df_list, ignore_index=True, sort=False, join="inner")
 
+    if counter is not None:
+        counter["Initial reads"] = counter.get("Initial reads", 0)+n_initial
+
     if len(df) == 0:
         raise pycoQCError ("No valid read found in input file")
 
     return df
 
+def _import_pyarrow (fn):
+    try:
+        import pyarrow
+    except ImportError:
+        raise pycoQCError ("The pyarrow package is required to read file {}".format(fn))
+    return pyarrow
+
+def _is_arrow_file (fn):
+    """Feather v1 files start with FEA1 and cannot be scanned as Arrow IPC files"""
+    with open(fn, "rb") as fp:
+        return fp.read(6) == b"ARROW1"
+
+def _get_columnar_schema (fn, file_format):
+    """Read the schema of a columnar file from its metadata"""
+    pa = _import_pyarrow(fn)
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_schema(fn)
+    if file_format == "feather" and _is_arrow_file(fn):
+        with pa.ipc.open_file(fn) as reader:
+            return reader.schema
+    if file_format == "feather":
+        import pyarrow.feather as feather
+        return feather.read_table(fn, memory_map=True).schema
+    with pa.ipc.open_stream(fn) as reader:
+        return reader.schema
+
+def _filters_to_expression (filters):
+    """Convert a list of (column, op, value) tuples into a pyarrow dataset expression combining them with AND"""
+    import pyarrow.dataset as ds
+    expr = None
+    for col, op, val in filters:
+        field = ds.field(col)
+        if op in ("=", "=="):
+            e = field == val
+        elif op == "!=":
+            e = field != val
+        elif op == "<":
+            e = field < val
+        elif op == ">":
+            e = field > val
+        elif op == "<=":
+            e = field <= val
+        elif op == ">=":
+            e = field >= val
+        elif op == "in":
+            e = field.isin(val)
+        elif op == "not in":
+            e = ~field.isin(val)
+        else:
+            raise pycoQCError ("Invalid filter operator {}".format(op))
+        expr = e if expr is None else expr & e
+    return expr
+
+def hash_read_ids (read_ids):
+    """
+    Return a stable 64 bits hash for each read_id. Hashes only depend on the read_id values, so they are identical
+    across runs, file chunks and processes
+    * read_ids
+        Iterable of read_id strings
+    """
+    import pandas as pd
+    return pd.util.hash_array(np.asarray(read_ids, dtype=object))
+
+def hash_sample_index (hashes, n):
+    """
+    Return the sorted positions of the n reads with the smallest hashes (bottom-k sampling). The bottom-k of
+    the concatenated bottom-k of several chunks is the bottom-k of the whole dataset
+    * hashes
+        Array of read_id hashes generated with hash_read_ids
+    * n
+        Number of reads to select
+    """
+    if n >= len(hashes):
+        return np.arange(len(hashes))
+    if n <= 0:
+        return np.array([], dtype=np.int64)
+    return np.sort(np.argpartition(hashes, n-1)[:n])
+
+def available_cpus ():
+    """Return the number of CPUs the current process is allowed to run on"""
+    import os
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
 def mkdir (fn, exist_ok=False):
     """ Create directory recursivelly. Raise IO error if path exist or if error at creation """
     try:
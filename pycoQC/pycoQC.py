@@ -29,28 +29,46 @@ def pycoQC (
     filter_calibration:bool=False,
     filter_duplicated:bool=False,
     min_barcode_percent:float=0.1,
+    fast5_threads:int=4,
+    bam_threads:int=4,
+    reference_file:str="",
+    store_dir:str="",
+    out_of_core:bool=False,
+    max_memory:int=0,
+    backend:str="pandas",
     min_pass_qual:float=7,
     min_pass_len:int=0,
     sample:int=100000,
+    cache_dir:str="",
+    groupby:str="",
     html_outfile:str="",
     report_title:str="PycoQC report",
     config_file:str="",
     template_file:str="",
     json_outfile:str="",
+    aggregate_outfile:str="",
     skip_coverage_plot:bool=False,
+    compact_report:bool=False,
+    external_plotlyjs:bool=False,
+    plotlyjs_dir:str="",
+    lazy_report:bool=False,
     verbose:bool=False,
     quiet:bool=False):
     """
     Parse Albacore sequencing_summary.txt file and clean-up the data
     * summary_file
         Path to a sequencing_summary generated by Albacore 1.0.0 + (read_fast5_basecaller.py) / Guppy 2.1.3+ (guppy_basecaller).
-        One can also pass multiple space separated file paths or a UNIX style regex matching multiple files
+        One can also pass multiple space separated file paths or a UNIX style regex matching multiple files.
+        One can also pass a directory containing basecalled fast5 files to extract the data directly from the fast5 files.
+        Parquet, feather and arrow files are also supported (requires pyarrow)
     * barcode_file
         Path to the barcode_file generated by Guppy 2.1.3+ (guppy_barcoder) or Deepbinner 0.2.0+. This is not a required file.
         One can also pass multiple space separated file paths or a UNIX style regex matching multiple files
     * bam_file
-        Path to a Bam file corresponding to reads in the summary_file. Preferably aligned with Minimap2
-        One can also pass multiple space separated file paths or a UNIX style regex matching multiple files
+        Path to a Bam or Cram file corresponding to reads in the summary_file. Preferably aligned with Minimap2
+        One can also pass multiple space separated file paths or a UNIX style regex matching multiple files.
+        Files do not have to be sorted or indexed. Sam, bam or cram alignments can also be streamed on stdin by passing "-",
+        for example from minimap2
     * runid_list
         Select only specific runids to be analysed. Can also be used to force pycoQC to order the runids for
         temporal plots, if the sequencing_summary file contain several sucessive runs. By default pycoQC analyses
@@ -61,12 +79,35 @@ def pycoQC (
         If True duplicated read_ids are removed but the first occurence is kept (Guppy sometimes outputs the same read multiple times)
     * min_barcode_percent
         Minimal percent of total reads to retain barcode label. If below the barcode value is set as `unclassified`.
+    * fast5_threads
+        Total number of processes used to extract data if summary_file is a fast5 directory. Minimum 3
+    * bam_threads
+        Number of htslib threads used to decompress the bam and cram files, limited to the number of available CPUs
+    * reference_file
+        Path to the reference fasta file used to decode cram files. If not given htslib looks for the reference as defined in
+        the cram header or with the REF_PATH and REF_CACHE environment variables
+    * store_dir
+        Directory where to save the parsed and cleaned data as a memory-mapped column store. The store can then be passed as summary_file
+        to generate new reports without parsing the input files again
+    * out_of_core
+        If True the reads are parsed and cleaned by partitions spilled to disk and the cleaned data are memory-mapped from a column store
+        (store_dir or a temporary directory), so that datasets larger than the memory can be analysed
+    * max_memory
+        Memory budget in MB for the summary data. The out-of-core engine is used if the estimated size of the data exceeds the budget.
+        0 disables the automatic selection
+    * backend
+        Library used to parse, merge and clean the data in memory: pandas or polars. The polars backend (requires polars and pyarrow)
+        uses lazy scans and multithreaded execution
     * min_pass_qual
         Minimum quality to consider a read as 'pass'
     * min_pass_len
         Minimum read length to consider a read as 'pass'
     * sample
         If not None a n number of reads will be randomly selected instead of the entire dataset for ploting function (deterministic sampling)
+    * cache_dir
+        Directory where to cache the computed figures. Subsequent runs on the same data with the same plotting parameters reuse the cached figures
+    * groupby
+        Field to group the reads by in the report (barcode or run_id). Summary tables get one row per group and plots a dropdown menu per group
     * html_outfile
         Path to an output html file report
     * report_title
@@ -80,6 +121,19 @@ def pycoQC (
         Jinja2 html template for the html report
     * json_outfile
         Path to an output json file report
+    * aggregate_outfile
+        Path to an output aggregate file containing the plot ready data of all plots (gzip compressed if the name ends with .gz).
+        The html and json reports can be regenerated from this file with pycoQC_render without the raw input files
+    * skip_coverage_plot
+        Skip the coverage plot in HTML report. Useful when using a reference file containing many sequences, i.e. transcriptome
+    * compact_report
+        If True the plot data of the html report are embedded as compact base64 encoded arrays instead of full precision JSON text
+    * external_plotlyjs
+        If True plotly.js is written once as a sidecar file next to the html report (or in plotlyjs_dir) and referenced from the report
+    * plotlyjs_dir
+        Shared directory where to write the plotly.js sidecar file. By default the file is written in the html report directory
+    * lazy_report
+        If True the data of each plot are written in separate files next to the html report and only loaded when the plot scrolls into view
     * verbose
         Increase verbosity
     * quiet
@@ -99,16 +153,30 @@ def pycoQC (
     filter_calibration = check_arg("filter_calibration", filter_calibration, required_type=bool, allow_none=False)
     filter_duplicated = check_arg("filter_duplicated", filter_duplicated, required_type=bool, allow_none=False)
     min_barcode_percent = check_arg("min_barcode_percent", min_barcode_percent, required_type=float, min=0, max=100, allow_none=False)
+    fast5_threads = check_arg("fast5_threads", fast5_threads, required_type=int, min=3, allow_none=False)
+    bam_threads = check_arg("bam_threads", bam_threads, required_type=int, min=1, allow_none=False)
+    reference_file = check_arg("reference_file", reference_file, required_type=str, allow_none=True)
+    store_dir = check_arg("store_dir", store_dir, required_type=str, allow_none=True)
+    out_of_core = check_arg("out_of_core", out_of_core, required_type=bool, allow_none=False)
+    max_memory = check_arg("max_memory", max_memory, required_type=int, min=0, allow_none=False)
+    backend = check_arg("backend", backend, required_type=str, allow_none=False, choices=["pandas", "polars"])
     min_pass_qual = check_arg("min_pass_qual", min_pass_qual, required_type=float, min=0, max=60, allow_none=False)
     min_pass_len = check_arg("min_pass_len", min_pass_len, required_type=int, min=0, allow_none=False)
     sample = check_arg("sample", sample, required_type=int, min=0, allow_none=True)
+    cache_dir = check_arg("cache_dir", cache_dir, required_type=str, allow_none=True)
+    groupby = check_arg("groupby", groupby, required_type=str, allow_none=True, choices=["", "barcode", "run_id"])
     html_outfile = check_arg("html_outfile", html_outfile, required_type=str, allow_none=True)
     html_outfile = check_arg("html_outfile", html_outfile, required_type=str, allow_none=True)
     report_title = check_arg("report_title", report_title, required_type=str, allow_none=True)
     config_file = check_arg("config_file", config_file, required_type=str, allow_none=True)
     template_file = check_arg("template_file", template_file, required_type=str, allow_none=True)
     json_outfile = check_arg("json_outfile", json_outfile, required_type=str, allow_none=True)
+    aggregate_outfile = check_arg("aggregate_outfile", aggregate_outfile, required_type=str, allow_none=True)
     skip_coverage_plot = check_arg("skip_coverage_plot", skip_coverage_plot, required_type=bool, allow_none=False)
+    compact_report = check_arg("compact_report", compact_report, required_type=bool, allow_none=False)
+    external_plotlyjs = check_arg("external_plotlyjs", external_plotlyjs, required_type=bool, allow_none=False)
+    plotlyjs_dir = check_arg("plotlyjs_dir", plotlyjs_dir, required_type=str, allow_none=True)
+    lazy_report = check_arg("lazy_report", lazy_report, required_type=bool, allow_none=False)
 
     # Print debug info
     logger.debug("General info")
@@ -125,18 +193,29 @@ def pycoQC (
         filter_calibration=filter_calibration,
         filter_duplicated=filter_duplicated,
         min_barcode_percent=min_barcode_percent,
+        fast5_threads=fast5_threads,
+        bam_threads=bam_threads,
+        reference_file=reference_file,
+        out_of_core=out_of_core,
+        max_memory=max_memory,
+        store_dir=store_dir,
+        backend=backend,
         verbose=verbose,
         quiet=quiet)
 
     logger.debug("Parser stats")
     logger.debug(parser)
 
+    if store_dir and not parser.store_dir:
+        parser.save_store(store_dir)
+
     #~~~~~~~~~~pycoQC_plot~~~~~~~~~~#
     plotter = pycoQC_plot(
         parser=parser,
         min_pass_qual=min_pass_qual,
         min_pass_len=min_pass_len,
         sample=sample,
+        cache_dir=cache_dir,
         verbose=verbose,
         quiet=quiet)
 
@@ -144,10 +223,11 @@ def pycoQC (
     logger.debug(plotter)
 
     #~~~~~~~~~~pycoQC_report~~~~~~~~~~#
-    if html_outfile or json_outfile:
+    if html_outfile or json_outfile or aggregate_outfile:
         reporter = pycoQC_report (
             parser=parser,
             plotter=plotter,
+            groupby=groupby,
             verbose=verbose,
             quiet=quiet)
 
@@ -157,12 +237,23 @@ def pycoQC (
                 config_file=config_file,
                 template_file=template_file,
                 report_title=report_title,
-                skip_coverage_plot=skip_coverage_plot)
+                skip_coverage_plot=skip_coverage_plot,
+                compact=compact_report,
+                external_plotlyjs=external_plotlyjs,
+                plotlyjs_dir=plotlyjs_dir,
+                lazy=lazy_report)
 
         # Run json output function
         if json_outfile:
             reporter.json_report(
                 outfile=json_outfile)
 
+        # Run aggregate output function. The plots already computed for the html report are reused
+        if aggregate_outfile:
+            reporter.aggregate_report(
+                outfile=aggregate_outfile,
+                config_file=config_file,
+                skip_coverage_plot=skip_coverage_plot)
+
     #~~~~~~~~~~return plotting object for API~~~~~~~~~~#
     return plotter
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+# Standard library imports
+from collections import *
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+# Local lib import
+from pycoQC.common import *
+from pycoQC import __version__ as package_version
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~GLOBAL SETTINGS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+# Extension of the cache files written in the disk tier
+CACHE_EXT = ".pkl"
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~MAIN CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class pycoQC_cache ():
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~INIT METHOD~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    def __init__ (self,
+        max_items:int=32,
+        cache_dir:str="",
+        max_disk_size:int=512,
+        verbose:bool=False,
+        quiet:bool=False):
+        """
+        Two tier memo cache for computed values. Values are stored pickled so that each lookup returns an independent copy.
+        * max_items
+            Maximal number of values kept in memory. The least recently used values are dropped first. 0 disables the memory tier
+        * cache_dir
+            Directory where to persist the values on disk. The disk tier is disabled if not given.
+            Cache files are trusted pickles, so the directory should not be writable by other users
+        * max_disk_size
+            Maximal size of the disk tier in MB. The least recently used files are removed first
+        """
+        # Set logging level
+        self.logger = get_logger (name=__name__, verbose=verbose, quiet=quiet)
+
+        # Save args to self values
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_disk_size = max_disk_size*1024*1024
+
+        # Init memory tier and counters
+        self._memory = OrderedDict()
+        self.counter = OrderedDict([("memory hits", 0), ("disk hits", 0), ("misses", 0)])
+
+        if self.cache_dir:
+            mkdir(self.cache_dir, exist_ok=True)
+
+    def __str__(self):
+        m = "Memory values: {:,}/{:,}\n".format(len(self._memory), self.max_items)
+        if self.cache_dir:
+            m += "Disk directory: {}\n".format(self.cache_dir)
+        m += dict_to_str(self.counter)
+        return m
+
+    def __repr__(self):
+        return "[{}]\n".format(self.__class__.__name__)
+
+    def __len__(self):
+        return len(self._memory)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PUBLIC METHODS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    @staticmethod
+    def make_key (*parts):
+        """
+        Build a cache key from json serialisable parts. The package version is included so that values computed
+        by a different version are never reused
+        * parts
+            Values identifying the cached value, for example a data fingerprint, a method name and its arguments
+        """
+        s = json.dumps([package_version]+list(parts), sort_keys=True, default=repr)
+        return hashlib.sha1(s.encode()).hexdigest()
+
+    def get (self, key, default=None):
+        """
+        Return a copy of the value corresponding to key or default if the key is not in the cache
+        * key
+            Key generated with make_key
+        * default
+            Value to return for missing keys
+        """
+        # Memory tier
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.counter["memory hits"] += 1
+            return pickle.loads(self._memory[key])
+
+        # Disk tier
+        if self.cache_dir:
+            fn = self._key_fn(key)
+            try:
+                with open(fn, "rb") as fp:
+                    data = fp.read()
+                value = pickle.loads(data)
+            except FileNotFoundError:
+                pass
+            except Exception as E:
+                self.logger.debug("\t\tIgnoring unreadable cache file {}: {}".format(fn, E))
+            else:
+                # Touch the file to keep track of the last access for eviction
+                os.utime(fn)
+                self._memory_set(key, data)
+                self.counter["disk hits"] += 1
+                return value
+
+        self.counter["misses"] += 1
+        return default
+
+    def set (self, key, value):
+        """
+        Store a copy of value in the cache
+        * key
+            Key generated with make_key
+        * value
+            Any picklable value
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._memory_set(key, data)
+
+        if self.cache_dir:
+            fn = self._key_fn(key)
+            # Write in a unique temporary file first to be safe with concurrent processes and threads sharing the directory
+            tmp_fn = None
+            try:
+                tmp_fd, tmp_fn = tempfile.mkstemp(dir=self.cache_dir, prefix=key, suffix=".tmp")
+                with os.fdopen(tmp_fd, "wb") as fp:
+                    fp.write(data)
+                os.replace(tmp_fn, fn)
+            except OSError as E:
+                self.logger.debug("\t\tCannot write cache file {}: {}".format(fn, E))
+            finally:
+                if tmp_fn and os.path.isfile(tmp_fn):
+                    os.remove(tmp_fn)
+            self._evict_disk()
+
+    def clear (self, disk:bool=False):
+        """
+        Remove all the values from the memory tier
+        * disk
+            Also remove the cache files from the disk tier
+        """
+        self._memory.clear()
+        if disk and self.cache_dir:
+            for fn, size, mtime in self._disk_files():
+                os.remove(fn)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PRIVATE METHODS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    def _key_fn (self, key):
+        return os.path.join(self.cache_dir, key+CACHE_EXT)
+
+    def _memory_set (self, key, data):
+        """Add pickled data to the memory tier and drop the least recently used values"""
+        if self.max_items <= 0:
+            return
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _disk_files (self):
+        """List (path, size, mtime) of the cache files in the disk tier"""
+        l = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(CACHE_EXT) and entry.is_file():
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    l.append((entry.path, st.st_size, st.st_mtime))
+        return l
+
+    def _evict_disk (self):
+        """Remove the least recently used files until the disk tier fits in max_disk_size"""
+        files = self._disk_files()
+        total_size = sum(size for fn, size, mtime in files)
+        for fn, size, mtime in sorted(files, key=lambda x: x[2]):
+            if total_size <= self.max_disk_size:
+                break
+            self.logger.debug("\t\tRemoving cache file {}".format(fn))
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -5,6 +5,14 @@
 # Standard library imports
 from collections import *
 import warnings
+import logging
+import os
+import json
+import shutil
+import tempfile
+import weakref
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 
 # Third party imports
 import numpy as np
@@ -13,12 +21,47 @@ import pysam as ps
 
 # Local lib import
 from pycoQC.common import *
+from pycoQC import __version__ as package_version
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~GLOBAL SETTINGS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
 # Silence futurewarnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+# Metadata file identifying a column store directory written by save_store
+STORE_META_FN = "pycoQC_store.json"
+STORE_VERSION = 1
+
+# Maximal number of reads per partition of the out-of-core engine
+PARTITION_SIZE = 250000
+
+# Number of reads read to estimate the memory footprint of the summary files and compression ratio assumed for compressed text files
+SIZE_SAMPLE_READS = 10000
+TEXT_COMPRESSION_RATIO = 4
+COMPRESSED_EXT = (".gz", ".bz2", ".xz", ".zip", ".zst")
+
+# Sequencing summary columns renamed to the pycoQC names
+SUMMARY_RENAME_COLNAMES = {
+    "sequence_length_template":"read_len",
+    "sequence_length_2d":"read_len",
+    "sequence_length":"read_len",
+    "mean_qscore_template":"mean_qscore",
+    "mean_qscore_2d":"mean_qscore",
+    "calibration_strand_genome_template":"calibration",
+    "barcode_arrangement":"barcode"}
+SUMMARY_REQUIRED_COLNAMES = ["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore"]
+SUMMARY_OPTIONAL_COLNAMES = ["calibration", "barcode"]
+CALIBRATION_KEEP_VALUES = ["filtered_out", "no_match", "*"]
+
+# htslib fields decoded from CRAM files (QNAME, FLAG, RNAME, POS, MAPQ, CIGAR and AUX). SEQ is only added if the NM tag is not stored, as
+# NM and MD are then computed from the sequence. Number of alignments read to check the presence of the NM tag
+CRAM_REQUIRED_FIELDS = 0x83F
+CRAM_SEQ_FIELD = 0x200
+CRAM_NM_CHECK_READS = 1000
+
+# Alignment stats collected for each primary alignment
+BAM_READ_STATS_COLNAMES = ["ref_id", "ref_start", "ref_end", "align_len", "mapq", "insertion", "deletion", "soft_clip", "mismatch", "identity_freq"]
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~MAIN CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class pycoQC_parse ():
 
@@ -32,19 +75,33 @@ class pycoQC_parse ():
         filter_duplicated:bool=False,
         min_barcode_percent:float=0.1,
         cleanup:bool=True,
+        fast5_threads:int=4,
+        bam_threads:int=4,
+        reference_file:str="",
+        out_of_core:bool=False,
+        max_memory:int=0,
+        store_dir:str="",
+        backend:str="pandas",
         verbose:bool=False,
         quiet:bool=False):
         """
         Parse Albacore sequencing_summary.txt file and clean-up the data
         * summary_file
             Path to the sequencing_summary generated by Albacore 1.0.0 + (read_fast5_basecaller.py) / Guppy 2.1.3+ (guppy_basecaller).
-            One can also pass multiple space separated file paths or a UNIX style regex matching multiple files
+            One can also pass multiple space separated file paths or a UNIX style regex matching multiple files.
+            One can also pass a directory containing basecalled fast5 files. The summary data are then extracted directly
+            from the fast5 files, as with Fast5_to_seq_summary, without writing an intermediate file.
+            One can also pass a column store directory written by save_store to reload already parsed and cleaned data.
+            Parquet, feather and arrow files are detected from their content and read natively, with only the required columns. Zero length
+            reads and reads excluded by runid_list are then filtered out while reading
         * barcode_file
             Path to the barcode_file generated by Guppy 2.1.3+ (guppy_barcoder) or Deepbinner 0.2.0+. This is not a required file.
             One can also pass multiple space separated file paths or a UNIX style regex matching multiple files
         * bam_file
-            Path to a Bam file corresponding to reads in the summary_file. Preferably aligned with Minimap2
-            One can also pass multiple space separated file paths or a UNIX style regex matching multiple files
+            Path to a Bam or Cram file corresponding to reads in the summary_file. Preferably aligned with Minimap2
+            One can also pass multiple space separated file paths or a UNIX style regex matching multiple files.
+            Files do not have to be sorted or indexed. Sam, bam or cram alignments can also be streamed on stdin by passing "-",
+            for example from minimap2
         * runid_list
             Select only specific runids to be analysed. Can also be used to force pycoQC to order the runids for
             temporal plots, if the sequencing_summary file contain several sucessive runs. By default pycoQC analyses
@@ -55,6 +112,27 @@ class pycoQC_parse ():
             If True duplicated read_ids are removed but the first occurence is kept (Guppy sometimes outputs the same read multiple times)
         * min_barcode_percent
             Minimal percent of total reads to retain barcode label. If below the barcode value is set as `unclassified`.
+        * fast5_threads
+            Total number of processes used to extract data if summary_file is a fast5 directory. Minimum 3
+        * bam_threads
+            Number of htslib threads used to decompress the bam and cram files, limited to the number of available CPUs
+        * reference_file
+            Path to the reference fasta file used to decode cram files. If not given htslib looks for the reference as defined in
+            the cram header or with the REF_PATH and REF_CACHE environment variables
+        * out_of_core
+            If True the reads are parsed and cleaned by partitions of at most 250,000 reads, which are spilled to disk. Only the per partition
+            partial results (read_id hashes, run time ranges, barcode counts) are combined in memory, and the cleaned data are written in a
+            column store which is memory-mapped as in load_store. The reads are then indexed by position and not sorted by start_time
+        * max_memory
+            Memory budget in MB for the summary data. If the size of the data estimated from the number of rows and a sample of reads exceeds
+            the budget the out-of-core engine is used. 0 disables the automatic selection
+        * store_dir
+            Directory where the out-of-core engine writes the column store. A temporary directory removed with the object is used by default
+        * backend
+            Library used to parse, merge and clean the data in memory: pandas or polars. The polars backend (requires polars and pyarrow)
+            scans the files lazily with only the required columns, joins the barcode and alignment data and cleans the reads with multithreaded
+            execution. The cleaned data are then converted to the same pandas DataFrame as with the pandas backend. Not used by the out-of-core
+            engine
         """
 
         # Set logging level
@@ -66,17 +144,40 @@ class pycoQC_parse ():
         self.filter_duplicated = filter_duplicated
         self.min_barcode_percent = min_barcode_percent
         self.cleanup = cleanup
-
-        # Init object counter
+        self.fast5_threads = fast5_threads
+        self.bam_threads = bam_threads
+        self.reference_file = reference_file
+        self.backend = backend
+        if not backend in ("pandas", "polars"):
+            raise pycoQCError ("Invalid backend {}. Valid backends are pandas and polars".format(backend))
+
+        # Init object counter and counter of the reads discarded while reading columnar files
         self.counter = OrderedDict()
+        self._read_discard_counter = OrderedDict()
 
         # Check input files
         self.logger.warning ("Check input data files")
 
+        # Reload previously parsed data from a column store
+        self.store_dir = self._get_store_dir(summary_file)
+        if self.store_dir:
+            self.logger.debug ("\t\tColumn store found: {}".format(self.store_dir))
+            if barcode_file or bam_file:
+                raise pycoQCError ("A column store already contains the barcode and alignment data. barcode_file and bam_file cannot be used")
+            self.logger.warning ("Load column store")
+            self._load_store(self.store_dir)
+            return
+
         # Expand file names and test readability
-        self.summary_files_list = expand_file_names(summary_file)
-        self.logger.debug ("\t\tSequencing summary files found: {}".format(" ".join(self.summary_files_list)))
-        self.counter["Summary files found"] = len(self.summary_files_list)
+        self.read_id_hash = None
+        self.fast5_dir = self._get_fast5_dir(summary_file)
+        if self.fast5_dir:
+            self.logger.debug ("\t\tFast5 directory found: {}".format(self.fast5_dir))
+            self.summary_files_list = []
+        else:
+            self.summary_files_list = expand_file_names(summary_file)
+            self.logger.debug ("\t\tSequencing summary files found: {}".format(" ".join(self.summary_files_list)))
+            self.counter["Summary files found"] = len(self.summary_files_list)
 
         if barcode_file:
             self.barcode_files_list = expand_file_names(barcode_file)
@@ -92,10 +193,38 @@ class pycoQC_parse ():
         else:
             self.bam_file_list =[]
 
+        # Parse and clean the data by partitions if requested or if the data would not fit in the memory budget
+        if self.cleanup and not out_of_core and max_memory:
+            size = self._estimate_summary_size()
+            self.logger.debug ("\t\tEstimated size of the summary data: {:,.0f} MB".format(size/1024/1024))
+            out_of_core = size > max_memory*1024*1024
+        if out_of_core:
+            if not self.cleanup:
+                raise pycoQCError ("The out-of-core engine always cleans the data. It cannot be used with cleanup=False")
+            self.logger.warning ("Parse and clean data files by partitions")
+            self._parse_out_of_core(store_dir)
+            return
+
+        if self.backend == "polars" and self.cleanup:
+            self.logger.warning ("Parse, merge and clean data files with polars")
+            self.reads_df = self._parse_polars()
+            return
+
+        # With several CPUs the bam files are parsed in a separate process and the barcode files in a thread while the summary files are parsed
         self.logger.warning ("Parse data files")
-        summary_reads_df = self._parse_summary()
-        barcode_reads_df = self._parse_barcode()
-        bam_reads_df, self.alignments_df, self.ref_len_dict = self._parse_bam()
+        if available_cpus() > 1:
+            bam_future = self._parse_bam_async()
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                barcode_future = executor.submit(self._parse_barcode)
+                summary_reads_df = self._parse_summary()
+                barcode_reads_df = barcode_future.result()
+            bam_reads_df, self.alignments_df, self.ref_len_dict = bam_future.result()
+            if "Reads with barcodes" in self.counter:
+                self.counter.move_to_end("Reads with barcodes")
+        else:
+            summary_reads_df = self._parse_summary()
+            barcode_reads_df = self._parse_barcode()
+            bam_reads_df, self.alignments_df, self.ref_len_dict = self._parse_bam()
 
         self.logger.warning ("Merge data")
         self.reads_df = self._merge_reads_df(summary_reads_df, barcode_reads_df, bam_reads_df)
@@ -111,47 +240,902 @@ class pycoQC_parse ():
     def __repr__(self):
         return "[{}]\n".format(self.__class__.__name__)
 
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PUBLIC METHODS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    def save_store (self, store_dir:str):
+        """
+        Save the parsed data in a column store directory, with one memory-mappable .npy file per column. String columns are saved as
+        integer codes with their categories in the metadata file and read_ids as fixed width bytes along with their hashes.
+        The store can be reopened almost instantly with load_store or by passing it as summary_file
+        * store_dir
+            Path of the directory where to save the store. An existing store in the directory is replaced
+        """
+        self.logger.warning ("Save column store")
+        mkdir(store_dir, exist_ok=True)
+
+        # The metadata file is written last so that an interrupted save never leaves a loadable store
+        meta_fn = os.path.join(store_dir, STORE_META_FN)
+        if os.path.isfile(meta_fn):
+            os.remove(meta_fn)
+
+        meta = OrderedDict()
+        meta["package_version"] = package_version
+        meta["store_version"] = STORE_VERSION
+        meta["counter"] = OrderedDict((k, int(v)) for k, v in self.counter.items())
+        meta["ref_len_dict"] = OrderedDict((k, int(v)) for k, v in self.ref_len_dict.items())
+        meta["tables"] = OrderedDict()
+        meta["tables"]["reads_df"] = self._save_table(self.reads_df, store_dir, "reads_df", read_id_hash=self.read_id_hash)
+        if not self.alignments_df.empty:
+            meta["tables"]["alignments_df"] = self._save_table(self.alignments_df, store_dir, "alignments_df")
+
+        with open (meta_fn+".tmp", "w") as fp:
+            json.dump(meta, fp, indent=2)
+        os.replace(meta_fn+".tmp", meta_fn)
+        self.logger.info ("\t{:,} reads saved in {}".format(len(self.reads_df), store_dir))
+
+    @classmethod
+    def load_store (cls,
+        store_dir:str,
+        read_ids:bool=True,
+        verbose:bool=False,
+        quiet:bool=False):
+        """
+        Create a pycoQC_parse object from a column store directory written by save_store, without parsing or cleaning the data.
+        Numeric columns are memory-mapped read-only, so the data are only read from the disk when used and the pages are shared
+        between all the processes opening the same store
+        * store_dir
+            Path of the column store directory
+        * read_ids
+            If False the read_id index is not loaded and the reads are indexed by position. This avoids creating a python string per read,
+            which is the only part of the loading time that depends on the number of reads. The sampling of pycoQC_plot still uses the
+            saved read_id hashes, so the same reads are sampled
+        """
+        self = cls.__new__(cls)
+        self.logger = get_logger(name=__name__, verbose=verbose, quiet=quiet)
+        self.store_dir = cls._get_store_dir(store_dir)
+        if not self.store_dir:
+            raise pycoQCError ("{} is not a valid column store directory".format(store_dir))
+        self._load_store(self.store_dir, read_ids=read_ids)
+        return self
+
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PRIVATE METHODS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 
     def _parse_summary (self):
         """"""
-        self.logger.debug ("\tParse summary files")
-        df = merge_files_to_df (self.summary_files_list)
+        rename_colmanes = SUMMARY_RENAME_COLNAMES
+        required_colnames = SUMMARY_REQUIRED_COLNAMES
+        optional_colnames = SUMMARY_OPTIONAL_COLNAMES
+
+        if self.fast5_dir:
+            df = self._parse_fast5()
+            n = len(df)
+        else:
+            self.logger.debug ("\tParse summary files")
+            # Only the used columns are read from columnar files and the zero length and excluded run_id reads are discarded while reading.
+            # They are counted separately and added to the counters of the cleanup step
+            columns = discard = None
+            if self.cleanup:
+                columns = list(rename_colmanes.keys())+required_colnames+optional_colnames
+                discard = self._summary_discard_expressions
+            c = OrderedDict()
+            df = merge_files_to_df (self.summary_files_list, columns=columns, discard=discard, counter=c)
+            n = c.pop("Initial reads")
+            self._read_discard_counter = c
 
         if self.cleanup:
             # Standardise col names for all types of files
             self.logger.debug ("\tRename summary sequencing columns")
-            rename_colmanes = {
-                "sequence_length_template":"read_len",
-                "sequence_length_2d":"read_len",
-                "sequence_length":"read_len",
-                "mean_qscore_template":"mean_qscore",
-                "mean_qscore_2d":"mean_qscore",
-                "calibration_strand_genome_template":"calibration",
-                "barcode_arrangement":"barcode"}
             df = df.rename(columns=rename_colmanes)
 
             # Verify the required and optional columns, Drop unused fields
             self.logger.debug ("\tVerifying fields and discarding unused columns")
             df = self._select_df_columns (
                 df = df,
-                required_colnames = ["read_id", "run_id", "channel", "start_time", "read_len", "mean_qscore"],
-                optional_colnames = ["calibration", "barcode"])
+                required_colnames = required_colnames,
+                optional_colnames = optional_colnames)
 
         # Collect stats
-        n = len(df)
         self.logger.debug ("\t\t{:,} reads found in initial file".format(n))
         self.counter["Initial reads"] = n
+        for name, n_discarded in self._read_discard_counter.items():
+            self.logger.debug ("\t\t{}: {:,} while reading".format(name, n_discarded))
+
+        return df
+
+    def _summary_discard_expressions (self, schema):
+        """
+        Return the expressions selecting the zero length reads and the reads excluded by runid_list in a columnar summary file. They only
+        select reads that the cleanup step would discard for the same reason, in the same order: reads with NA values or calibration reads
+        are kept to be counted by the cleanup step
+        """
+        import pyarrow.dataset as ds
+
+        # Original column names of each required field. Nothing is discarded while reading if a field is missing or ambiguous
+        fields = OrderedDict()
+        for colname in SUMMARY_REQUIRED_COLNAMES+SUMMARY_OPTIONAL_COLNAMES:
+            names = [i for i in schema.names if SUMMARY_RENAME_COLNAMES.get(i, i) == colname]
+            if len(names) > 1 or (not names and colname in SUMMARY_REQUIRED_COLNAMES):
+                return OrderedDict()
+            if names:
+                fields[colname] = ds.field(names[0])
+
+        discard_d = OrderedDict()
+        valid = ~functools.reduce(lambda a, b: a|b, [fields[i].is_null() for i in SUMMARY_REQUIRED_COLNAMES])
+        discard_d["Zero length reads discarded"] = valid & ~(fields["read_len"] > 0)
+
+        # The run_id selection is done after the removal of duplicated reads and of calibration reads
+        if self.runid_list and not self.filter_duplicated:
+            expr = valid & (fields["read_len"] > 0) & ~fields["run_id"].isin(self.runid_list)
+            if self.filter_calibration and "calibration" in fields:
+                expr = expr & fields["calibration"].isin(CALIBRATION_KEEP_VALUES)
+            discard_d["Excluded runid reads discarded"] = expr
+        return discard_d
+
+    def _parse_fast5 (self):
+        """Extract the summary data from fast5 files and build a dataframe from the batches of reads sent by the workers"""
+        df_list = list(self._iter_fast5_dfs())
+        if not df_list:
+            raise pycoQCError ("No valid read found in fast5 files")
+        return pd.concat(df_list, ignore_index=True, sort=False)
+
+    def _iter_fast5_dfs (self):
+        """Yield a dataframe per batch of reads extracted from the fast5 files"""
+        # Imported here as the module changes the environment and the logging settings
+        from pycoQC.Fast5_to_seq_summary import Fast5_to_seq_summary
+
+        self.logger.debug ("\tExtract summary data from fast5 files")
+        f2s = Fast5_to_seq_summary (
+            fast5_dir = self.fast5_dir,
+            seq_summary_fn = "",
+            threads = self.fast5_threads,
+            verbose_level = 2 if self.logger.level == logging.DEBUG else 0)
+
+        # Convert batches to dataframes as they are received, to overlap parsing with the extraction
+        n_files = 0
+        for file_info, batch in f2s.iter_batches():
+            n_files += 1
+            if batch["read_id"]:
+                batch_df = pd.DataFrame(batch)
+                for col in batch_df:
+                    if not col in ("read_id", "run_id", "calibration_strand_genome_template", "barcode_arrangement"):
+                        batch_df[col] = pd.to_numeric(batch_df[col], errors="coerce")
+                yield batch_df
+        self.counter["Fast5 files found"] = n_files
+
+    def _parse_polars (self):
+        """
+        Parse, merge and clean the data with polars and return the cleaned reads in a pandas DataFrame indexed by read_id. The files are
+        scanned lazily with only the required columns and the joins with the barcode and alignment data are executed in a single
+        multithreaded query. The cleanup steps are the same as in _clean_reads_df
+        """
+        # The bam files are parsed in a separate process started before the polars thread pool
+        bam_future = self._parse_bam_async()
+        pl = self._import_polars()
+
+        self.logger.debug ("\tScan summary files")
+        lf = self._scan_summary_polars(pl)
+
+        n_barcodes = None
+        if self.barcode_files_list:
+            self.logger.debug ("\tScan barcode files")
+            barcode_df = self._scan_barcode_polars(pl).collect()
+            n_barcodes = barcode_df.filter(pl.col("barcode").ne_missing("unclassified")).height
+            lf = lf.join(barcode_df.lazy(), on="read_id", how="left").with_columns(pl.col("barcode").fill_null("unclassified"))
+
+        bam_reads_df, self.alignments_df, self.ref_len_dict = bam_future.result()
+        if not bam_reads_df.empty:
+            lf = lf.join(pl.from_pandas(bam_reads_df).lazy(), on="read_id", how="left")
+
+        self.logger.debug ("\tCollect merged data")
+        df = lf.collect()
+        self.logger.debug ("\t\t{:,} reads found in initial file".format(len(df)))
+        self.counter["Initial reads"] = len(df)
+        if n_barcodes is not None:
+            self.logger.debug ("\t\t{:,} reads with barcodes assigned".format(n_barcodes))
+            self.counter["Reads with barcodes"] = n_barcodes
+
+        # Optional columns without any value are ignored
+        for col in SUMMARY_OPTIONAL_COLNAMES:
+            if col in df.columns and df[col].null_count() == len(df):
+                df = df.drop(col)
+
+        # Row filters
+        filters = [
+            ("\tDiscarding lines containing NA values", None, "Reads with NA values discarded", "No valid read left after NA values filtering"),
+            ("\tFiltering out zero length reads", pl.col("read_len") > 0, "Zero length reads discarded", "No valid read left after zero_len filtering")]
+        if self.filter_duplicated:
+            filters.append(("\tFiltering out duplicated reads", pl.col("read_id").is_first_distinct(), "Duplicated reads discarded",
+                "No valid read left after calibration strand filtering"))
+        if self.filter_calibration and "calibration" in df.columns:
+            filters.append(("\tFiltering out calibration strand reads", pl.col("calibration").is_in(CALIBRATION_KEEP_VALUES),
+                "Calibration reads discarded", "No valid read left after calibration strand filtering"))
+        if self.runid_list:
+            filters.append(("\tSelecting run_ids passed by user", pl.col("run_id").is_in(self.runid_list),
+                "Excluded runid reads discarded", "No valid read left after run ID filtering"))
+
+        for msg, expr, counter_key, error_msg in filters:
+            self.logger.info (msg)
+            l = len(df)
+            df = df.drop_nulls(subset=SUMMARY_REQUIRED_COLNAMES) if expr is None else df.filter(expr)
+            n = l-len(df)
+            self.logger.info ("\t\t{:,} reads discarded".format(n))
+            self.counter[counter_key] = n
+            if len(df) <= 1:
+                raise pycoQCError(error_msg)
+
+        # Order the run_ids as given by the user or by decreasing throughput
+        run_stats = df.group_by("run_id").agg(
+            pl.col("start_time").count().alias("count"),
+            pl.col("start_time").min().alias("min"),
+            pl.col("start_time").max().alias("max"))
+        run_stats = OrderedDict((run_id, (count, min_val, max_val)) for run_id, count, min_val, max_val in sorted(run_stats.rows()))
+        if self.runid_list:
+            runid_list = [runid for runid in self.runid_list if runid in run_stats]
+        else:
+            self.logger.info ("\tSorting run IDs by decreasing throughput")
+            d = OrderedDict()
+            for run_id, (count, min_val, max_val) in run_stats.items():
+                d[run_id] = count/(max_val-min_val) if max_val > min_val else np.inf
+            runid_list = [i for i, j in sorted (d.items(), key=lambda t: t[1], reverse=True)]
+            self.logger.info ("\t\tRun-id order {}".format(runid_list))
+
+        self.logger.info ("\tReordering runids")
+        increment_time = 0
+        offset_expr = pl.lit(0.0)
+        for runid in runid_list:
+            self.logger.info ("\t\tProcessing reads with Run_ID {} / time offset: {}".format(runid, increment_time))
+            offset_expr = pl.when(pl.col("run_id") == runid).then(pl.lit(float(increment_time))).otherwise(offset_expr)
+            increment_time += run_stats[runid][2]+1
+        df = df.with_columns(pl.col("start_time")+offset_expr).sort("start_time")
+
+        #  Unset low frequency barcodes
+        if "barcode" in df.columns and self.min_barcode_percent:
+            self.logger.info ("\tCleaning up low frequency barcodes")
+            barcode_counts = df.filter(pl.col("barcode") != "unclassified").group_by("barcode").agg(pl.col("barcode").count().alias("count"))
+            cutoff = int(barcode_counts["count"].sum()*self.min_barcode_percent/100)
+            low_barcode = barcode_counts.filter(pl.col("count") < cutoff)
+            n = int(low_barcode["count"].sum())
+            if n:
+                df = df.with_columns(pl.when(pl.col("barcode").is_in(low_barcode["barcode"].to_list())).then(pl.lit("unclassified")).otherwise(pl.col("barcode")).alias("barcode"))
+            self.logger.info ("\t\t{:,} reads with low frequency barcode unset".format(n))
+            self.counter["Reads with low frequency barcode unset"] = n
+
+        # Cast values to required types
+        self.logger.info ("\tCast value to appropriate type")
+        df = df.with_columns(
+            pl.col("channel").cast(pl.UInt16),
+            pl.col("start_time").cast(pl.Float32),
+            pl.col("read_len").cast(pl.UInt32),
+            pl.col("mean_qscore").cast(pl.Float32))
+
+        self.logger.info ("\tConverting to pandas dataframe indexed by read_ids")
+        df = df.to_pandas().set_index("read_id")
+        self.logger.info ("\t\t{:,} Final valid reads".format(len(df)))
+
+        self.counter["Valid reads"] = len(df)
+        if len(df) < 500:
+            self.logger.warning ("WARNING: Low number of reads found. This is likely to lead to errors when trying to generate plots")
+
+        return df
+
+    def _scan_summary_polars (self, pl):
+        """Return a polars LazyFrame of the summary data with the pycoQC column names and types. Missing numeric values are set to null"""
+        numeric_colnames = ["channel", "start_time", "read_len", "mean_qscore"]
+        optional_colnames = SUMMARY_OPTIONAL_COLNAMES if not self.barcode_files_list else ["calibration"]
+
+        if self.fast5_dir:
+            fn_list = [self._parse_fast5()]
+        else:
+            fn_list = self.summary_files_list
+
+        # Only the columns found in all the files are used
+        columns = list(SUMMARY_RENAME_COLNAMES.keys())+SUMMARY_REQUIRED_COLNAMES+SUMMARY_OPTIONAL_COLNAMES
+        for fn in fn_list:
+            fn_columns = list(fn.columns) if isinstance(fn, pd.DataFrame) else get_file_columns(fn)
+            columns = [col for col in columns if col in fn_columns]
+
+        rename_d = {col:new_col for col, new_col in SUMMARY_RENAME_COLNAMES.items() if col in columns}
+        final_columns = [SUMMARY_RENAME_COLNAMES.get(col, col) for col in columns]
+        for col in SUMMARY_REQUIRED_COLNAMES:
+            if not col in final_columns:
+                raise pycoQCError("Column {} not found in the provided sequence_summary file".format(col))
+        final_columns = SUMMARY_REQUIRED_COLNAMES+[col for col in optional_colnames if col in final_columns]
+        dtypes = {col:pl.Float64 if rename_d.get(col, col) in numeric_colnames else pl.Utf8 for col in columns}
+
+        lf_list = []
+        for fn in fn_list:
+            lf = self._scan_file_polars(pl, fn, dtypes)
+            lf = lf.rename(rename_d).select(final_columns)
+            lf = lf.with_columns([pl.col(col).fill_nan(None) for col in numeric_colnames])
+            lf_list.append(lf)
+        return lf_list[0] if len(lf_list) == 1 else pl.concat(lf_list, how="vertical")
+
+    def _scan_barcode_polars (self, pl):
+        """Return a polars LazyFrame of the Guppy or Deepbinner barcode files with read_id and barcode columns"""
+        lf_list = []
+        for fn in self.barcode_files_list:
+            header = get_file_columns(fn)
+            if "read_id" in header and "barcode_arrangement" in header:
+                lf = self._scan_file_polars(pl, fn, {"read_id":pl.Utf8, "barcode_arrangement":pl.Utf8})
+                lf = lf.rename({"barcode_arrangement":"barcode"})
+            elif "read_ID" in header and "barcode_call" in header:
+                lf = self._scan_file_polars(pl, fn, {"read_ID":pl.Utf8, "barcode_call":pl.Utf8})
+                lf = lf.rename({"read_ID":"read_id", "barcode_call":"barcode"})
+                lf = lf.with_columns(pl.when(pl.col("barcode") == "none").then(pl.lit("unclassified")).otherwise(pl.col("barcode")).alias("barcode"))
+            else:
+                raise pycoQCError ("File {} does not contain required barcode information".format(fn))
+            lf_list.append(lf)
+        return lf_list[0] if len(lf_list) == 1 else pl.concat(lf_list, how="vertical")
+
+    @staticmethod
+    def _scan_file_polars (pl, fn, dtypes):
+        """
+        Return a polars LazyFrame of the columns of a tabular file or pandas DataFrame cast to dtypes (dict of column name and polars type).
+        Uncompressed text and parquet files are scanned lazily, gzip and zstd compressed text files are decompressed and parsed by polars,
+        other compressed text files by pandas
+        """
+        columns = list(dtypes.keys())
+        if isinstance(fn, pd.DataFrame):
+            lf = pl.from_pandas(fn[columns]).lazy()
+        else:
+            file_format = get_file_format(fn)
+            if file_format == "parquet":
+                lf = pl.scan_parquet(fn)
+            elif file_format != "text":
+                lf = pl.from_arrow(read_columnar_file(fn, columns=columns)[0]).lazy()
+            elif fn.endswith((".gz", ".zst")):
+                lf = pl.read_csv(fn, separator="\t", columns=columns, schema_overrides=dtypes).lazy()
+            elif fn.endswith(COMPRESSED_EXT):
+                lf = pl.from_pandas(pd.read_csv(fn, sep="\t", usecols=columns)).lazy()
+            else:
+                lf = pl.scan_csv(fn, separator="\t", schema_overrides=dtypes)
+        return lf.select([pl.col(col).cast(dtype) for col, dtype in dtypes.items()])
+
+    @staticmethod
+    def _import_polars ():
+        try:
+            import polars
+        except ImportError:
+            raise pycoQCError ("The polars package is required to use the polars backend")
+        return polars
+
+    def _estimate_summary_size (self):
+        """
+        Estimate the memory used by the summary data once loaded in a DataFrame, from the number of rows of the files and the memory used
+        by a sample of reads. The number of rows of text files is estimated from their size. Fast5 directories are not estimated
+        """
+        size = 0
+        for fn in self.summary_files_list:
+            if get_file_format(fn) == "text":
+                sample_df = pd.read_csv(fn, sep="\t", nrows=SIZE_SAMPLE_READS)
+                line_size = len(sample_df.to_csv(sep="\t", index=False, header=False))/max(len(sample_df), 1)
+                file_size = os.path.getsize(fn)
+                if fn.endswith(COMPRESSED_EXT):
+                    file_size *= TEXT_COMPRESSION_RATIO
+                n = file_size/line_size
+            else:
+                sample_df = columnar_to_df(next(iter_columnar_file(fn, batch_size=SIZE_SAMPLE_READS)))
+                n = count_file_rows(fn)
+            size += n*sample_df.memory_usage(deep=True, index=False).sum()/max(len(sample_df), 1)
+        return size
+
+    def _parse_out_of_core (self, store_dir=""):
+        """
+        Parse and clean the summary, barcode and bam data by partitions and write the cleaned reads in a column store. Each partition is
+        renamed, filtered (NA values and zero length reads), merged with the barcode and alignment data through read_id hash indexes and
+        spilled to disk with the strings encoded as category codes. The filters and transformations depending on all the reads are then
+        computed from partial results combined across partitions, and applied while the partitions are compacted in the store
+        """
+        if store_dir:
+            mkdir(store_dir, exist_ok=True)
+            # Remove the metadata file first so that an interrupted run never leaves a loadable store
+            meta_fn = os.path.join(store_dir, STORE_META_FN)
+            if os.path.isfile(meta_fn):
+                os.remove(meta_fn)
+        else:
+            store_dir = tempfile.mkdtemp(prefix="pycoQC_store_")
+            weakref.finalize(self, shutil.rmtree, store_dir, True)
+
+        spill_dir = tempfile.mkdtemp(prefix="partitions_", dir=store_dir)
+        try:
+            # Index of the barcode and alignment data by read_id hash
+            barcode_index = self._barcode_hash_index()
+            bam_index = self._bam_hash_index()
+
+            # Parse, filter and spill partitions
+            self.logger.debug ("\tParse summary data by partitions")
+            labels = OrderedDict((col, OrderedDict()) for col in ["run_id", "calibration", "barcode", "ref_id"])
+            if barcode_index:
+                labels["barcode"] = OrderedDict((label, i) for i, label in enumerate(barcode_index[2]))
+            n_initial = n_na = n_zero = 0
+            partitions = []
+            for df in self._iter_summary_partitions():
+                n_initial += len(df)
+                valid = df[SUMMARY_REQUIRED_COLNAMES].notnull().all(axis=1).values
+                n_na += len(df)-valid.sum()
+                df = df[valid]
+                valid = (df["read_len"] > 0).values
+                n_zero += len(df)-valid.sum()
+                df = df[valid]
+                if len(df):
+                    part = self._partition_arrays(df, labels, barcode_index, bam_index)
+                    partitions.append(self._spill_partition(part, spill_dir, len(partitions)))
+
+            self.logger.debug ("\t\t{:,} reads found in initial file".format(n_initial))
+            self.counter["Initial reads"] = n_initial
+            if barcode_index:
+                hashes, codes, barcode_labels = barcode_index
+                n = int((barcode_labels != "unclassified")[codes].sum())
+                self.logger.debug ("\t\t{:,} reads with barcodes assigned".format(n))
+                self.counter["Reads with barcodes"] = n
+            del barcode_index, bam_index
+
+            # Cleanup steps depending on all the reads
+            columns, keep, offsets, barcode_remap = self._combine_partitions(partitions, labels, n_na, n_zero)
+
+            # Write the store and memory-map it
+            self.logger.debug ("\tWrite cleaned partitions in column store")
+            meta = OrderedDict()
+            meta["package_version"] = package_version
+            meta["store_version"] = STORE_VERSION
+            meta["counter"] = OrderedDict((k, int(v)) for k, v in self.counter.items())
+            meta["ref_len_dict"] = OrderedDict((k, int(v)) for k, v in self.ref_len_dict.items())
+            meta["tables"] = OrderedDict()
+            meta["tables"]["reads_df"] = self._compact_partitions(partitions, columns, keep, offsets, barcode_remap, labels, store_dir)
+            if not self.alignments_df.empty:
+                meta["tables"]["alignments_df"] = self._save_table(self.alignments_df, store_dir, "alignments_df")
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+        meta_fn = os.path.join(store_dir, STORE_META_FN)
+        with open (meta_fn+".tmp", "w") as fp:
+            json.dump(meta, fp, indent=2)
+        os.replace(meta_fn+".tmp", meta_fn)
+
+        self._load_store(store_dir, read_ids=False)
+        self.store_dir = store_dir
+
+    def _barcode_hash_index (self):
+        """Return a tuple (sorted read_id hashes, barcode codes, barcode labels) for the barcode files or None"""
+        if not self.barcode_files_list:
+            return None
+        # Imported here to avoid a circular import
+        from pycoQC.Barcode_split import _barcode_index
+
+        self.logger.debug ("\tIndex barcode files")
+        return _barcode_index(self.barcode_files_list, PARTITION_SIZE)
 
+    def _bam_hash_index (self):
+        """Return a tuple (sorted read_id hashes, dict of sorted alignment columns, ref_id labels) for the bam files or None"""
+        bam_reads_df, self.alignments_df, self.ref_len_dict = self._parse_bam()
+        if bam_reads_df.empty:
+            return None
+
+        self.logger.debug ("\tIndex alignment data")
+        hashes = hash_read_ids(bam_reads_df["read_id"].values)
+        order = np.argsort(hashes, kind="stable")
+        columns = OrderedDict()
+        for col in bam_reads_df:
+            if col == "ref_id":
+                codes, ref_labels = pd.factorize(bam_reads_df[col])
+                columns[col] = codes[order]
+            elif col != "read_id":
+                columns[col] = bam_reads_df[col].values.astype(np.float64)[order]
+        return (hashes[order], columns, list(ref_labels))
+
+    def _iter_summary_partitions (self):
+        """Yield the summary data by partitions of at most PARTITION_SIZE reads, with the pycoQC column names"""
+        str_cols = ["read_id", "run_id", "calibration_strand_genome_template", "barcode_arrangement"]
+
+        if self.fast5_dir:
+            df_list = []
+            n = 0
+            for df in self._iter_fast5_dfs():
+                df_list.append(df)
+                n += len(df)
+                if n >= PARTITION_SIZE:
+                    yield self._rename_partition(pd.concat(df_list, ignore_index=True, sort=False))
+                    df_list = []
+                    n = 0
+            if df_list:
+                yield self._rename_partition(pd.concat(df_list, ignore_index=True, sort=False))
+            return
+
+        # Only the columns found in all the files are used, as when files are concatenated
+        columns = list(SUMMARY_RENAME_COLNAMES.keys())+SUMMARY_REQUIRED_COLNAMES+SUMMARY_OPTIONAL_COLNAMES
+        for fn in self.summary_files_list:
+            fn_columns = get_file_columns(fn)
+            columns = [col for col in columns if col in fn_columns]
+
+        for fn in self.summary_files_list:
+            self.logger.debug ("\t\tParse file {}".format(fn))
+            if get_file_format(fn) == "text":
+                dtype = {col:str for col in str_cols if col in columns}
+                for df in pd.read_csv(fn, sep="\t", usecols=columns, dtype=dtype, chunksize=PARTITION_SIZE):
+                    yield self._rename_partition(df)
+            else:
+                for table in iter_columnar_file(fn, columns=columns, batch_size=PARTITION_SIZE):
+                    yield self._rename_partition(columnar_to_df(table))
+
+    def _rename_partition (self, df):
+        """Rename the columns of a partition, verify the required columns and convert the numeric columns"""
+        df = df.rename(columns=SUMMARY_RENAME_COLNAMES)
+        for col in SUMMARY_REQUIRED_COLNAMES:
+            if not col in df:
+                raise pycoQCError("Column {} not found in the provided sequence_summary file".format(col))
+        for col in ["channel", "start_time", "read_len", "mean_qscore"]:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
         return df
 
+    @staticmethod
+    def _category_codes (values, label_d):
+        """Return the codes of values in label_d, adding new labels. Missing values get the code -1"""
+        codes, uniques = pd.factorize(values)
+        label_codes = np.array([label_d.setdefault(v, len(label_d)) for v in uniques]+[-1], dtype=np.int32)
+        return label_codes[codes]
+
+    @staticmethod
+    def _lookup_hash_index (hashes, index_hashes):
+        """Return the positions of hashes in a sorted index and a mask of the hashes found"""
+        if not len(index_hashes):
+            return (np.zeros(len(hashes), dtype=np.int64), np.zeros(len(hashes), dtype=bool))
+        pos = np.minimum(np.searchsorted(index_hashes, hashes), len(index_hashes)-1)
+        return (pos, index_hashes[pos] == hashes)
+
+    def _partition_arrays (self, df, labels, barcode_index, bam_index):
+        """Convert a filtered partition into an ordered dict of numpy arrays, with the strings encoded as category codes"""
+        part = OrderedDict()
+        part["read_id_hash"] = hash_read_ids(df["read_id"].values)
+        part["run_id"] = self._category_codes(df["run_id"].values, labels["run_id"])
+        for col in ["channel", "start_time", "read_len", "mean_qscore"]:
+            part[col] = df[col].values.astype(np.float64)
+        if "calibration" in df:
+            part["calibration"] = self._category_codes(df["calibration"].values, labels["calibration"])
+
+        # Barcodes from the barcode files, else from the summary file
+        if barcode_index:
+            hashes, codes, barcode_labels = barcode_index
+            pos, found = self._lookup_hash_index(part["read_id_hash"], hashes)
+            part["barcode"] = np.where(found, codes[pos], labels["barcode"].setdefault("unclassified", len(labels["barcode"]))).astype(np.int32)
+        elif "barcode" in df:
+            part["barcode"] = self._category_codes(df["barcode"].values, labels["barcode"])
+
+        # Alignment data of the primary alignments
+        if bam_index:
+            hashes, columns, ref_labels = bam_index
+            if not labels["ref_id"]:
+                labels["ref_id"].update((label, i) for i, label in enumerate(ref_labels))
+            pos, found = self._lookup_hash_index(part["read_id_hash"], hashes)
+            for col, values in columns.items():
+                if col == "ref_id":
+                    part[col] = np.where(found, values[pos], -1).astype(np.int32)
+                else:
+                    part[col] = np.where(found, values[pos], np.nan)
+        return part
+
+    @staticmethod
+    def _spill_partition (part, spill_dir, i):
+        """Save the arrays of a partition in spill_dir and return a dict of (column, file path) and the number of reads"""
+        files = OrderedDict()
+        for col, values in part.items():
+            files[col] = os.path.join(spill_dir, "{:06}_{}.npy".format(i, col))
+            np.save(files[col], values)
+        return (files, len(part["read_id_hash"]))
+
+    @staticmethod
+    def _iter_spilled (partitions, col):
+        """Yield the spilled arrays of a column, partition by partition"""
+        for files, n in partitions:
+            yield np.load(files[col], mmap_mode="r")
+
+    def _combine_partitions (self, partitions, labels, n_na, n_zero):
+        """
+        Compute the filters and transformations depending on all the reads from partial results combined across partitions. Return a
+        tuple (columns kept, mask of the reads kept, start_time offset per run_id code, barcode code remapping)
+        """
+        n = sum(i for files, i in partitions)
+        columns = list(partitions[0][0].keys()) if partitions else []
+
+        # Optional columns without any value are ignored
+        for col in SUMMARY_OPTIONAL_COLNAMES:
+            if col in columns and not any((codes >= 0).any() for codes in self._iter_spilled(partitions, col)):
+                columns.remove(col)
+
+        self.logger.info ("\tDiscarding lines containing NA values")
+        self.logger.info ("\t\t{:,} reads discarded".format(n_na))
+        self.counter["Reads with NA values discarded"] = n_na
+        if n+n_zero <= 1:
+            raise pycoQCError("No valid read left after NA values filtering")
+
+        self.logger.info ("\tFiltering out zero length reads")
+        self.logger.info ("\t\t{:,} reads discarded".format(n_zero))
+        self.counter["Zero length reads discarded"] = n_zero
+        if n <= 1:
+            raise pycoQCError("No valid read left after zero_len filtering")
+
+        # The first occurence of each read_id is found by sorting the hashes of all the reads, using 16 bytes per read
+        keep = np.ones(n, dtype=bool)
+        if self.filter_duplicated:
+            self.logger.info ("\tFiltering out duplicated reads")
+            hashes = np.concatenate(list(self._iter_spilled(partitions, "read_id_hash")))
+            order = np.argsort(hashes, kind="stable")
+            hashes = hashes[order]
+            keep[order[1:][hashes[1:] == hashes[:-1]]] = False
+            del hashes, order
+            n_dup = n-keep.sum()
+            self.logger.info ("\t\t{:,} reads discarded".format(n_dup))
+            self.counter["Duplicated reads discarded"] = n_dup
+            if n-n_dup <= 1:
+                raise pycoQCError("No valid read left after calibration strand filtering")
+
+        # Label based filters, the last value of the label masks corresponds to missing values (code -1)
+        label_filters = []
+        if self.filter_calibration and "calibration" in columns:
+            label_keep = np.array([label in CALIBRATION_KEEP_VALUES for label in labels["calibration"]]+[False])
+            label_filters.append(("calibration", label_keep, "\tFiltering out calibration strand reads", "Calibration reads discarded",
+                "No valid read left after calibration strand filtering"))
+        if self.runid_list:
+            label_keep = np.array([label in self.runid_list for label in labels["run_id"]]+[False])
+            label_filters.append(("run_id", label_keep, "\tSelecting run_ids passed by user", "Excluded runid reads discarded",
+                "No valid read left after run ID filtering"))
+
+        for col, label_keep, msg, counter_key, error_msg in label_filters:
+            self.logger.info (msg)
+            l = keep.sum()
+            start = 0
+            for codes in self._iter_spilled(partitions, col):
+                keep[start:start+len(codes)] &= label_keep[codes]
+                start += len(codes)
+            n_discarded = l-keep.sum()
+            self.logger.info ("\t\t{:,} reads discarded".format(n_discarded))
+            self.counter[counter_key] = n_discarded
+            if l-n_discarded <= 1:
+                raise pycoQCError(error_msg)
+
+        # Per run_id count and start_time range of the reads kept
+        n_runs = len(labels["run_id"])
+        run_count = np.zeros(n_runs, dtype=np.int64)
+        run_min = np.full(n_runs, np.inf)
+        run_max = np.full(n_runs, -np.inf)
+        barcode_count = np.zeros(len(labels["barcode"]), dtype=np.int64)
+        start = 0
+        for files, i in partitions:
+            part_keep = keep[start:start+i]
+            start += i
+            codes = np.load(files["run_id"])[part_keep]
+            start_time = np.load(files["start_time"])[part_keep]
+            run_count += np.bincount(codes, minlength=n_runs)
+            np.minimum.at(run_min, codes, start_time)
+            np.maximum.at(run_max, codes, start_time)
+            if "barcode" in columns:
+                codes = np.load(files["barcode"])[part_keep]
+                barcode_count += np.bincount(codes[codes >= 0], minlength=len(labels["barcode"]))
+
+        # Order the run_ids as given by the user or by decreasing throughput
+        run_labels = list(labels["run_id"].keys())
+        if self.runid_list:
+            runid_list = [runid for runid in self.runid_list if runid in labels["run_id"] and run_count[labels["run_id"][runid]]]
+        else:
+            self.logger.info ("\tSorting run IDs by decreasing throughput")
+            d = OrderedDict()
+            for run_id in sorted(run_labels):
+                code = labels["run_id"][run_id]
+                if run_count[code]:
+                    d[run_id] = run_count[code]/(run_max[code]-run_min[code])
+            runid_list = [i for i, j in sorted (d.items(), key=lambda t: t[1], reverse=True)]
+            self.logger.info ("\t\tRun-id order {}".format(runid_list))
+
+        self.logger.info ("\tReordering runids")
+        offsets = np.zeros(n_runs+1)
+        increment_time = 0
+        for runid in runid_list:
+            self.logger.info ("\t\tProcessing reads with Run_ID {} / time offset: {}".format(runid, increment_time))
+            code = labels["run_id"][runid]
+            offsets[code] = increment_time
+            increment_time += run_max[code]+1
+
+        #  Unset low frequency barcodes
+        barcode_remap = np.arange(len(labels["barcode"])+1, dtype=np.int32)
+        barcode_remap[-1] = -1
+        if "barcode" in columns and self.min_barcode_percent:
+            self.logger.info ("\tCleaning up low frequency barcodes")
+            unclassified = labels["barcode"].get("unclassified")
+            counts = barcode_count.copy()
+            if unclassified is not None:
+                counts[unclassified] = 0
+            cutoff = int(counts.sum()*self.min_barcode_percent/100)
+            low_barcode = np.flatnonzero((counts > 0) & (counts < cutoff))
+            if len(low_barcode):
+                unclassified = labels["barcode"].setdefault("unclassified", len(labels["barcode"]))
+                barcode_remap[low_barcode] = unclassified
+            n_low = int(counts[low_barcode].sum())
+            self.logger.info ("\t\t{:,} reads with low frequency barcode unset".format(n_low))
+            self.counter["Reads with low frequency barcode unset"] = n_low
+
+        n_valid = int(keep.sum())
+        self.logger.info ("\t\t{:,} Final valid reads".format(n_valid))
+        self.counter["Valid reads"] = n_valid
+        if n_valid < 500:
+            self.logger.warning ("WARNING: Low number of reads found. This is likely to lead to errors when trying to generate plots")
+
+        return (columns, keep, offsets, barcode_remap)
+
+    def _compact_partitions (self, partitions, columns, keep, offsets, barcode_remap, labels, store_dir):
+        """Write the reads kept from the spilled partitions in the reads_df table of a column store and return the table metadata"""
+        name = "reads_df"
+        mkdir(os.path.join(store_dir, name), exist_ok=True)
+        n = int(keep.sum())
+
+        table_meta = OrderedDict()
+        table_meta["length"] = n
+        table_meta["index"] = None
+        table_meta["columns"] = []
+        table_meta["read_id_hash"] = os.path.join(name, "read_id_hash.npy")
+
+        cast_d = {"channel":np.uint16, "start_time":np.float32, "read_len":np.uint32, "mean_qscore":np.float32}
+        for i, col in enumerate(columns):
+            if col == "read_id_hash":
+                fn = table_meta["read_id_hash"]
+                dtype = np.uint64
+            else:
+                fn = os.path.join(name, "{:03}.npy".format(i-1))
+                col_meta = OrderedDict([("name", col), ("file", fn)])
+                if col in labels:
+                    categories = list(labels[col].keys())
+                    dtype = np.min_scalar_type(-max(len(categories), 1))
+                    col_meta.update([("dtype", "object"), ("kind", "category"), ("categories", categories)])
+                else:
+                    dtype = cast_d.get(col, np.float64)
+                    col_meta.update([("dtype", np.dtype(dtype).name), ("kind", "array")])
+                table_meta["columns"].append(col_meta)
+
+            # Fill the column partition by partition
+            a = np.lib.format.open_memmap(os.path.join(store_dir, fn), mode="w+", dtype=dtype, shape=(n,))
+            start = end = 0
+            for files, l in partitions:
+                part_keep = keep[start:start+l]
+                start += l
+                values = np.load(files[col])[part_keep]
+                if col == "start_time":
+                    values = values+offsets[np.load(files["run_id"])[part_keep]]
+                elif col == "barcode":
+                    values = barcode_remap[values]
+                a[end:end+len(values)] = values
+                end += len(values)
+            a.flush()
+            del a
+        return table_meta
+
+    def _load_store (self, store_dir, read_ids=True):
+        """Load the data and the counters of a column store"""
+        with open (os.path.join(store_dir, STORE_META_FN)) as fp:
+            meta = json.load(fp, object_pairs_hook=OrderedDict)
+        if meta["store_version"] != STORE_VERSION:
+            raise pycoQCError ("Column store {} was written with an incompatible version of pycoQC ({})".format(store_dir, meta["package_version"]))
+
+        self.summary_files_list = [store_dir]
+        self.barcode_files_list = []
+        self.bam_file_list = []
+        self.fast5_dir = ""
+        self.counter = meta["counter"]
+        self.ref_len_dict = meta["ref_len_dict"]
+        self.reads_df, self.read_id_hash = self._load_table(store_dir, meta["tables"]["reads_df"], read_ids=read_ids)
+        if "alignments_df" in meta["tables"]:
+            self.alignments_df = self._load_table(store_dir, meta["tables"]["alignments_df"])[0]
+        else:
+            self.alignments_df = pd.DataFrame()
+        self.logger.info ("\t{:,} reads loaded from {}".format(len(self.reads_df), store_dir))
+
+    @staticmethod
+    def _save_table (df, store_dir, name, read_id_hash=None):
+        """
+        Save the columns and the index of a DataFrame in a subdirectory of the store and return the table metadata. The read_id hashes
+        are computed from the read_ids or taken from read_id_hash if the reads are indexed by position
+        """
+        mkdir(os.path.join(store_dir, name), exist_ok=True)
+        table_meta = OrderedDict()
+        table_meta["length"] = len(df)
+
+        # Index not saved if it is a default range index
+        if isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+            table_meta["index"] = None
+        else:
+            table_meta["index"] = pycoQC_parse._save_column(df.index, df.index.name, os.path.join(name, "index"), store_dir)
+
+        table_meta["columns"] = []
+        for i, col in enumerate(df.columns):
+            table_meta["columns"].append(pycoQC_parse._save_column(df[col], col, os.path.join(name, "{:03}".format(i)), store_dir))
+
+        # read_id hashes used by pycoQC_plot for sampling
+        read_ids = df.index if df.index.name == "read_id" else df["read_id"] if "read_id" in df else None
+        if read_ids is not None:
+            read_id_hash = hash_read_ids(read_ids)
+        if read_id_hash is not None:
+            table_meta["read_id_hash"] = os.path.join(name, "read_id_hash.npy")
+            np.save(os.path.join(store_dir, table_meta["read_id_hash"]), np.asarray(read_id_hash))
+        else:
+            table_meta["read_id_hash"] = None
+        return table_meta
+
+    @staticmethod
+    def _save_column (values, name, fn, store_dir):
+        """
+        Save a column in a .npy file and return its metadata. Numeric and boolean columns are saved as is. Strings columns are saved
+        as integer codes with a list of categories, or as fixed width utf8 bytes if most values are unique, like read_ids
+        """
+        col_meta = OrderedDict([("name", name), ("file", fn+".npy"), ("dtype", str(values.dtype))])
+        fn = os.path.join(store_dir, fn+".npy")
+
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf":
+            col_meta["kind"] = "array"
+            np.save(fn, np.asarray(values))
+            return col_meta
+
+        if not (values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values.dtype)):
+            raise pycoQCError ("Column {} of type {} cannot be saved in a column store".format(name, values.dtype))
+
+        codes, categories = pd.factorize(values)
+        if len(categories) > len(values)/2 and (codes >= 0).all() and all(isinstance(v, str) for v in categories):
+            col_meta["kind"] = "bytes"
+            np.save(fn, np.array([v.encode("utf8") for v in values], dtype=bytes))
+        else:
+            col_meta["kind"] = "category"
+            col_meta["categories"] = [v.item() if isinstance(v, np.generic) else v for v in categories]
+            np.save(fn, codes.astype(np.min_scalar_type(-max(len(categories), 1))))
+        return col_meta
+
+    @staticmethod
+    def _load_table (store_dir, table_meta, read_ids=True):
+        """Return a tuple (DataFrame, read_id hashes) from the metadata of a table. Numeric columns are memory-mapped"""
+        columns = OrderedDict()
+        for col_meta in table_meta["columns"]:
+            columns[col_meta["name"]] = pycoQC_parse._load_column(store_dir, col_meta)
+
+        # Each column is kept in a separate block so that the memory-mapped arrays are not copied
+        df = pd.DataFrame(columns, index=pd.RangeIndex(table_meta["length"]), copy=False)
+        if table_meta["index"] and read_ids:
+            df.index = pd.Index(pycoQC_parse._load_column(store_dir, table_meta["index"]), name=table_meta["index"]["name"])
+
+        if table_meta["read_id_hash"]:
+            read_id_hash = np.load(os.path.join(store_dir, table_meta["read_id_hash"]), mmap_mode="r")
+        else:
+            read_id_hash = None
+        return (df, read_id_hash)
+
+    @staticmethod
+    def _load_column (store_dir, col_meta):
+        a = np.load(os.path.join(store_dir, col_meta["file"]), mmap_mode="r")
+        if col_meta["kind"] == "array":
+            return a
+        if col_meta["kind"] == "bytes":
+            return np.array([v.decode("utf8") for v in a.tolist()], dtype=object)
+        values = pd.Categorical.from_codes(a, categories=col_meta["categories"])
+        return values if col_meta["dtype"] == "category" else np.asarray(values, dtype=object)
+
+    @staticmethod
+    def _get_store_dir (summary_file):
+        """Return the directory path if summary_file is a column store directory, else an empty string"""
+        summary_dir = pycoQC_parse._get_fast5_dir(summary_file)
+        if summary_dir and os.path.isfile(os.path.join(summary_dir, STORE_META_FN)):
+            return summary_dir
+        return ""
+
+    @staticmethod
+    def _get_fast5_dir (summary_file):
+        """Return the directory path if summary_file is a single directory, else an empty string"""
+        if isinstance(summary_file, list) and len(summary_file) == 1:
+            summary_file = summary_file[0]
+        if isinstance(summary_file, str) and os.path.isdir(summary_file):
+            return summary_file
+        return ""
+
     def _parse_barcode (self):
         """"""
         if not self.barcode_files_list:
             return pd.DataFrame()
 
         self.logger.debug ("\tParse barcode files")
-        df = merge_files_to_df (self.barcode_files_list)
+        df = merge_files_to_df (self.barcode_files_list, columns=["read_id", "barcode_arrangement", "read_ID", "barcode_call"])
 
         # check presence of barcode details
         if "read_id" in df and "barcode_arrangement" in df:
@@ -175,16 +1159,39 @@ class pycoQC_parse ():
 
     def _parse_bam (self):
         """"""
-        if not self.bam_file_list:
+        return self._parse_bam_files(self.bam_file_list, self.bam_threads, self.reference_file)
+
+    def _parse_bam_async (self):
+        """
+        Start parsing the bam files in a separate process and return a Future of the result of _parse_bam. The process should be started
+        before any other thread so that it is forked from a single threaded process. The bam files are parsed directly with a single CPU
+        """
+        if not self.bam_file_list or available_cpus() <= 1:
+            future = Future()
+            future.set_result(self._parse_bam())
+            return future
+
+        self.logger.debug ("\tParse bam files in a separate process")
+        executor = ProcessPoolExecutor(max_workers=1)
+        future = executor.submit(pycoQC_parse._parse_bam_files, self.bam_file_list, self.bam_threads, self.reference_file)
+        executor.shutdown(wait=False)
+        return future
+
+    @staticmethod
+    def _parse_bam_files (bam_file_list, threads=1, reference_file=""):
+        """Return a tuple (read_df, alignments_df, ref_len_dict) from a list of bam, cram or sam files"""
+        if not bam_file_list:
             return (pd.DataFrame(), pd.DataFrame(), OrderedDict())
 
-        # Init collections
+        # Init collections. The stats of the primary alignments are collected as tuples to build the dataframe in one go
         ref_len_dict = OrderedDict()
         alignments_dict = Counter()
-        read_dict = OrderedDict ()
+        read_id_set = set()
+        read_id_list = []
+        read_stats_list = []
 
-        for bam_fn in self.bam_file_list:
-            with ps.AlignmentFile(bam_fn, "rb") as bam:
+        for bam_fn in bam_file_list:
+            with pycoQC_parse._open_alignment_file(bam_fn, threads, reference_file) as bam:
 
                 # Save reference lengths information
                 for ref_id, ref_len in zip(bam.references, bam.lengths):
@@ -199,11 +1206,13 @@ class pycoQC_parse ():
                         alignments_dict["Secondary"]+=1
                     elif read.is_supplementary:
                         alignments_dict["Suplementary"]+=1
-                    elif read.query_name in read_dict:
+                    elif read.query_name in read_id_set:
                         alignments_dict["Duplicated"]+=1
                     else:
                         alignments_dict["Primary"]+=1
-                        read_dict[read.query_name] = self._get_read_stats(read)
+                        read_id_set.add(read.query_name)
+                        read_id_list.append(read.query_name)
+                        read_stats_list.append(pycoQC_parse._get_read_stats(read))
 
         # Convert aligments_dict to df
         if alignments_dict:
@@ -214,16 +1223,55 @@ class pycoQC_parse ():
         else:
             alignments_df = pd.DataFrame()
 
-        # Convert read_dict to df
-        if read_dict:
-            read_df = pd.DataFrame.from_dict(read_dict, orient="index")
-            read_df.index.name="read_id"
-            read_df.reset_index(inplace=True)
+        # Convert read stats to df. mismatch and identity_freq are only defined if NM or MD tags are found
+        if read_stats_list:
+            read_df = pd.DataFrame(read_stats_list, columns=BAM_READ_STATS_COLNAMES)
+            read_df.insert(0, "read_id", read_id_list)
+            for col in ["mismatch", "identity_freq"]:
+                if read_df[col].isnull().all():
+                    read_df = read_df.drop(columns=col)
         else:
             read_df = pd.DataFrame()
 
         return (read_df, alignments_df, ref_len_dict)
 
+    @staticmethod
+    def _open_alignment_file (fn, threads=1, reference_file=""):
+        """
+        Open a bam, cram or sam file, or a stream on stdin if fn is "-", with htslib decompression threads. Only the fields used by pycoQC
+        are decoded from cram files, which skips the quality strings and if possible the sequences
+        """
+        kwargs = {"threads":max(min(threads, available_cpus()), 1)}
+        if reference_file:
+            kwargs["reference_filename"] = reference_file
+
+        if fn != "-":
+            with open(fn, "rb") as fp:
+                if fp.read(4) != b"CRAM":
+                    return ps.AlignmentFile(fn, "r", **kwargs)
+        # pysam always tries to load the cram index, htslib errors are silenced for unindexed files and streams
+        verbosity = ps.set_verbosity(0)
+        try:
+            # The format of stdin streams cannot be checked without consuming them. The sequences are decoded if it is a cram stream
+            if fn == "-":
+                return ps.AlignmentFile(fn, "r", format_options=[("required_fields=0x{:X}".format(CRAM_REQUIRED_FIELDS|CRAM_SEQ_FIELD)).encode()], **kwargs)
+
+            # Check that the NM tag is stored for the first mapped reads before skipping the sequences
+            required_fields = CRAM_REQUIRED_FIELDS
+            with ps.AlignmentFile(fn, "r", format_options=[("required_fields=0x{:X}".format(required_fields)).encode()], **kwargs) as bam:
+                n = 0
+                for read in bam:
+                    if not read.is_unmapped:
+                        if not read.has_tag("NM"):
+                            required_fields |= CRAM_SEQ_FIELD
+                            break
+                        n += 1
+                        if n >= CRAM_NM_CHECK_READS:
+                            break
+            return ps.AlignmentFile(fn, "r", format_options=[("required_fields=0x{:X}".format(required_fields)).encode()], **kwargs)
+        finally:
+            ps.set_verbosity(verbosity)
+
     def _merge_reads_df(self, summary_reads_df, barcode_reads_df, bam_reads_df):
         """"""
         df = summary_reads_df
@@ -255,7 +1303,7 @@ class pycoQC_parse ():
         self.logger.info ("\tFiltering out zero length reads")
         l = len(df)
         df = df[(df["read_len"] > 0)]
-        n=l-len(df)
+        n=l-len(df)+self._read_discard_counter.get("Zero length reads discarded", 0)
         self.logger.info ("\t\t{:,} reads discarded".format(n))
         self.counter["Zero length reads discarded"] = n
         if len(df) <= 1:
@@ -276,7 +1324,7 @@ class pycoQC_parse ():
         if self.filter_calibration and "calibration" in df:
             self.logger.info ("\tFiltering out calibration strand reads")
             l = len(df)
-            df = df[(df["calibration"].isin(["filtered_out", "no_match", "*"]))]
+            df = df[(df["calibration"].isin(CALIBRATION_KEEP_VALUES))]
             n=l-len(df)
             self.logger.info ("\t\t{:,} reads discarded".format(n))
             self.counter["Calibration reads discarded"] = n
@@ -288,7 +1336,7 @@ class pycoQC_parse ():
             self.logger.info ("\tSelecting run_ids passed by user")
             l = len(df)
             df = df[(df["run_id"].isin(self.runid_list))]
-            n=l-len(df)
+            n=l-len(df)+self._read_discard_counter.get("Excluded runid reads discarded", 0)
             self.logger.debug ("\t\t{:,} reads discarded".format(n))
             self.counter["Excluded runid reads discarded"] = n
             if len(df) <= 1:
@@ -345,31 +1393,22 @@ class pycoQC_parse ():
 
         return df
 
-    def _get_read_stats(self, read):
-        """"""
-        d = OrderedDict()
-
-        # Extract general stats
-        d["ref_id"] = read.reference_name
-        d["ref_start"] = read.reference_start
-        d["ref_end"] = read.reference_end
-        d["align_len"] = read.query_alignment_length
-        d["mapq"] = read.mapping_quality
+    @staticmethod
+    def _get_read_stats(read):
+        """Return a tuple of the alignment stats of a read in the order of BAM_READ_STATS_COLNAMES"""
+        align_len = read.query_alignment_length
 
         # Extract indel and soft_clip from cigar
         c_stat = read.get_cigar_stats()[0]
-        d["insertion"] = c_stat[1]
-        d["deletion"] = c_stat[2]
-        d["soft_clip"] = c_stat[4]
+        insertion = c_stat[1]
+        deletion = c_stat[2]
 
         # Compute alignment score from NM field if available
+        mismatch = identity_freq = None
         if read.has_tag("NM"):
             edit_dist = read.get_tag("NM")
-            d["mismatch"] = edit_dist-(d["deletion"]+d["insertion"])
-            try:
-                d["identity_freq"] = (d["align_len"]-edit_dist)/d["align_len"]
-            except ZeroDivisionError:
-                d["identity_freq"] = 0
+            mismatch = edit_dist-(deletion+insertion)
+            identity_freq = (align_len-edit_dist)/align_len if align_len else 0
 
         # If not NM try to compute score from MD field
         elif read.has_tag("MD"):
@@ -377,14 +1416,12 @@ class pycoQC_parse ():
             for i in read.get_tag("MD"):
                 if i in ["A","T","C","G","a","t","c","g"]:
                     md_err += 1
-            d["mismatch"] = md_err-d["deletion"]
-            edit_dist = d["mismatch"]+d["insertion"]+d["deletion"]
-            try:
-                d["identity_freq"] = (d["align_len"]-edit_dist)/d["align_len"]
-            except ZeroDivisionError:
-                d["identity_freq"] = 0
+            mismatch = md_err-deletion
+            edit_dist = mismatch+insertion+deletion
+            identity_freq = (align_len-edit_dist)/align_len if align_len else 0
 
-        return d
+        return (read.reference_name, read.reference_start, read.reference_end, align_len, read.mapping_quality,
+            insertion, deletion, c_stat[4], mismatch, identity_freq)
 
     def _select_df_columns(self, df, required_colnames, optional_colnames):
         """"""
@@ -395,8 +1432,9 @@ class pycoQC_parse ():
                 col_found.append(col)
             else:
                 raise pycoQCError("Column {} not found in the provided sequence_summary file".format(col))
+        # Optional columns without any value, for example from Fast5_to_seq_summary, are ignored
         for col in optional_colnames:
-            if col in df:
+            if col in df and df[col].notnull().any():
                 col_found.append(col)
 
         return df[col_found]
@@ -6,6 +6,9 @@
 from collections import *
 import warnings
 import datetime
+import functools
+import inspect
+import hashlib
 
 # Third party imports
 import numpy as np
@@ -17,17 +20,105 @@ from plotly.subplots import make_subplots
 # Local lib import
 from pycoQC.common import *
 from pycoQC.pycoQC_parse import pycoQC_parse
+from pycoQC.pycoQC_cache import pycoQC_cache
 from pycoQC import __name__ as package_name
 from pycoQC import __version__ as package_version
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~GLOBAL SETTINGS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
-# Set seed for deterministic random sampling
-SEED = 42
-np.random.RandomState(seed=SEED)
-
 # Silence futurewarnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+# Number of bins of the plot ready data of the distribution, output over time and coverage plots. The figures are rebinned
+# from these data so that they can be rebuilt from an aggregate file with other nbins or time_bins values. The numbers of bins
+# are multiples of the number of intervals of the default plots, which are therefore rebinned exactly
+PLOT_DATA_1D_BINS = 199*20
+PLOT_DATA_2D_BINS = (199*2, 99*2)
+PLOT_DATA_TIME_BINS = 499*4
+PLOT_DATA_COVERAGE_BINS = 500*8
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~CACHE DECORATOR~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+def cached_plot (method):
+    """
+    Decorator serving the figures and the plot ready data of pycoQC_plot methods from the plotter cache.
+    Figures are keyed by the data fingerprint, the pass thresholds, the sampling, the method name and all its arguments values
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper (self, *args, **kwargs):
+        if self.cache is None:
+            return method(self, *args, **kwargs)
+
+        # Normalise args so that positional, keyword and default values give the same key
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        method_args = OrderedDict((k, v) for k, v in bound.arguments.items() if k != "self")
+        key = self.cache.make_key(self.data_fingerprint, self.min_pass_qual, self.min_pass_len, self.sample, method.__name__, method_args)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.logger.info ("\t\tLoading figure from cache")
+            self.last_plot_data = cached["plot_data"]
+            return go.Figure(cached["figure"])
+
+        fig = method(self, *args, **kwargs)
+        # The template is not stored as it is the slowest part to rebuild and is reapplied by default
+        fig_dict = fig.to_dict()
+        fig_dict["layout"].pop("template", None)
+        self.cache.set(key, {"figure":fig_dict, "plot_data":self.last_plot_data})
+        return fig
+
+    return wrapper
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~READS VIEW CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class Reads_view ():
+
+    def __init__ (self, df, idx=None):
+        """
+        Read only selection of rows over a DataFrame shared by all the views. Columns are only extracted when accessed,
+        so that the selection never holds a copy of the whole table
+        * df
+            Shared DataFrame
+        * idx
+            Boolean mask or sorted integer positions of the selected rows. All the rows are selected if None
+        """
+        self.df = df
+        self.idx = idx
+        if idx is None:
+            self._len = len(df)
+        elif idx.dtype == bool:
+            self._len = int(idx.sum())
+        else:
+            self._len = len(idx)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, colname):
+        return colname in self.df
+
+    def __repr__(self):
+        return "[{}] {:,} rows selected out of {:,}\n".format(self.__class__.__name__, self._len, len(self.df))
+
+    def __getitem__(self, key):
+        # List of columns are returned as a new DataFrame
+        if isinstance(key, list):
+            return pd.DataFrame(OrderedDict((k, self[k]) for k in key))
+        col = self.df[key]
+        if self.idx is None:
+            return col
+        return pd.Series(col.values[self.idx], name=key)
+
+    @property
+    def columns (self):
+        return self.df.columns
+
+    def to_df (self):
+        """Return the selected rows as a DataFrame (copy unless all the rows are selected)"""
+        if self.idx is None:
+            return self.df
+        return self.df.iloc[self.idx]
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~MAIN CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
 class pycoQC_plot ():
 
@@ -36,6 +127,9 @@ class pycoQC_plot ():
         min_pass_qual:int=7,
         min_pass_len:int=0,
         sample:int=100000,
+        cache_size:int=0,
+        cache_dir:str="",
+        cache_max_disk_size:int=512,
         verbose:bool=False,
         quiet:bool=False):
         """
@@ -46,7 +140,15 @@ class pycoQC_plot ():
         * min_pass_len
             Minimum read length to consider a read as 'pass'
         * sample
-            If not None a n number of reads will be randomly selected instead of the entire dataset for plotting function (deterministic sampling)
+            If not None a n number of reads will be randomly selected instead of the entire dataset for plotting function (deterministic sampling based on read_id hashes)
+        * cache_size
+            Number of figures kept in memory to serve repeated calls of the plotting methods with identical parameters, for example
+            in interactive sessions. 0 (default) disables the memory cache
+        * cache_dir
+            Directory where to persist the figures across sessions. The disk cache is disabled if not given.
+            The figure cache is only enabled if cache_size or cache_dir is given, as computing the data fingerprint has a cost
+        * cache_max_disk_size
+            Maximal size of the disk cache in MB. The least recently used figures are removed first
         """
 
         # Set logging level
@@ -55,7 +157,20 @@ class pycoQC_plot ():
 
         # Save args to self values
         self.min_pass_qual = min_pass_qual
+        self.min_pass_len = min_pass_len
         self.sample = sample
+        self._data_fingerprint = None
+        self._group_codes_cache = {}
+        self._group_views_cache = {}
+
+        # Plot ready data of the last figure, saved in aggregate files by pycoQC_report
+        self.last_plot_data = None
+
+        # Init figure cache
+        if cache_size or cache_dir:
+            self.cache = pycoQC_cache (max_items=cache_size, cache_dir=cache_dir, max_disk_size=cache_max_disk_size, verbose=verbose, quiet=quiet)
+        else:
+            self.cache = None
 
         # Check that parser is a valid instance of pycoQC_parse
         if not isinstance(parser, pycoQC_parse):
@@ -69,22 +184,23 @@ class pycoQC_plot ():
             self.alignments_df = parser.alignments_df
         self.logger.info ("\tFound {:,} total reads".format(len(self.all_df)))
 
-        # Save df wiews and compute scaling factors
+        # Sample the reads with the smallest read_id hashes (bottom-k). The same reads are selected across runs whatever the
+        # file order, and pass reads can be re-thresholded without re-sampling. All selections are views over the shared all_df
         if sample and len(self.all_df)>sample:
-            self.all_sample_df = self.all_df.sample(n=sample, random_state=SEED)
+            # Hashes saved in a column store are reused, as the read_ids may not be loaded
+            if parser.read_id_hash is not None:
+                self._read_hash = np.asarray(parser.read_id_hash)
+            else:
+                read_ids = self.all_df["read_id"] if "read_id" in self.all_df else self.all_df.index
+                self._read_hash = hash_read_ids(read_ids)
+            self.all_sample_df = Reads_view(self.all_df, hash_sample_index(self._read_hash, sample))
             self.all_scaling_factor = len(self.all_df)/sample
         else:
-            self.all_sample_df = self.all_df
+            self._read_hash = None
+            self.all_sample_df = Reads_view(self.all_df)
             self.all_scaling_factor = 1
 
-        self.pass_df = self.all_df.query ("mean_qscore>={} and read_len>={}".format(min_pass_qual, min_pass_len))
-        if sample and len(self.pass_df)>sample:
-            self.pass_sample_df = self.pass_df.sample(n=sample, random_state=SEED)
-            self.pass_scaling_factor = len(self.pass_df)/sample
-        else:
-            self.pass_sample_df = self.pass_df
-            self.pass_scaling_factor = 1
-        self.logger.info ("\tFound {:,} pass reads (qual >= {} and length >= {})".format(len(self.pass_df), min_pass_qual, min_pass_len))
+        self.set_pass_thresholds (min_pass_qual=min_pass_qual, min_pass_len=min_pass_len)
 
     def __str__(self):
         m = ""
@@ -124,6 +240,20 @@ class pycoQC_plot ():
         if self.has_alignment:
             return np.sum(list(self.ref_len_dict.values()))
 
+    @property
+    def data_fingerprint (self):
+        """Hash of the parsed data identifying the figures in the cache. Computed once on first use"""
+        if not self._data_fingerprint:
+            h = hashlib.sha1()
+            dfs = [self.all_df, self.alignments_df] if self.has_alignment else [self.all_df]
+            for df in dfs:
+                h.update(str(list(zip(df.columns, df.dtypes))).encode())
+                h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+            if self.has_alignment:
+                h.update(str(sorted(self.ref_len_dict.items())).encode())
+            self._data_fingerprint = h.hexdigest()
+        return self._data_fingerprint
+
     def _run_duration(self, df):
         return float(np.ptp(df["start_time"])/3600)
 
@@ -178,6 +308,288 @@ class pycoQC_plot ():
     def _alignment_mismatch_rate(self, df):
         return df["mismatch"].dropna().sum()/self._aligned_bases(df) if self.has_identity_freq else np.nan
 
+    #~~~~~~~PASS THRESHOLDS METHODS~~~~~~~#
+    def set_pass_thresholds (self,
+        min_pass_qual:float=None,
+        min_pass_len:int=None):
+        """
+        Redefine in place the thresholds used to select the 'pass' reads. The data are neither reloaded nor re-sampled
+        * min_pass_qual
+            Minimum quality to consider a read as 'pass'. Unchanged if None
+        * min_pass_len
+            Minimum read length to consider a read as 'pass'. Unchanged if None
+        """
+        if min_pass_qual is not None:
+            self.min_pass_qual = min_pass_qual
+        if min_pass_len is not None:
+            self.min_pass_len = min_pass_len
+
+        pass_mask = (self.all_df["mean_qscore"].values>=self.min_pass_qual) & (self.all_df["read_len"].values>=self.min_pass_len)
+        self.pass_df = Reads_view(self.all_df, pass_mask)
+        self._group_views_cache = {}
+
+        # Pass sample = pass reads with the smallest read_id hashes
+        if self._read_hash is not None and len(self.pass_df)>self.sample:
+            pass_idx = np.flatnonzero(pass_mask)
+            self.pass_sample_df = Reads_view(self.all_df, pass_idx[hash_sample_index(self._read_hash[pass_idx], self.sample)])
+            self.pass_scaling_factor = len(self.pass_df)/self.sample
+        else:
+            self.pass_sample_df = self.pass_df
+            self.pass_scaling_factor = 1
+        self.logger.info ("\tFound {:,} pass reads (qual >= {} and length >= {})".format(len(self.pass_df), self.min_pass_qual, self.min_pass_len))
+
+    def pass_threshold_sweep_data (self,
+        qual_thresholds:list=None,
+        len_thresholds:list=None):
+        """
+        Compute the reads, bases and N50 retained for every combination of quality and length thresholds in a single pass
+        over all the reads, using cumulative 2D histograms. Results are exact as the length bins are the distinct read lengths.
+        Return a long format DataFrame with one row per combination of thresholds
+        * qual_thresholds
+            List of minimum quality values. By default every integer value from 0 to the maximal read quality
+        * len_thresholds
+            List of minimum read length values. By default 0 and log spaced values up to the maximal read length
+        """
+        self.logger.debug ("\t\tComputing pass threshold sweep")
+        qual = self.all_df["mean_qscore"].values
+        read_len = self.all_df["read_len"].values.astype(np.int64)
+
+        # Define default thresholds grids including the current thresholds
+        if qual_thresholds is None:
+            qual_thresholds = list(range(0, int(np.floor(qual.max()))+1)) + [self.min_pass_qual]
+        if len_thresholds is None:
+            len_thresholds = [0, self.min_pass_len]
+            if read_len.max() > 100:
+                for v in np.logspace(2, np.log10(read_len.max()), num=20):
+                    len_thresholds.append(int(float("{:.2g}".format(v))))
+        qual_thresholds = np.unique(np.array(qual_thresholds, dtype=np.float64))
+        len_thresholds = np.unique(np.array(len_thresholds, dtype=np.int64))
+        n_qual = len(qual_thresholds)
+
+        # Fine 2D histogram of reads and bases per quality threshold bin and distinct read length
+        len_values, len_idx = np.unique(read_len, return_inverse=True)
+        n_len = len(len_values)
+        qual_idx = np.searchsorted(qual_thresholds, qual, side="right")-1
+        valid = qual_idx>=0
+        flat_idx = qual_idx[valid]*n_len + len_idx[valid]
+        reads_hist = np.bincount(flat_idx, minlength=n_qual*n_len).reshape(n_qual, n_len)
+        bases_hist = np.bincount(flat_idx, weights=read_len[valid], minlength=n_qual*n_len).reshape(n_qual, n_len)
+
+        # Cumulate over quality (reads >= threshold) then over length in ascending order
+        reads_cum = np.cumsum(np.cumsum(reads_hist[::-1], axis=0)[::-1], axis=1)
+        bases_cum = np.cumsum(np.cumsum(bases_hist[::-1], axis=0)[::-1], axis=1)
+
+        # Counts below each length threshold and retained counts for all thresholds combinations
+        len_start = np.searchsorted(len_values, len_thresholds, side="left")
+        reads_below = np.hstack([np.zeros((n_qual, 1)), reads_cum])[:, len_start]
+        bases_below = np.hstack([np.zeros((n_qual, 1)), bases_cum])[:, len_start]
+        reads = reads_cum[:, -1:] - reads_below
+        bases = bases_cum[:, -1:] - bases_below
+
+        # N50 = shortest retained length for which the cumulated bases of shorter or equal reads reach half of the retained bases
+        N50 = np.full((n_qual, len(len_thresholds)), np.nan)
+        for i in range(n_qual):
+            idx = np.searchsorted(bases_cum[i], bases_below[i]+bases[i]/2, side="left")
+            N50[i] = np.where(bases[i]>0, len_values[np.minimum(idx, n_len-1)], np.nan)
+
+        # Cast to long format DataFrame
+        qual_grid, len_grid = np.meshgrid(qual_thresholds, len_thresholds, indexing="ij")
+        df = pd.DataFrame (OrderedDict ((
+            ("min_pass_qual", qual_grid.ravel()),
+            ("min_pass_len", len_grid.ravel()),
+            ("reads", reads.ravel().astype(np.int64)),
+            ("bases", bases.ravel().astype(np.int64)),
+            ("N50", N50.ravel()))))
+        return df
+
+    #~~~~~~~GROUPED AGGREGATION METHODS AND HELPER~~~~~~~#
+    def grouped_stats_df (self,
+        groupby:str="barcode"):
+        """
+        Compute the run, basecall and alignment summary statistics of all and pass reads for each group in a single pass over
+        the data, using the groups categorical codes and bincount accumulation. Return a DataFrame indexed by status and group
+        * groupby
+            Field to group the reads by. Either barcode or run_id
+        """
+        self.logger.info ("\tCompute summary statistics per {}".format(groupby))
+        df_list = []
+        for df_level, status in (("all", "All Reads"), ("pass", "Pass Reads")):
+            df = self._grouped_stats (df_level=df_level, groupby=groupby)
+            df.index = pd.MultiIndex.from_product([[status], df.index], names=["status", groupby])
+            df_list.append(df)
+        return pd.concat(df_list)
+
+    def _group_codes (self, groupby):
+        """Return the sorted group labels and the group code of every read in all_df. Reads without group get code -1"""
+        if groupby not in ("barcode", "run_id"):
+            raise pycoQCError ("Invalid groupby value {}. Valid values are barcode and run_id".format(groupby))
+        if groupby not in self.all_df:
+            raise pycoQCError ("No {} information available".format(groupby))
+        if not groupby in self._group_codes_cache:
+            codes, labels = pd.factorize(self.all_df[groupby], sort=True)
+            self._group_codes_cache[groupby] = (np.asarray(labels).astype(str), codes)
+        return self._group_codes_cache[groupby]
+
+    def _get_view (self, df_level, sample=True, groupby=None, group=None):
+        """Return the reads view and scaling factor for a level of reads, optionally restricted to a group"""
+        if groupby and group is not None:
+            return self._group_views(df_level=df_level, groupby=groupby, sample=sample)[group]
+        if sample:
+            return (self.pass_sample_df, self.pass_scaling_factor) if df_level=="pass" else (self.all_sample_df, self.all_scaling_factor)
+        return (self.pass_df, 1) if df_level=="pass" else (Reads_view(self.all_df), 1)
+
+    def _iter_levels (self, groupby=None, field_names=[]):
+        """
+        Yield the (df_level, group) combinations to plot. Groups come after the overall levels and
+        groups without any value for one of the field_names are skipped
+        """
+        for df_level in ("all", "pass"):
+            yield (df_level, None)
+        if groupby:
+            for df_level in ("all", "pass"):
+                for group, (df, sf) in self._group_views(df_level=df_level, groupby=groupby).items():
+                    if all(df[field_name].notna().any() for field_name in field_names):
+                        yield (df_level, group)
+
+    def _group_views (self, df_level, groupby, sample=True):
+        """
+        Split a level of reads in one view per group with a single sort of the group codes.
+        Scaling factors are computed per group from the group sizes before sampling
+        """
+        key = (df_level, groupby, sample)
+        if not key in self._group_views_cache:
+            labels, codes = self._group_codes(groupby)
+            n_groups = len(labels)
+
+            # Group sizes before sampling
+            full_view, sf = self._get_view(df_level, sample=False)
+            full_codes = codes[self._view_positions(full_view)]
+            full_counts = np.bincount(full_codes[full_codes>=0], minlength=n_groups)
+
+            # Split positions per group. The stable sort keeps positions sorted within groups
+            view, sf = self._get_view(df_level, sample=sample)
+            pos = self._view_positions(view)
+            pos_codes = codes[pos]
+            pos, pos_codes = pos[pos_codes>=0], pos_codes[pos_codes>=0]
+            counts = np.bincount(pos_codes, minlength=n_groups)
+            pos_split = np.split(pos[np.argsort(pos_codes, kind="stable")], np.cumsum(counts)[:-1])
+
+            group_views = OrderedDict()
+            for label, idx, n_sample, n_full in zip(labels, pos_split, counts, full_counts):
+                if n_sample:
+                    group_views[label] = (Reads_view(self.all_df, idx), n_full/n_sample)
+            self._group_views_cache[key] = group_views
+
+        return self._group_views_cache[key]
+
+    @staticmethod
+    def _view_positions (view):
+        """Return the integer positions of the rows selected by a view"""
+        if view.idx is None:
+            return np.arange(len(view.df))
+        if view.idx.dtype == bool:
+            return np.flatnonzero(view.idx)
+        return view.idx
+
+    def _grouped_stats (self, df_level, groupby):
+        """Private function computing the summary statistics of a level of reads per group"""
+        labels, codes = self._group_codes(groupby)
+        n_groups = len(labels)
+        view, sf = self._get_view(df_level, sample=False)
+        pos = self._view_positions(view)
+        c = codes[pos]
+        pos, c = pos[c>=0], c[c>=0]
+
+        d = OrderedDict()
+        # run information
+        start_time, starts, counts = self._grouped_sort(c, self.all_df["start_time"].values[pos], n_groups)
+        run_duration = np.full(n_groups, np.nan)
+        run_duration[counts>0] = (start_time[starts+counts-1]-start_time[starts])[counts>0]/3600
+        d["run_duration"] = run_duration
+        d["active_channels"] = self._grouped_nunique(c, self.all_df["channel"].values[pos], n_groups)
+        d["runid_number"] = self._grouped_nunique(c, self._group_codes("run_id")[1][pos], n_groups)
+        d["barcodes_number"] = self._grouped_nunique(c, self._group_codes("barcode")[1][pos], n_groups) if self.has_barcodes else np.zeros(n_groups, dtype=np.int64)
+
+        # basecall information
+        read_len, starts, counts = self._grouped_sort(c, self.all_df["read_len"].values[pos].astype(np.float64), n_groups)
+        d["reads_number"] = counts
+        d["bases_number"] = np.bincount(c, weights=self.all_df["read_len"].values[pos], minlength=n_groups).astype(np.int64)
+        d["N50"] = self._grouped_N50(read_len, starts, counts)
+        d["median_read_len"] = self._grouped_median(read_len, starts, counts)
+        qual, starts, counts = self._grouped_sort(c, self.all_df["mean_qscore"].values[pos], n_groups)
+        d["median_read_qscore"] = self._grouped_median(qual, starts, counts)
+
+        # alignment information
+        if self.has_alignment:
+            align_len = self.all_df["align_len"].values[pos].astype(np.float64)
+            aligned = ~np.isnan(align_len)
+            d["aligned_reads"] = np.bincount(c[aligned], minlength=n_groups)
+            d["aligned_bases"] = np.bincount(c[aligned], weights=align_len[aligned], minlength=n_groups).astype(np.int64)
+            d["mean_coverage"] = d["aligned_bases"]/self.total_ref_len
+            align_len, starts, counts = self._grouped_sort(c[aligned], align_len[aligned], n_groups)
+            d["alignment_N50"] = self._grouped_N50(align_len, starts, counts)
+            d["median_align_len"] = self._grouped_median(align_len, starts, counts)
+            if self.has_identity_freq:
+                identity = self.all_df["identity_freq"].values[pos].astype(np.float64)
+                valid = ~np.isnan(identity)
+                identity, starts, counts = self._grouped_sort(c[valid], identity[valid], n_groups)
+                d["median_identity_freq"] = self._grouped_median(identity, starts, counts)
+            else:
+                d["median_identity_freq"] = np.full(n_groups, np.nan)
+
+        return pd.DataFrame(d, index=pd.Index(labels, name=groupby))
+
+    @staticmethod
+    def _grouped_sort (codes, values, n_groups):
+        """Sort values by group then by value. Return the sorted values with the start offset and size of each group"""
+        sorted_values = values[np.lexsort((values, codes))]
+        counts = np.bincount(codes, minlength=n_groups)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        return (sorted_values, starts, counts)
+
+    @staticmethod
+    def _grouped_median (sorted_values, starts, counts):
+        """Median of each group from group sorted values"""
+        median = np.full(len(counts), np.nan)
+        ok = counts>0
+        lo = starts[ok]+(counts[ok]-1)//2
+        hi = starts[ok]+counts[ok]//2
+        median[ok] = (sorted_values[lo]+sorted_values[hi])/2
+        return median
+
+    @staticmethod
+    def _grouped_N50 (sorted_values, starts, counts):
+        """N50 of each group from group sorted lengths, with the same definition as _compute_N50"""
+        N50 = np.full(len(counts), np.nan)
+        if not len(sorted_values):
+            return N50
+        cum_sum = np.concatenate([[0], np.cumsum(sorted_values)])
+        before = cum_sum[starts]
+        half_sum = (cum_sum[starts+counts]-before)/2
+        idx = np.searchsorted(cum_sum[1:], before+half_sum, side="left")
+        ok = counts>0
+        N50[ok] = sorted_values[np.minimum(idx, len(sorted_values)-1)][ok]
+        return N50
+
+    @staticmethod
+    def _grouped_nunique (codes, values, n_groups):
+        """Number of distinct integer values in each group"""
+        values = np.asarray(values, dtype=np.int64)
+        values = values - values.min() if len(values) else values
+        n_values = int(values.max())+1 if len(values) else 1
+        pairs = np.unique(codes.astype(np.int64)*n_values + values)
+        return np.bincount(pairs//n_values, minlength=n_groups)
+
+    #~~~~~~~PLOT DATA METHOD~~~~~~~#
+    def _plot_data (self, data_fn, **data_args):
+        """
+        Compute the plot ready data of a plotting method with data_fn. The data are kept in last_plot_data together with the
+        arguments of the plotting method they depend on (data_args), so that the figure can be rebuilt from an aggregate file
+        with different values of all the other arguments
+        """
+        self.last_plot_data = OrderedDict ((("data_args", data_args), ("data", data_fn())))
+        return self.last_plot_data["data"]
+
     #~~~~~~~SUMMARY_STATS_DICT METHOD AND HELPER~~~~~~~#
 
     def summary_stats_dict (self):
@@ -245,30 +657,28 @@ class pycoQC_plot ():
 
     #~~~~~~~SUMMARY METHODS AND HELPER~~~~~~~#
 
+    @cached_plot
     def run_summary (self,
         width:int = None,
         height:int = 300,
-        plot_title:str="General run summary"):
+        plot_title:str="General run summary",
+        groupby:str=None):
         """
         Plot an interactive overall summary table
-        * groupby
-            Value of field to group the data in the table
         * width
             With of the plotting area in pixel
         * height
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the data in the table (barcode or run_id). Rows are added for each group after the overall rows
         """
         # Extract data
-        data = []
-        for status, df in (("All Reads", self.all_df), ("Pass Reads", self.pass_df)):
-            data.append([
-                status,
-                self._run_duration(df),
-                self._active_channels(df),
-                self._runid_number(df),
-                self._barcodes_number(df)])
+        data = self._plot_data (functools.partial (self.__summary_data,
+            row_fn = lambda df: [self._run_duration(df), self._active_channels(df), self._runid_number(df), self._barcodes_number(df)],
+            group_fields = ["run_duration", "active_channels", "runid_number", "barcodes_number"],
+            groupby = groupby), groupby=groupby)
 
         fig = self.__summary_plot (
             width = width,
@@ -276,35 +686,34 @@ class pycoQC_plot ():
             plot_title = plot_title,
             header=["Status", "Run Duration (h)", "Active Channels", "Number of Runids", "Number of Barcodes"],
             data_format=["", ".2f", "", "", ""],
-            data=[*zip(*data)])
+            data=data,
+            groupby=groupby)
 
         return fig
 
+    @cached_plot
     def basecall_summary (self,
         width:int = None,
         height:int = 300,
-        plot_title:str="Basecall summary"):
+        plot_title:str="Basecall summary",
+        groupby:str=None):
         """
         Plot an interactive basecall summary table
-        * groupby
-            Value of field to group the data in the table
         * width
             With of the plotting area in pixel
         * height
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the data in the table (barcode or run_id). Rows are added for each group after the overall rows
         """
         # Extract data
-        data = []
-        for status, df in (("All Reads", self.all_df), ("Pass Reads", self.pass_df)):
-            data.append([
-                status,
-                self._basecalled_reads(df),
-                self._basecalled_bases(df),
-                self._basecall_N50(df),
-                self._basecall_median_read_len(df),
-                self._basecall_median_read_qscore(df)])
+        data = self._plot_data (functools.partial (self.__summary_data,
+            row_fn = lambda df: [self._basecalled_reads(df), self._basecalled_bases(df), self._basecall_N50(df),
+                self._basecall_median_read_len(df), self._basecall_median_read_qscore(df)],
+            group_fields = ["reads_number", "bases_number", "N50", "median_read_len", "median_read_qscore"],
+            groupby = groupby), groupby=groupby)
 
         fig = self.__summary_plot (
             width = width,
@@ -312,39 +721,38 @@ class pycoQC_plot ():
             plot_title = plot_title,
             header=["Status", "Reads", "Bases", "N50", "Median Read Length", "Median PHRED score"],
             data_format=["", ".6e", ".6e", ".3r", ".3r", ".3f"],
-            data=[*zip(*data)])
+            data=data,
+            groupby=groupby)
 
         return fig
 
+    @cached_plot
     def alignment_summary (self,
         width:int = None,
         height:int = 300,
-        plot_title:str="Alignment summary"):
+        plot_title:str="Alignment summary",
+        groupby:str=None):
         """
         Plot an interactive alignment summary table
-        * groupby
-            Value of field to group the data in the table
         * width
             With of the plotting area in pixel
         * height
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the data in the table (barcode or run_id). Rows are added for each group after the overall rows
         """
         # Verify that alignemnt information are available
         if not self.has_alignment:
             raise pycoQCError ("No Alignment information available")
 
-        data = []
-        for status, df in (("All Reads", self.all_df), ("Pass Reads", self.pass_df)):
-            data.append([
-                status,
-                self._aligned_reads(df),
-                self._aligned_bases(df),
-                self._alignment_mean_coverage(df),
-                self._alignment_N50(df),
-                self._alignment_median_read_len(df),
-                self._alignment_median_identity(df)])
+        # Extract data
+        data = self._plot_data (functools.partial (self.__summary_data,
+            row_fn = lambda df: [self._aligned_reads(df), self._aligned_bases(df), self._alignment_mean_coverage(df),
+                self._alignment_N50(df), self._alignment_median_read_len(df), self._alignment_median_identity(df)],
+            group_fields = ["aligned_reads", "aligned_bases", "mean_coverage", "alignment_N50", "median_align_len", "median_identity_freq"],
+            groupby = groupby), groupby=groupby)
 
         fig = self.__summary_plot (
             width = width,
@@ -352,14 +760,21 @@ class pycoQC_plot ():
             plot_title = plot_title,
             header=["Status", "Reads", "Bases", "Mean Coverage", "N50", "Median Read Length", "Median Identity Freq"],
             data_format=["", ".6e", ".6e", ".3r", ".3r", ".3r", ".3f"],
-            data=[*zip(*data)])
+            data=data,
+            groupby=groupby)
 
         return fig
 
-    def __summary_plot (self, width, height, plot_title, header, data_format, data):
+    def __summary_plot (self, width, height, plot_title, header, data_format, data, groupby=None):
         """Private function generating summary table plots"""
         self.logger.info ("\t\tComputing plot")
 
+        # Add a group column
+        if groupby:
+            header = header[:1]+[groupby.capitalize()]+header[1:]
+            data_format = data_format[:1]+[""]+data_format[1:]
+        data = [*zip(*data)]
+
         # Plot data
         data = [go.Table(
             header = {
@@ -382,14 +797,27 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
+    def __summary_data (self, row_fn, group_fields, groupby=None):
+        """Private function preparing the rows of summary table plots. With groupby, one row per status and group is added after the overall rows"""
+        data = [[status]+row_fn(df) for status, df in (("All Reads", self.all_df), ("Pass Reads", self.pass_df))]
+        if groupby:
+            data = [row[:1]+["All"]+row[1:] for row in data]
+            stats_df = self.grouped_stats_df(groupby=groupby)
+            for (status, group), row in stats_df.iterrows():
+                if row["reads_number"]:
+                    data.append([status, group]+[row[field] for field in group_fields])
+        return data
+
     #~~~~~~~1D DISTRIBUTION METHODS AND HELPER~~~~~~~#
+    @cached_plot
     def read_len_1D (self,
         color:str="lightsteelblue",
         nbins:int=200,
         smooth_sigma:float=2,
         width:int=None,
         height:int=500,
-        plot_title:str="Basecalled reads length"):
+        plot_title:str="Basecalled reads length",
+        groupby:str=None):
         """
         Plot a distribution of read length (log scale)
         * color
@@ -404,6 +832,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         fig = self.__1D_density_plot (
             field_name = "read_len",
@@ -413,17 +843,20 @@ class pycoQC_plot ():
             x_scale = "log",
             nbins=nbins,
             smooth_sigma=smooth_sigma,
+            groupby=groupby,
             width=width,
             height=height)
         return fig
 
+    @cached_plot
     def read_qual_1D (self,
         color:str="salmon",
         nbins:int=200,
         smooth_sigma:float=2,
         width:int=None,
         height:int=500,
-        plot_title:str="Basecalled reads PHRED quality"):
+        plot_title:str="Basecalled reads PHRED quality",
+        groupby:str=None):
         """
         Plot a distribution of quality scores
         * color
@@ -438,6 +871,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         fig = self.__1D_density_plot (
             field_name = "mean_qscore",
@@ -447,17 +882,20 @@ class pycoQC_plot ():
             x_scale = "linear",
             nbins=nbins,
             smooth_sigma=smooth_sigma,
+            groupby=groupby,
             width=width,
             height=height)
         return fig
 
+    @cached_plot
     def align_len_1D (self,
         color:str="mediumseagreen",
         nbins:int=200,
         smooth_sigma:float=2,
         width:int=None,
         height:int=500,
-        plot_title:str="Aligned reads length"):
+        plot_title:str="Aligned reads length",
+        groupby:str=None):
         """
         Plot a distribution of read length (log scale)
         * color
@@ -472,6 +910,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         # Verify that alignemnt information are available
         if not self.has_alignment:
@@ -485,17 +925,20 @@ class pycoQC_plot ():
             x_scale = "log",
             nbins=nbins,
             smooth_sigma=smooth_sigma,
+            groupby=groupby,
             width=width,
             height=height)
         return fig
 
+    @cached_plot
     def identity_freq_1D (self,
         color:str="sandybrown",
         nbins:int=200,
         smooth_sigma:float=2,
         width:int=None,
         height:int=500,
-        plot_title:str="Aligned reads identity"):
+        plot_title:str="Aligned reads identity",
+        groupby:str=None):
         """
         Plot a distribution of alignments identity
         * color
@@ -510,6 +953,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         # Verify that alignemnt information are available
         if not self.has_identity_freq:
@@ -523,17 +968,19 @@ class pycoQC_plot ():
             x_scale = "linear",
             nbins=nbins,
             smooth_sigma=smooth_sigma,
+            groupby=groupby,
             width=width,
             height=height)
         return fig
 
-    def __1D_density_plot (self, field_name, plot_title, x_lab, color, x_scale, nbins, smooth_sigma, width, height):
+    def __1D_density_plot (self, field_name, plot_title, x_lab, color, x_scale, nbins, smooth_sigma, groupby, width, height):
         """Private function generating density plots for all 1D distribution functions"""
         self.logger.info ("\t\tComputing plot")
 
         # Prepare all data
-        lab1, dd1, ld1 = self.__1D_density_data ("all", field_name, x_scale, nbins, smooth_sigma)
-        lab2, dd2, ld2 = self.__1D_density_data ("pass" ,field_name, x_scale, nbins, smooth_sigma)
+        plot_data = self._plot_data (functools.partial (self.__1D_density_data, field_name=field_name, x_scale=x_scale, groupby=groupby), groupby=groupby)
+        data_list = [self.__1D_density_bin (label, level_data, x_scale, nbins, smooth_sigma) for label, level_data in plot_data]
+        lab1, dd1, ld1 = data_list[0]
 
         # Plot initial data
         common = {
@@ -551,9 +998,8 @@ class pycoQC_plot ():
 
         # Create update buttons
         updatemenus = [
-            dict (type="buttons", active=0, x=-0.2, y=0, xanchor='left', yanchor='bottom', buttons = [
-                dict (label=lab1, method='update', args=[dd1, ld1]),
-                dict (label=lab2, method='update', args=[dd2, ld2])])]
+            dict (type="dropdown" if groupby else "buttons", active=0, x=-0.2, y=0, xanchor='left', yanchor='bottom', buttons = [
+                dict (label=lab, method='update', args=[dd, ld]) for lab, dd, ld in data_list])]
 
         # tweak plot layout
         layout = go.Layout (
@@ -569,22 +1015,36 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
-    def __1D_density_data (self, df_level, field_name, x_scale, nbins, smooth_sigma):
-        """Private function preparing data for reads_1D"""
-
-        self.logger.debug ("\t\tPreparing data for {} reads and {}".format(df_level, field_name))
-
-        # Get data
-        df = self.pass_sample_df if df_level=="pass" else self.all_sample_df
-        data = df[field_name].dropna().values
-
-        # Count each categories in log or linear space
-        min = np.nanmin(data)
-        max = np.nanmax(data)
-        if x_scale == "log":
-            count_y, bins = np.histogram (a=data, bins=np.logspace (np.log10(min), np.log10(max)+0.1, nbins))
-        elif x_scale == "linear":
-            count_y, bins = np.histogram (a=data, bins= np.linspace (min, max, nbins))
+    def __1D_density_data (self, field_name, x_scale, groupby=None):
+        """Private function preparing the plot ready data of reads_1D. Values are counted in PLOT_DATA_1D_BINS bins for each level of reads"""
+        plot_data = []
+        for df_level, group in self._iter_levels(groupby, field_names=[field_name]):
+            self.logger.debug ("\t\tPreparing data for {} reads and {}".format(df_level, field_name))
+
+            # Get data
+            df, sf = self._get_view(df_level, groupby=groupby, group=group)
+            data = df[field_name].dropna().values
+
+            # Count each categories in log or linear space
+            min = float(np.nanmin(data))
+            max = float(np.nanmax(data))
+            counts, bins = np.histogram (a=data, bins=self._hist_bins (min, max, x_scale, PLOT_DATA_1D_BINS+1))
+
+            label = "{} Reads".format(df_level.capitalize())
+            if group:
+                label += " {}".format(group)
+            plot_data.append ((label, OrderedDict ((
+                ("min", min),
+                ("max", max),
+                ("counts", counts),
+                ("percentiles", np.percentile (data, [10,25,50,75,90]))))))
+        return plot_data
+
+    def __1D_density_bin (self, label, level_data, x_scale, nbins, smooth_sigma):
+        """Private function binning the plot ready data of a level of reads for reads_1D"""
+        # Rebin counts in nbins-1 bins. Counts are rounded to integers as returned by np.histogram
+        bins = self._hist_bins (level_data["min"], level_data["max"], x_scale, nbins)
+        count_y = np.rint(self._rebin (level_data["counts"], nbins-1)).astype(np.int64)
 
         # Remove last bin from labels
         count_x = bins[1:]
@@ -594,7 +1054,7 @@ class pycoQC_plot ():
             count_y = gaussian_filter1d (count_y, sigma=smooth_sigma)
 
         # Get percentiles percentiles
-        stat = np.percentile (data, [10,25,50,75,90])
+        stat = level_data["percentiles"]
         y_max = count_y.max()
 
         data_dict = dict (
@@ -611,10 +1071,10 @@ class pycoQC_plot ():
         # Make layout dict = Off set for labels on top
         layout_dict = {"yaxis.range": [0, y_max+y_max/6]}
 
-        label = "{} Reads".format(df_level.capitalize())
         return (label, data_dict, layout_dict)
 
     #~~~~~~~2D DISTRIBUTION METHOD AND HELPER~~~~~~~#
+    @cached_plot
     def read_len_read_qual_2D (self,
         colorscale = [
             [0.0,'rgba(255,255,255,0)'],
@@ -628,7 +1088,8 @@ class pycoQC_plot ():
         smooth_sigma:float=2,
         width:int=None,
         height:int=600,
-        plot_title:str="Basecalled reads length vs reads PHRED quality"):
+        plot_title:str="Basecalled reads length vs reads PHRED quality",
+        groupby:str=None):
         """
         Plot a 2D distribution of quality scores vs length of the reads
         * colorscale
@@ -645,6 +1106,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         fig = self.__2D_density_plot (
             x_field_name = "read_len",
@@ -657,11 +1120,13 @@ class pycoQC_plot ():
             y_nbins = y_nbins,
             colorscale = colorscale,
             smooth_sigma=smooth_sigma,
+            groupby=groupby,
             width=width,
             height=height,
             plot_title = plot_title)
         return fig
 
+    @cached_plot
     def read_len_align_len_2D (self,
         colorscale = [
             [0.0,'rgba(255,255,255,0)'],
@@ -675,7 +1140,8 @@ class pycoQC_plot ():
         smooth_sigma:float=1,
         width:int=None,
         height:int=600,
-        plot_title:str="Basecalled reads length vs alignments length"):
+        plot_title:str="Basecalled reads length vs alignments length",
+        groupby:str=None):
         """
         Plot a 2D distribution of length of the reads vs length of the alignments
         * colorscale
@@ -692,6 +1158,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         # Verify that alignemnt information are available
         if not self.has_alignment:
@@ -708,11 +1176,13 @@ class pycoQC_plot ():
             y_nbins = y_nbins,
             colorscale = colorscale,
             smooth_sigma=smooth_sigma,
+            groupby=groupby,
             width=width,
             height=height,
             plot_title = plot_title)
         return fig
 
+    @cached_plot
     def align_len_identity_freq_2D (self,
         colorscale = [
             [0.0,'rgba(255,255,255,0)'],
@@ -725,7 +1195,8 @@ class pycoQC_plot ():
         smooth_sigma:float=2,
         width:int=None,
         height:int=600,
-        plot_title:str="Aligned reads length vs alignments identity"):
+        plot_title:str="Aligned reads length vs alignments identity",
+        groupby:str=None):
         """
         Plot a 2D distribution of alignments length vs alignments identity
         * colorscale
@@ -742,6 +1213,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         # Verify that alignemnt information are available
         if not self.has_identity_freq:
@@ -758,11 +1231,13 @@ class pycoQC_plot ():
             y_nbins = y_nbins,
             colorscale = colorscale,
             smooth_sigma=smooth_sigma,
+            groupby=groupby,
             width=width,
             height=height,
             plot_title = plot_title)
         return fig
 
+    @cached_plot
     def read_qual_identity_freq_2D (self,
         colorscale = [
             [0.0,'rgba(255,255,255,0)'],
@@ -776,7 +1251,8 @@ class pycoQC_plot ():
         smooth_sigma:float=1,
         width:int=None,
         height:int=600,
-        plot_title:str="Reads PHRED quality vs alignments identity"):
+        plot_title:str="Reads PHRED quality vs alignments identity",
+        groupby:str=None):
         """
         Plot a 2D distribution of read quality vs alignments identity
         * colorscale
@@ -793,6 +1269,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         # Verify that alignemnt information are available
         if not self.has_identity_freq:
@@ -809,6 +1287,7 @@ class pycoQC_plot ():
             y_nbins = y_nbins,
             colorscale = colorscale,
             smooth_sigma=smooth_sigma,
+            groupby=groupby,
             width=width,
             height=height,
             plot_title = plot_title)
@@ -816,13 +1295,15 @@ class pycoQC_plot ():
 
     def __2D_density_plot (self,
         x_field_name, y_field_name, x_lab, y_lab, x_scale, y_scale, x_nbins, y_nbins,
-        colorscale, smooth_sigma, width, height, plot_title):
+        colorscale, smooth_sigma, groupby, width, height, plot_title):
         """Private function generating density plots for all 2D distribution functions"""
         self.logger.info ("\t\tComputing plot")
 
         # Prepare all data
-        lab1, dd1 = self.__2D_density_data ("all", x_field_name, y_field_name, x_nbins, y_nbins, x_scale, y_scale, smooth_sigma)
-        lab2, dd2 = self.__2D_density_data ("pass", x_field_name, y_field_name, x_nbins, y_nbins, x_scale, y_scale, smooth_sigma)
+        plot_data = self._plot_data (functools.partial (self.__2D_density_data, x_field_name=x_field_name, y_field_name=y_field_name,
+            x_scale=x_scale, y_scale=y_scale, groupby=groupby), groupby=groupby)
+        data_list = [self.__2D_density_bin (label, level_data, x_scale, y_scale, x_nbins, y_nbins, smooth_sigma) for label, level_data in plot_data]
+        lab1, dd1 = data_list[0]
 
         # Plot initial data
         data = [
@@ -833,9 +1314,8 @@ class pycoQC_plot ():
 
         # Create update buttons
         updatemenus = [
-            dict (type="buttons", active=0, x=-0.2, y=0, xanchor='left', yanchor='bottom', buttons = [
-                dict (label=lab1, method='restyle', args=[dd1]),
-                dict (label=lab2, method='restyle', args=[dd2])])]
+            dict (type="dropdown" if groupby else "buttons", active=0, x=-0.2, y=0, xanchor='left', yanchor='bottom', buttons = [
+                dict (label=lab, method='restyle', args=[dd]) for lab, dd in data_list])]
 
         # tweak plot layout
         layout = go.Layout (
@@ -851,53 +1331,144 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
-    def __2D_density_data (self, df_level, x_field_name, y_field_name, x_nbins, y_nbins, x_scale, y_scale, smooth_sigma):
-        """ Private function preparing data for 2D_density_plot """
-
-        self.logger.debug ("\t\tPreparing data for {} reads".format(df_level))
-
-        # Extract data field from df
-        df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
-        df = df[[x_field_name, y_field_name]].dropna()
-
-        # Prepare data for x
-        x_data = df[x_field_name].values
-        x_min, x_med, x_max = np.percentile (x_data, (0, 50, 100))
-        if x_scale == "log":
-            x_bins = np.logspace (start=np.log10((x_min)), stop=np.log10(x_max)+0.1, num=x_nbins, base=10)
-        else:
-            x_bins = np.linspace (start=x_min, stop=x_max, num=x_nbins)
-
-        # Prepare data for y
-        y_data = df[y_field_name].values
-        y_min, y_med, y_max = np.percentile (y_data, (0, 50, 100))
-        if y_scale == "log":
-            y_bins = np.logspace (start=np.log10((y_min)), stop=np.log10(y_max)+0.1, num=y_nbins, base=10)
-        else:
-            y_bins = np.linspace (start=y_min, stop=y_max, num=y_nbins)
-
-        # Compute 2D histogram
-        z, y, x = np.histogram2d (x=y_data, y=x_data, bins=[y_bins, x_bins])
+    def __2D_density_data (self, x_field_name, y_field_name, x_scale, y_scale, groupby=None):
+        """Private function preparing the plot ready data of 2D_density_plot. Values are counted in PLOT_DATA_2D_BINS bins for each level of reads"""
+        plot_data = []
+        for df_level, group in self._iter_levels(groupby, field_names=[x_field_name, y_field_name]):
+            self.logger.debug ("\t\tPreparing data for {} reads".format(df_level))
+
+            # Extract data field from df
+            df, sf = self._get_view(df_level, groupby=groupby, group=group)
+            df = df[[x_field_name, y_field_name]].dropna()
+            x_data = df[x_field_name].values
+            y_data = df[y_field_name].values
+            x_min, x_med, x_max = np.percentile (x_data, (0, 50, 100))
+            y_min, y_med, y_max = np.percentile (y_data, (0, 50, 100))
+
+            # Compute 2D histogram
+            x_bins = self._hist_bins (x_min, x_max, x_scale, PLOT_DATA_2D_BINS[0]+1)
+            y_bins = self._hist_bins (y_min, y_max, y_scale, PLOT_DATA_2D_BINS[1]+1)
+            z, y, x = np.histogram2d (x=y_data, y=x_data, bins=[y_bins, x_bins])
+
+            label = "{} Reads".format(df_level.capitalize())
+            if group:
+                label += " {}".format(group)
+            plot_data.append ((label, OrderedDict ((
+                ("x_min", x_min), ("x_med", x_med), ("x_max", x_max),
+                ("y_min", y_min), ("y_med", y_med), ("y_max", y_max),
+                ("counts", z.astype(np.int64))))))
+        return plot_data
+
+    def __2D_density_bin (self, label, level_data, x_scale, y_scale, x_nbins, y_nbins, smooth_sigma):
+        """Private function binning the plot ready data of a level of reads for 2D_density_plot"""
+        # Rebin counts in y_nbins-1 x x_nbins-1 bins
+        x = self._hist_bins (level_data["x_min"], level_data["x_max"], x_scale, x_nbins)
+        y = self._hist_bins (level_data["y_min"], level_data["y_max"], y_scale, y_nbins)
+        z = self._rebin (self._rebin (level_data["counts"], y_nbins-1, axis=0), x_nbins-1, axis=1)
         if smooth_sigma:
             z = gaussian_filter(z, sigma=smooth_sigma)
         z_min, z_max = np.percentile (z, (0, 100))
 
         # Extract label and values
         data_dict = dict (
-            x = [x, [x_med]], y = [y, [y_med]], z = [z, None],
+            x = [x, [level_data["x_med"]]], y = [y, [level_data["y_med"]]], z = [z, None],
             contours = [dict(start=z_min, end=z_max, size=(z_max-z_min)/15),None])
 
-        label = "{} Reads".format(df_level.capitalize())
         return (label, data_dict)
 
+    #~~~~~~~PASS THRESHOLD SWEEP METHOD~~~~~~~#
+    @cached_plot
+    def pass_threshold_sweep (self,
+        colorscale:list = [[0.0,'rgba(255,255,255,0)'], [0.1,'rgb(255,150,0)'], [0.25,'rgb(255,200,0)'], [0.5,'rgb(200,230,0)'], [1.0,'rgb(0,150,0)']],
+        qual_thresholds:list=None,
+        len_thresholds:list=None,
+        width:int=None,
+        height:int=600,
+        plot_title:str="Pass reads for quality and length thresholds"):
+        """
+        Plot the reads, bases and N50 of pass reads for a grid of minimum quality and minimum length thresholds
+        * colorscale
+            a valid plotly color scale https://plot.ly/python/colorscales/ (Not recommanded to change)
+        * qual_thresholds
+            List of minimum quality values. By default every integer value from 0 to the maximal read quality
+        * len_thresholds
+            List of minimum read length values. By default 0 and log spaced values up to the maximal read length
+        * width
+            With of the plotting area in pixel
+        * height
+            height of the plotting area in pixel
+        * plot_title
+            Title to display on top of the plot
+        """
+        self.logger.info ("\t\tComputing plot")
+
+        # Prepare all data
+        plot_data = self._plot_data (functools.partial (self.__pass_threshold_sweep_data, qual_thresholds=qual_thresholds, len_thresholds=len_thresholds),
+            qual_thresholds=qual_thresholds, len_thresholds=len_thresholds)
+        reads = np.asarray(plot_data["reads"])
+        bases = np.asarray(plot_data["bases"])
+        N50 = np.asarray(plot_data["N50"], dtype=np.float64)
+
+        # Length thresholds are not evenly spaced and displayed as categories
+        x = ["≥{:,}".format(v) for v in plot_data["len_thresholds"]]
+        y = list(plot_data["qual_thresholds"])
+        total_reads = max(reads.max(), 1)
+        total_bases = max(bases.max(), 1)
+        text = [["Reads: {:,} ({:.2%})<br>Bases: {:,} ({:.2%})<br>N50: {}".format(
+            int(r), r/total_reads, int(b), b/total_bases, "{:,}".format(int(n)) if not np.isnan(n) else "NA")
+            for r, b, n in zip(r_row, b_row, n_row)] for r_row, b_row, n_row in zip(reads, bases, N50)]
+
+        # Plot initial data
+        data = [
+            go.Heatmap(x=x, y=y, z=reads, text=text, colorscale=colorscale, xgap=0.5, ygap=0.5,
+                hoverinfo="text", name="Sweep"),
+            go.Scatter (x=["≥{:,}".format(plot_data["min_pass_len"])], y=[plot_data["min_pass_qual"]], mode='markers', name='Current thresholds',
+                hoverinfo="name", marker={"size":12,"color":'black', "symbol":"x"})]
+
+        # Create update buttons
+        updatemenus = [
+            dict (type="buttons", active=0, x=-0.06, y=0, xanchor='right', yanchor='bottom', buttons = [
+                dict (label="Reads", method='restyle', args=[dict(z=[reads, None])]),
+                dict (label="Bases", method='restyle', args=[dict(z=[bases, None])]),
+                dict (label="N50", method='restyle', args=[dict(z=[N50, None])])])]
+
+        # tweak plot layout
+        layout = go.Layout (
+            hovermode = "closest",
+            plot_bgcolor="whitesmoke",
+            showlegend = False,
+            width = width,
+            height = height,
+            updatemenus = updatemenus,
+            title = {"text":plot_title, "xref":"paper" ,"x":0.5, "xanchor":"center"},
+            xaxis = {"title":"Minimum read length", "type":"category", "zeroline":False, "showline":False, "showgrid":False},
+            yaxis = {"title":"Minimum PHRED quality", "zeroline":False, "showline":False, "showgrid":False})
+
+        return go.Figure (data=data, layout=layout)
+
+    def __pass_threshold_sweep_data (self, qual_thresholds=None, len_thresholds=None):
+        """Private function preparing the plot ready data of pass_threshold_sweep, with one row per quality threshold"""
+        df = self.pass_threshold_sweep_data (qual_thresholds=qual_thresholds, len_thresholds=len_thresholds)
+        plot_data = OrderedDict ()
+        for field in ("reads", "bases", "N50"):
+            pivot_df = df.pivot(index="min_pass_qual", columns="min_pass_len", values=field)
+            plot_data[field] = pivot_df.values
+        plot_data["qual_thresholds"] = pivot_df.index.values
+        plot_data["len_thresholds"] = pivot_df.columns.values
+        plot_data["min_pass_qual"] = self.min_pass_qual
+        plot_data["min_pass_len"] = self.min_pass_len
+        return plot_data
+
     #~~~~~~~OUTPUT_OVER_TIME METHODS AND HELPER~~~~~~~#
+    @cached_plot
     def output_over_time (self,
         cumulative_color:str="rgb(204,226,255)",
         interval_color:str="rgb(102,168,255)",
         time_bins:int=500,
         width:int=None,
         height:int=500,
-        plot_title:str="Output over experiment time"):
+        plot_title:str="Output over experiment time",
+        groupby:str=None):
         """
         Plot a yield over time
         * cumulative_color
@@ -912,14 +1483,15 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         self.logger.info ("\t\tComputing plot")
 
         # Prepare all data
-        lab1, dd1, ld1 = self.__output_over_time_data (df_level="all", count_level="reads", time_bins=time_bins)
-        lab2, dd2, ld2 = self.__output_over_time_data (df_level="pass", count_level="reads", time_bins=time_bins)
-        lab3, dd3, ld3 = self.__output_over_time_data (df_level="all", count_level="bases", time_bins=time_bins)
-        lab4, dd4, ld4 = self.__output_over_time_data (df_level="pass", count_level="bases", time_bins=time_bins)
+        plot_data = self._plot_data (functools.partial (self.__output_over_time_data, groupby=groupby), groupby=groupby)
+        data_list = [self.__output_over_time_bin (label, level_data, time_bins) for label, level_data in plot_data]
+        lab1, dd1, ld1 = data_list[0]
 
         # Plot initial data
         common = {
@@ -938,11 +1510,8 @@ class pycoQC_plot ():
 
         # Create update buttons
         updatemenus = [
-            dict (type="buttons", active=0, x=-0.06, y=0, xanchor='right', yanchor='bottom', buttons = [
-                dict (label=lab1,  method='update', args=[dd1, ld1]),
-                dict (label=lab2, method='update', args=[dd2, ld2]),
-                dict (label=lab3,  method='update', args=[dd3, ld3]),
-                dict (label=lab4, method='update', args=[dd4, ld4])])]
+            dict (type="dropdown" if groupby else "buttons", active=0, x=-0.06, y=0, xanchor='right', yanchor='bottom', buttons = [
+                dict (label=lab, method='update', args=[dd, ld]) for lab, dd, ld in data_list])]
 
         # tweak plot layout
         layout = go.Layout (
@@ -957,27 +1526,53 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
-    def __output_over_time_data (self, df_level, count_level, time_bins=500):
-        """Private function preparing data for output_over_time"""
-        self.logger.debug ("\t\tPreparing data for {} {}".format(df_level, count_level))
-
-        # Get data and scaling factor
-        df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
-        sf = self.pass_scaling_factor if df_level == "pass" else self.all_scaling_factor
-
-        # Bin data in categories
-        t = (df["start_time"]/3600).values
-        x = np.linspace (t.min(), t.max(), num=time_bins)
-        t = np.digitize (t, bins=x, right=True)
-
-        # Count reads or bases per categories
-        if count_level == "reads":
-            y = np.bincount(t)
-        elif count_level == "bases":
-            y = np.bincount(t, weights=df["read_len"].values)
+    def __output_over_time_data (self, groupby=None):
+        """
+        Private function preparing the plot ready data of output_over_time. Reads and bases are counted in PLOT_DATA_TIME_BINS
+        time bins for each level of reads
+        """
+        plot_data = []
+        for count_level in ("reads", "bases"):
+            for df_level, group in self._iter_levels(groupby):
+                self.logger.debug ("\t\tPreparing data for {} {}".format(df_level, count_level))
+
+                # Get data and scaling factor
+                df, sf = self._get_view(df_level, groupby=groupby, group=group)
+
+                # Bin data in categories. The first bin only contains the reads starting at t_min
+                t = (df["start_time"]/3600).values
+                t_min, t_max = float(t.min()), float(t.max())
+                t = np.digitize (t, bins=np.linspace (t_min, t_max, num=PLOT_DATA_TIME_BINS+1), right=True)
+
+                # Count reads or bases per categories
+                if count_level == "reads":
+                    y = np.bincount(t, minlength=PLOT_DATA_TIME_BINS+1)
+                elif count_level == "bases":
+                    y = np.bincount(t, weights=df["read_len"].values, minlength=PLOT_DATA_TIME_BINS+1)
+
+                label = "{} {}".format(df_level.capitalize(), count_level.capitalize())
+                if group:
+                    label += " {}".format(group)
+
+                plot_data.append ((label, OrderedDict ((
+                    ("count_level", count_level),
+                    ("t_min", t_min),
+                    ("t_max", t_max),
+                    ("counts", y),
+                    ("scaling_factor", sf)))))
+        return plot_data
+
+    def __output_over_time_bin (self, label, level_data, time_bins=500):
+        """Private function binning the plot ready data of a level of reads for output_over_time"""
+        count_level = level_data["count_level"]
+
+        # Rebin data in time_bins categories
+        x = np.linspace (level_data["t_min"], level_data["t_max"], num=time_bins)
+        counts = np.asarray(level_data["counts"], dtype=np.float64)
+        y = np.concatenate ((counts[:1], self._rebin (counts[1:], time_bins-1)))
 
         # Scale counts in case of downsampling
-        y = y*sf
+        y = y*level_data["scaling_factor"]
 
         # Transform to cummulative distribution
         y_cum = np.cumsum(y)
@@ -1008,10 +1603,10 @@ class pycoQC_plot ():
         # Make layout dict = offset for labels on top
         layout_dict = {"yaxis.range": [0, y_cum_max+y_cum_max/6]}
 
-        label = "{} {}".format(df_level.capitalize(), count_level.capitalize())
         return (label, data_dict, layout_dict)
 
     #~~~~~~~QUAL_OVER_TIME METHODS AND HELPER~~~~~~~#
+    @cached_plot
     def read_len_over_time (self,
         median_color:str="rgb(102,168,255)",
         quartile_color:str="rgb(153,197,255)",
@@ -1020,7 +1615,8 @@ class pycoQC_plot ():
         time_bins:int=500,
         width:int=None,
         height:int=500,
-        plot_title:str="Read length over experiment time"):
+        plot_title:str="Read length over experiment time",
+        groupby:str=None):
         """
         Plot a read length over time
         * median_color
@@ -1039,6 +1635,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         fig = self.__over_time_plot (
             field_name = "read_len",
@@ -1050,10 +1648,12 @@ class pycoQC_plot ():
             extreme_color = extreme_color,
             smooth_sigma = smooth_sigma,
             time_bins = time_bins,
+            groupby = groupby,
             width = width,
             height = height)
         return fig
 
+    @cached_plot
     def read_qual_over_time (self,
         median_color:str="rgb(250,128,114)",
         quartile_color:str="rgb(250,170,160)",
@@ -1062,7 +1662,8 @@ class pycoQC_plot ():
         time_bins:int=500,
         width:int=None,
         height:int=500,
-        plot_title:str="Read quality over experiment time"):
+        plot_title:str="Read quality over experiment time",
+        groupby:str=None):
         """
         Plot a mean quality over time
         * median_color
@@ -1081,6 +1682,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
 
         fig = self.__over_time_plot (
@@ -1093,10 +1696,12 @@ class pycoQC_plot ():
             extreme_color = extreme_color,
             smooth_sigma = smooth_sigma,
             time_bins = time_bins,
+            groupby = groupby,
             width = width,
             height = height)
         return fig
 
+    @cached_plot
     def align_len_over_time (self,
         median_color:str="rgb(102,168,255)",
         quartile_color:str="rgb(153,197,255)",
@@ -1105,7 +1710,8 @@ class pycoQC_plot ():
         time_bins:int=500,
         width:int=None,
         height:int=500,
-        plot_title:str="Aligned reads length over experiment time"):
+        plot_title:str="Aligned reads length over experiment time",
+        groupby:str=None):
         """
         Plot a aligned reads length over time
         * median_color
@@ -1124,6 +1730,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
         # Verify that alignemnt information are available
         if not self.has_alignment:
@@ -1139,10 +1747,12 @@ class pycoQC_plot ():
             extreme_color = extreme_color,
             smooth_sigma = smooth_sigma,
             time_bins = time_bins,
+            groupby = groupby,
             width = width,
             height = height)
         return fig
 
+    @cached_plot
     def identity_freq_over_time (self,
         median_color:str="rgb(250,128,114)",
         quartile_color:str="rgb(250,170,160)",
@@ -1151,7 +1761,8 @@ class pycoQC_plot ():
         time_bins:int=500,
         width:int=None,
         height:int=500,
-        plot_title:str="Aligned reads identity over experiment time"):
+        plot_title:str="Aligned reads identity over experiment time",
+        groupby:str=None):
         """
         Plot the alignment identity scores over time
         * median_color
@@ -1170,6 +1781,8 @@ class pycoQC_plot ():
             height of the plotting area in pixel
         * plot_title
             Title to display on top of the plot
+        * groupby
+            Field to group the reads by (barcode or run_id). A dropdown menu gives access to the plot of each group
         """
 
         # Verify that alignemnt information are available
@@ -1186,6 +1799,7 @@ class pycoQC_plot ():
             extreme_color = extreme_color,
             smooth_sigma = smooth_sigma,
             time_bins = time_bins,
+            groupby = groupby,
             width = width,
             height = height)
         return fig
@@ -1200,13 +1814,16 @@ class pycoQC_plot ():
         extreme_color,
         smooth_sigma,
         time_bins,
+        groupby,
         width,
         height):
         """Private function generating density plots for all over_time functions"""
         self.logger.info ("\t\tComputing plot")
 
-        lab1, dd1 = self.__over_time_data (df_level="all", field_name=field_name, smooth_sigma=smooth_sigma, time_bins=time_bins)
-        lab2, dd2 = self.__over_time_data (df_level="pass", field_name=field_name, smooth_sigma=smooth_sigma, time_bins=time_bins)
+        plot_data = self._plot_data (functools.partial (self.__over_time_data, field_name=field_name, time_bins=time_bins, groupby=groupby),
+            time_bins=time_bins, groupby=groupby)
+        data_list = [self.__over_time_smooth (label, data_dict, smooth_sigma) for label, data_dict in plot_data]
+        lab1, dd1 = data_list[0]
 
         # Plot initial data
         common = {
@@ -1221,11 +1838,9 @@ class pycoQC_plot ():
 
         # Create update buttons
         updatemenus = [
-            go.layout.Updatemenu (type="buttons", active=0, x=-0.07, y=0, xanchor='right', yanchor='bottom', buttons = [
+            go.layout.Updatemenu (type="dropdown" if groupby else "buttons", active=0, x=-0.07, y=0, xanchor='right', yanchor='bottom', buttons = [
                 go.layout.updatemenu.Button (
-                    label=lab1, method='restyle', args=[dd1]),
-                go.layout.updatemenu.Button (
-                    label=lab2, method='restyle', args=[dd2])])]
+                    label=lab, method='restyle', args=[dd]) for lab, dd in data_list])]
 
         # tweak plot layout
         layout = go.Layout (
@@ -1240,51 +1855,58 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
-    def __over_time_data (self, df_level, field_name="read_len", smooth_sigma=1.5, time_bins=500):
-        """Private function preparing data for qual_over_time"""
-        self.logger.debug ("\t\tPreparing data for {} reads and {}".format(df_level, field_name))
-
-        # get data
-        df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
-        data = df[field_name].dropna().values
-
-        # Bin data in categories
-        t = (df["start_time"]/3600).values
-        x = np.linspace (t.min(), t.max(), num=time_bins)
-        t = np.digitize (t, bins=x, right=True)
-
-        # List quality value per categories
-        bin_dict = defaultdict (list)
-        for bin_idx, val in zip (t, data) :
-            bin = x[bin_idx]
-            bin_dict[bin].append(val)
-
-        # Aggregate values per category
-        val_name = ["Min", "Max", "25%", "75%", "Median"]
-        stat_dict = defaultdict(list)
-        for bin in x:
-            if bin in bin_dict:
-                p = np.percentile (bin_dict[bin], [0, 100, 25, 75, 50])
-            else:
-                p = [np.nan,np.nan,np.nan,np.nan,np.nan]
-            for val, stat in zip (val_name, p):
-                stat_dict[val].append(stat)
-
-        # Values smoothing
+    def __over_time_data (self, field_name="read_len", time_bins=500, groupby=None):
+        """Private function preparing the plot ready data of qual_over_time for each level of reads"""
+        plot_data = []
+        for df_level, group in self._iter_levels(groupby, field_names=[field_name]):
+            self.logger.debug ("\t\tPreparing data for {} reads and {}".format(df_level, field_name))
+
+            # get data
+            df, sf = self._get_view(df_level, groupby=groupby, group=group)
+            data = df[field_name].dropna().values
+
+            # Bin data in categories
+            t = (df["start_time"]/3600).values
+            x = np.linspace (t.min(), t.max(), num=time_bins)
+            t = np.digitize (t, bins=x, right=True)
+
+            # List quality value per categories
+            bin_dict = defaultdict (list)
+            for bin_idx, val in zip (t, data) :
+                bin = x[bin_idx]
+                bin_dict[bin].append(val)
+
+            # Aggregate values per category
+            val_name = ["Min", "Max", "25%", "75%", "Median"]
+            stat_dict = defaultdict(list)
+            for bin in x:
+                if bin in bin_dict:
+                    p = np.percentile (bin_dict[bin], [0, 100, 25, 75, 50])
+                else:
+                    p = [np.nan,np.nan,np.nan,np.nan,np.nan]
+                for val, stat in zip (val_name, p):
+                    stat_dict[val].append(stat)
+
+            # make data dict
+            data_dict = dict(
+                x = [x,x,x,x,x],
+                y = [stat_dict["Min"], stat_dict["Max"], stat_dict["25%"], stat_dict["75%"], stat_dict["Median"]],
+                name = val_name)
+
+            label = "{} Reads".format(df_level.capitalize())
+            if group:
+                label += " {}".format(group)
+            plot_data.append ((label, data_dict))
+        return plot_data
+
+    def __over_time_smooth (self, label, data_dict, smooth_sigma=1.5):
+        """Private function smoothing the plot ready data of a level of reads for qual_over_time"""
         if smooth_sigma:
-            for val in val_name:
-                stat_dict [val] = gaussian_filter1d (stat_dict [val], sigma=smooth_sigma)
-
-        # make data dict
-        data_dict = dict(
-            x = [x,x,x,x,x],
-            y = [stat_dict["Min"], stat_dict["Max"], stat_dict["25%"], stat_dict["75%"], stat_dict["Median"]],
-            name = val_name)
-
-        label = "{} Reads".format(df_level.capitalize())
+            data_dict = dict(data_dict, y=[gaussian_filter1d (np.asarray(y, dtype=np.float64), sigma=smooth_sigma) for y in data_dict["y"]])
         return (label, data_dict)
 
     #~~~~~~~BARCODE_COUNT METHODS AND HELPER~~~~~~~#
+    @cached_plot
     def barcode_counts (self,
         colors:list=["#f8bc9c", "#f6e9a1", "#f5f8f2", "#92d9f5", "#4f97ba"],
         width:int= None,
@@ -1307,8 +1929,7 @@ class pycoQC_plot ():
         self.logger.info ("\t\tComputing plot")
 
         # Prepare all data
-        lab1, dd1 = self.__barcode_counts_data (df_level="all")
-        lab2, dd2 = self.__barcode_counts_data (df_level="pass")
+        (lab1, dd1), (lab2, dd2) = self._plot_data (self.__barcode_counts_data)
 
         # Plot initial data
         data= [go.Pie (labels=dd1["labels"][0] , values=dd1["values"][0] , sort=False, marker=dict(colors=colors))]
@@ -1330,24 +1951,28 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
-    def __barcode_counts_data (self, df_level):
-        """Private function preparing data for barcode_counts"""
-        self.logger.debug ("\t\tPreparing data for {} reads".format(df_level))
+    def __barcode_counts_data (self):
+        """Private function preparing the plot ready data of barcode_counts for all and pass reads"""
+        plot_data = []
+        for df_level in ("all", "pass"):
+            self.logger.debug ("\t\tPreparing data for {} reads".format(df_level))
 
-        # get data
-        df = self.pass_df if df_level == "pass" else self.all_df
-        counts = df["barcode"].value_counts()
-        counts = counts.sort_index()
+            # get data
+            df = self.pass_df if df_level == "pass" else self.all_df
+            counts = df["barcode"].value_counts()
+            counts = counts.sort_index()
 
-        # Extract label and values
-        data_dict = dict (
-            labels = [counts.index],
-            values = [counts.values])
+            # Extract label and values
+            data_dict = dict (
+                labels = [counts.index.astype(str).tolist()],
+                values = [counts.values])
 
-        label = "{} Reads".format(df_level.capitalize())
-        return (label, data_dict)
+            label = "{} Reads".format(df_level.capitalize())
+            plot_data.append ((label, data_dict))
+        return plot_data
 
     #~~~~~~~BARCODE_COUNT METHODS AND HELPER~~~~~~~# ############################################################################# ADD TABLE AS IN ALIGNMENTS
+    @cached_plot
     def channels_activity (self,
         colorscale:list = [
             [0.0,'rgba(255,255,255,0)'],
@@ -1378,14 +2003,9 @@ class pycoQC_plot ():
         """
         self.logger.info ("\t\tComputing plot")
 
-        # Define maximal number of channels
-        n_channels = 3000 if self.is_promethion else 512
-
         # Prepare all data
-        lab1, dd1 = self.__channels_activity_data(df_level="all", count_level="reads", n_channels=n_channels, smooth_sigma=smooth_sigma, time_bins=time_bins)
-        lab2, dd2 = self.__channels_activity_data(df_level="pass", count_level="reads", n_channels=n_channels, smooth_sigma=smooth_sigma, time_bins=time_bins)
-        lab3, dd3 = self.__channels_activity_data(df_level="all", count_level="bases", n_channels=n_channels, smooth_sigma=smooth_sigma, time_bins=time_bins)
-        lab4, dd4 = self.__channels_activity_data(df_level="pass", count_level="bases", n_channels=n_channels, smooth_sigma=smooth_sigma, time_bins=time_bins)
+        plot_data = self._plot_data (functools.partial (self.__channels_activity_data, time_bins=time_bins), time_bins=time_bins)
+        (lab1, dd1), (lab2, dd2), (lab3, dd3), (lab4, dd4) = [self.__channels_activity_smooth (label, data_dict, smooth_sigma) for label, data_dict in plot_data]
 
         # Plot initial data
         data = [go.Heatmap(x=dd1["x"][0], y=dd1["y"][0], z=dd1["z"][0], xgap=0.5, colorscale=colorscale, hoverinfo="x+y+z")]
@@ -1410,49 +2030,53 @@ class pycoQC_plot ():
 
         return go.Figure (data=data, layout=layout)
 
-    def __channels_activity_data (self, df_level, count_level="bases", n_channels=512, smooth_sigma=2, time_bins=150):
-        """Private function preparing data for channels_activity"""
-        self.logger.debug ("\t\tPreparing data for {} {}".format(df_level, count_level))
-
-        # Get data and scaling factor
-        df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
-        sf = self.pass_scaling_factor if df_level == "pass" else self.all_scaling_factor
-
-        # Bin data in categories
-        t = (df["start_time"]/3600).values
-        bins = np.linspace (t.min(), t.max(), num=time_bins)
-        t = np.digitize (t, bins=bins, right=True)
-
-        # Count values per categories
-        z = np.ones((len(bins), n_channels), dtype=np.int)
-        if count_level == "bases":
-            for t_idx, channel, n_bases in zip(t, df["channel"], df["read_len"]):
-                z[t_idx][channel-1]+=n_bases
-        elif count_level == "reads":
-            for t_idx, channel in zip(t, df["channel"]):
-                try:
-                    z[t_idx][channel-1]+=1
-                except IndexError:
-                    print (t_idx, channel)
-                    raise
-        # Scale counts in case of downsampling
-        z=z*sf
+    def __channels_activity_data (self, time_bins=150):
+        """Private function preparing the plot ready data of channels_activity for all and pass reads and bases"""
+        # Define maximal number of channels
+        n_channels = 3000 if self.is_promethion else 512
 
-        # Time series smoothing
+        plot_data = []
+        for count_level, df_level in (("reads", "all"), ("reads", "pass"), ("bases", "all"), ("bases", "pass")):
+            self.logger.debug ("\t\tPreparing data for {} {}".format(df_level, count_level))
+
+            # Get data and scaling factor
+            df = self.pass_sample_df if df_level == "pass" else self.all_sample_df
+            sf = self.pass_scaling_factor if df_level == "pass" else self.all_scaling_factor
+
+            # Bin data in categories
+            t = (df["start_time"]/3600).values
+            bins = np.linspace (t.min(), t.max(), num=time_bins)
+            t = np.digitize (t, bins=bins, right=True)
+
+            # Count values per categories with a single bincount over the flat (time, channel) index
+            z = np.ones((len(bins), n_channels), dtype=np.int64)
+            flat_idx = t*n_channels + (df["channel"].values.astype(np.int64)-1)
+            if count_level == "bases":
+                z += np.bincount(flat_idx, weights=df["read_len"].values, minlength=z.size).astype(np.int64).reshape(z.shape)
+            elif count_level == "reads":
+                z += np.bincount(flat_idx, minlength=z.size).reshape(z.shape)
+            # Scale counts in case of downsampling
+            z=z*sf
+
+            # Define x and y axis
+            x = ["c {}".format(i) for i in range(1, n_channels+1)]
+            y = bins[1:]
+
+            # Make data dict
+            data_dict = dict (x=[x], y=[y], z=[z])
+
+            label = "{} {}".format(df_level.capitalize(), count_level.capitalize())
+            plot_data.append ((label, data_dict))
+        return plot_data
+
+    def __channels_activity_smooth (self, label, data_dict, smooth_sigma=2):
+        """Private function smoothing the plot ready data of channels_activity over time"""
         if smooth_sigma:
-            z = gaussian_filter1d (z.astype(np.float32), sigma=smooth_sigma, axis=0)
-
-        # Define x and y axis
-        x = ["c {}".format(i) for i in range(1, n_channels+1)]
-        y = bins[1:]
-
-        # Make data dict
-        data_dict = dict (x=[x], y=[y], z=[z])
-
-        label = "{} {}".format(df_level.capitalize(), count_level.capitalize())
+            data_dict = dict (data_dict, z=[gaussian_filter1d (np.asarray(data_dict["z"][0], dtype=np.float32), sigma=smooth_sigma, axis=0)])
         return (label, data_dict)
 
     #~~~~~~~ALIGNMENT_SUMMARY METHOD~~~~~~~#
+    @cached_plot
     def alignment_reads_status (self,
         colors:list=["#f44f39","#fc8161","#fcaf94","#828282"],
         width:int= None,
@@ -1474,7 +2098,8 @@ class pycoQC_plot ():
             raise pycoQCError ("No Alignment information available")
         self.logger.info ("\t\tComputing plot")
 
-        df = self.alignments_df
+        df = pd.DataFrame (self._plot_data (lambda: OrderedDict ((col, self.alignments_df[col].values) for col in self.alignments_df)))
+
         # Create empty multiplot figure
         fig = make_subplots(rows=1, cols=2, column_widths=[0.4, 0.6], specs=[[{"type": "table"},{"type": "pie"}]])
 
@@ -1504,6 +2129,7 @@ class pycoQC_plot ():
         return fig
 
     #~~~~~~~ALIGNMENT RATE METHOD AND HELPER~~~~~~~#
+    @cached_plot
     def alignment_rate (self,
             colors:list=["#fcaf94","#828282","#fc8161","#828282","#f44f39","#d52221","#828282","#828282","#828282","#828282"],
             width:int=None,
@@ -1527,26 +2153,7 @@ class pycoQC_plot ():
         self.logger.info ("\t\tComputing plot")
 
         # Extract Data
-        bc_bases = self.all_df["read_len"].sum()
-        s = self.all_df[[ "read_len", "align_len", "insertion", "deletion", "soft_clip", "mismatch"]].dropna().sum()
-        total_error = s["insertion"]+s["deletion"]+s["mismatch"]
-        matching = s["align_len"]-total_error
-        unmapped = bc_bases-s["read_len"]
-        ct = namedtuple("ct", ["Bases","Counts","Total_freq","Aligned_freq"])
-        l = [
-            ct("Basecalled", bc_bases, 1, 1),
-            ct("Unmapped reads", unmapped, unmapped/bc_bases, 1),
-            ct("Mapped reads", s["read_len"], s["read_len"]/bc_bases, 1),
-            ct("Softclip", s["soft_clip"], s["soft_clip"]/bc_bases, 1),
-            ct("Aligned", s["align_len"], s["align_len"]/bc_bases, 1),
-            ct("Matching", matching, matching/bc_bases, matching/s["align_len"]),
-            ct("Non-matching", total_error, total_error/bc_bases, total_error/s["align_len"]),
-            ct("Insertions", s["insertion"], s["insertion"]/bc_bases, s["insertion"]/s["align_len"]),
-            ct("Deletions", s["deletion"], s["deletion"]/bc_bases, s["deletion"]/s["align_len"]),
-            ct("Mismatches", s["mismatch"], s["mismatch"]/bc_bases, s["mismatch"]/s["align_len"])]
-
-        # Cast to df and compute percentage
-        df = pd.DataFrame(l)
+        df = pd.DataFrame (self._plot_data (self.__alignment_rate_data))
 
         # plot Table
         data1 = go.Table(
@@ -1585,7 +2192,31 @@ class pycoQC_plot ():
 
         return fig
 
+    def __alignment_rate_data (self):
+        """Private function preparing the plot ready data of alignment_rate"""
+        bc_bases = self.all_df["read_len"].sum()
+        s = self.all_df[[ "read_len", "align_len", "insertion", "deletion", "soft_clip", "mismatch"]].dropna().sum()
+        total_error = s["insertion"]+s["deletion"]+s["mismatch"]
+        matching = s["align_len"]-total_error
+        unmapped = bc_bases-s["read_len"]
+        ct = namedtuple("ct", ["Bases","Counts","Total_freq","Aligned_freq"])
+        l = [
+            ct("Basecalled", bc_bases, 1, 1),
+            ct("Unmapped reads", unmapped, unmapped/bc_bases, 1),
+            ct("Mapped reads", s["read_len"], s["read_len"]/bc_bases, 1),
+            ct("Softclip", s["soft_clip"], s["soft_clip"]/bc_bases, 1),
+            ct("Aligned", s["align_len"], s["align_len"]/bc_bases, 1),
+            ct("Matching", matching, matching/bc_bases, matching/s["align_len"]),
+            ct("Non-matching", total_error, total_error/bc_bases, total_error/s["align_len"]),
+            ct("Insertions", s["insertion"], s["insertion"]/bc_bases, s["insertion"]/s["align_len"]),
+            ct("Deletions", s["deletion"], s["deletion"]/bc_bases, s["deletion"]/s["align_len"]),
+            ct("Mismatches", s["mismatch"], s["mismatch"]/bc_bases, s["mismatch"]/s["align_len"])]
+
+        # Cast to columns
+        return OrderedDict ((field, [getattr(i, field) for i in l]) for field in ct._fields)
+
     #~~~~~~~ALIGNMENT COVERAGE METHOD AND HELPER~~~~~~~#
+    @cached_plot
     def alignment_coverage (self,
         nbins:int=500,
         color:str='rgba(70,130,180,0.70)',
@@ -1611,19 +2242,17 @@ class pycoQC_plot ():
             raise pycoQCError ("No Alignment information available")
         self.logger.info ("\t\tComputing plot")
 
-        ref_offset_dict = self._ref_offset(self.ref_len_dict, "left", ret_type="dict")
-        df = self.all_df[["ref_id", "ref_start", "ref_end", "align_len"]].dropna()
-        steps = self.total_ref_len//nbins
-        mean_cov = round(df["align_len"].sum()/self.total_ref_len, 2)
-
-        # Compute coverage by interval
-        l = []
-        for line in df.itertuples():
-            l.append(int(ref_offset_dict[line.ref_id]+line.ref_start))
-        l = np.array(l)
-        bins = np.arange(0, self.total_ref_len, steps)
-        l = np.digitize(l,bins)
-        y = np.bincount(l, weights=df["align_len"])/steps
+        plot_data = self._plot_data (self.__alignment_coverage_data)
+        ref_len_dict = plot_data["ref_len"]
+        total_ref_len = plot_data["total_ref_len"]
+        steps = total_ref_len//nbins
+        mean_cov = plot_data["mean_coverage"]
+
+        # Compute coverage by interval from the cumulated aligned bases at the interval starts
+        counts = np.asarray(plot_data["counts"], dtype=np.float64)
+        bins = np.arange(0, total_ref_len, steps)
+        cum = np.interp(bins, np.linspace(0, total_ref_len, len(counts)+1), np.concatenate(([0], np.cumsum(counts))))
+        y = np.diff(np.concatenate(([0], cum, [counts.sum()])))/steps
 
         # Time series smoothing
         if smooth_sigma:
@@ -1657,11 +2286,11 @@ class pycoQC_plot ():
                 dict (label="linear", method='relayout', args=[{"yaxis":{"title":"Mean Coverage", "type":"linear", "zeroline":False, "fixedrange":True}}])])]
 
         # Add chromosome shading and labels
-        x_lab_coord = np.array(self._ref_offset(self.ref_len_dict, coordinates="middle", ret_type="list"))*nbins/self.total_ref_len
-        x_lab = list(self.ref_len_dict.keys())
+        x_lab_coord = np.array(self._ref_offset(ref_len_dict, coordinates="middle", ret_type="list"))*nbins/total_ref_len
+        x_lab = list(ref_len_dict.keys())
         shapes = []
-        x_shape_coord = np.array(self._ref_offset(self.ref_len_dict, coordinates="left", ret_type="list")[1:])*nbins/self.total_ref_len
-        for i in range(0, len(self.ref_len_dict)-2, 2):
+        x_shape_coord = np.array(self._ref_offset(ref_len_dict, coordinates="left", ret_type="list")[1:])*nbins/total_ref_len
+        for i in range(0, len(ref_len_dict)-2, 2):
             shapes.append(
                 go.layout.Shape(
                     type="rect",x0=x_shape_coord[i],x1=x_shape_coord[i+1],
@@ -1682,6 +2311,22 @@ class pycoQC_plot ():
 
         return go.Figure(data=[data1,data2], layout=layout)
 
+    def __alignment_coverage_data (self):
+        """Private function preparing the plot ready data of alignment_coverage. Aligned bases are counted in PLOT_DATA_COVERAGE_BINS bins over all the references"""
+        ref_offset_dict = self._ref_offset(self.ref_len_dict, "left", ret_type="dict")
+        df = self.all_df[["ref_id", "ref_start", "ref_end", "align_len"]].dropna()
+
+        # Count aligned bases by alignment start position
+        l = (df["ref_id"].map(ref_offset_dict).astype(np.float64)+df["ref_start"]).values.astype(np.int64)
+        counts, bins = np.histogram(l, bins=np.linspace(0, self.total_ref_len, PLOT_DATA_COVERAGE_BINS+1), weights=df["align_len"].values)
+
+        plot_data = OrderedDict ()
+        plot_data["ref_len"] = self.ref_len_dict
+        plot_data["total_ref_len"] = int(self.total_ref_len)
+        plot_data["mean_coverage"] = round(df["align_len"].sum()/self.total_ref_len, 2)
+        plot_data["counts"] = counts
+        return plot_data
+
     def _ref_offset (self, rlen, coordinates="left", ret_type="dict"):
         offset = [] if ret_type=="list" else OrderedDict()
         cumsum=0
@@ -1708,8 +2353,7 @@ class pycoQC_plot ():
 
     @staticmethod
     def _compute_N50 (data):
-        data = data.dropna().values
-        data.sort()
+        data = np.sort(data.dropna().values)
         half_sum = data.sum()/2
         cum_sum = 0
         for v in data:
@@ -1717,6 +2361,31 @@ class pycoQC_plot ():
             if cum_sum >= half_sum:
                 return int(v)
 
+    @staticmethod
+    def _hist_bins (min, max, scale="linear", nbins=200):
+        """Return nbins bin edges evenly spaced in log or linear space from min to max"""
+        if scale == "log":
+            return np.logspace (np.log10(min), np.log10(max)+0.1, nbins)
+        return np.linspace (min, max, nbins)
+
+    @staticmethod
+    def _rebin (counts, nbins, axis=-1):
+        """
+        Rebin the counts of evenly spaced bins along axis into nbins evenly spaced bins spanning the same range, by linear
+        interpolation of the cumulated counts. The counts are unchanged where the bins edges match
+        """
+        counts = np.moveaxis(np.asarray(counts, dtype=np.float64), axis, -1)
+        n = counts.shape[-1]
+        cum = np.concatenate ((np.zeros(counts.shape[:-1]+(1,)), np.cumsum(counts, axis=-1)), axis=-1)
+
+        # Position of the new edges in the old bins
+        pos = np.linspace(0, n, nbins+1)
+        pos = np.where(np.isclose(pos, np.rint(pos)), np.rint(pos), pos)
+        idx = np.minimum(pos.astype(np.int64), n-1)
+        frac = pos-idx
+        cum = cum[..., idx]*(1-frac) + cum[..., idx+1]*frac
+        return np.moveaxis(np.diff(cum, axis=-1), -1, axis)
+
     @staticmethod
     def _compute_hist (data, x_scale="linear", smooth_sigma=2, nbins=200):
 
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
+# Standard library imports
+import json
+import gzip
+import datetime
+import os
+import re
+import uuid
+import base64
+import importlib.util
+
+# Third party imports
+import numpy as np
+import jinja2
+
+# Local imports
+from pycoQC.common import *
+from pycoQC.pycoQC_plot import pycoQC_plot
+from pycoQC import __version__ as package_version
+from pycoQC import __name__ as package_name
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~GLOBAL SETTINGS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+# Aggregate file format identifier and version. Increment the version for any backward incompatible change
+AGGREGATE_FORMAT = "pycoQC_aggregate"
+AGGREGATE_VERSION = 2
+
+# Package templates directory. Resolved from the module path to avoid importing pkg_resources
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Minimal length of numerical arrays to be binary encoded in compact mode
+COMPACT_MIN_ARRAY_LEN = 16
+# Number of significant digits kept for short float arrays in compact mode
+COMPACT_SIG_DIGITS = 6
+# Number of levels used to quantise 2D matrices. The last uint8 value is kept for NaN
+COMPACT_Z_LEVELS = 254
+
+# Javascript function decoding the base64 typed arrays of compact plots into plain arrays
+COMPACT_DECODER_JS = """
+window.pycoQC_decode = window.pycoQC_decode || function decode (o) {
+    if (Array.isArray(o)) {return o.map(decode);}
+    if (o === null || typeof o !== "object") {return o;}
+    if (typeof o.bdata === "string" && typeof o.dtype === "string") {
+        var raw = atob(o.bdata), buf = new ArrayBuffer(raw.length), bytes = new Uint8Array(buf);
+        for (var i = 0; i < raw.length; i++) {bytes[i] = raw.charCodeAt(i);}
+        var arr = new ({"f4":Float32Array, "f8":Float64Array, "u1":Uint8Array, "i4":Int32Array})[o.dtype](buf);
+        var scale = ("scale" in o) ? o.scale : 1, offset = ("offset" in o) ? o.offset : 0, vals = new Array(arr.length);
+        for (var j = 0; j < arr.length; j++) {vals[j] = (arr[j] === o.nan) ? null : arr[j]*scale+offset;}
+        if (!o.shape) {return vals;}
+        var ncol = parseInt(o.shape.split(",")[1]), rows = [];
+        for (var r = 0; r < vals.length; r += ncol) {rows.push(vals.slice(r, r+ncol));}
+        return rows;
+    }
+    var out = {};
+    for (var k in o) {out[k] = decode(o[k]);}
+    return out;
+};"""
+
+# Javascript functions fetching and rendering the plot data files of lazy reports once the plot is about to be displayed
+# Data files are loaded through script tags so that the report also works from a local directory without server
+LAZY_LOADER_JS = """
+window.pycoQC_lazy_render = window.pycoQC_lazy_render || function (id, data, layout) {
+    Plotly.newPlot(id, pycoQC_decode(data), pycoQC_decode(layout), {"responsive":true});
+};
+window.pycoQC_lazy_observe = window.pycoQC_lazy_observe || function (id, src) {
+    var load = function () {
+        var script = document.createElement("script");
+        script.src = src;
+        document.head.appendChild(script);
+    };
+    if (!("IntersectionObserver" in window)) {load(); return;}
+    var observer = new IntersectionObserver(function (entries) {
+        if (entries.some(function (e) {return e.isIntersecting;})) {observer.disconnect(); load();}
+    }, {rootMargin: "200px"});
+    observer.observe(document.getElementById(id));
+};"""
+
+# Placeholder height of lazy plots without explicit height
+LAZY_DEFAULT_HEIGHT = 500
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~AGGREGATE PLOT CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class _Aggregate_plot (pycoQC_plot):
+
+    # Plots are only saved in aggregate files when the corresponding data are available
+    has_barcodes = has_alignment = has_identity_freq = True
+
+    def __init__ (self, logger):
+        """
+        pycoQC_plot building the figures from the plot ready data saved in an aggregate file instead of computing them from
+        the reads. The data of the plot to build are defined in saved_plot_data
+        """
+        self.logger = logger
+        self.cache = None
+        self.last_plot_data = None
+        self.saved_plot_data = None
+
+    def _plot_data (self, data_fn, **data_args):
+        self.last_plot_data = self.saved_plot_data
+        return self.saved_plot_data["data"]
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~MAIN CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+class pycoQC_render ():
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~INIT METHOD~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    def __init__ (self,
+        aggregate_file:str,
+        verbose:bool=False,
+        quiet:bool=False):
+        """
+        Render pycoQC reports from an aggregate file saved by pycoQC, without the raw input files
+        * aggregate_file
+            Path to an aggregate file generated by pycoQC (aggregate_outfile option)
+        * verbose
+            Increase verbosity
+        * quiet
+            Reduce verbosity
+        """
+        # Set logging level
+        self.logger = get_logger (name=__name__, verbose=verbose, quiet=quiet)
+
+        self.logger.warning ("Load aggregate file")
+        self.aggregate = self._read_aggregate(aggregate_file)
+        self.plotter = _Aggregate_plot(self.logger)
+
+    def __repr__(self):
+        return "[{}]\n".format(self.__class__.__name__)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PUBLIC METHODS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    def html_report( self,
+        outfile:str,
+        config_file:str="",
+        template_file:str="",
+        report_title:str="PycoQC report",
+        skip_coverage_plot:bool=False,
+        compact:bool=False,
+        external_plotlyjs:bool=False,
+        plotlyjs_dir:str="",
+        lazy:bool=False):
+        """
+        * outfile
+            Path to an output html file report
+        * config_file
+            Path to a JSON configuration file for the html report. Defines the plots to include, their order and their arguments.
+            The figures are rebuilt from the plot ready data saved in the aggregate file, so the arguments defining which data
+            are computed (groupby, thresholds of pass_threshold_sweep and time_bins of the over time plots and of channels_activity)
+            keep their saved values. Arguments not given keep the values used to generate the aggregate file
+        * template_file
+            Jinja2 html template for the html report
+        * report_title
+            Title to use in the html report
+        * skip_coverage_plot
+            If True the coverage plot is not included in the report
+        * compact
+            If True the plot data are embedded as base64 encoded typed arrays with quantised 2D matrices
+            instead of full precision JSON text. This considerably reduces the size of the report
+        * external_plotlyjs
+            If True plotly.js is written once as a sidecar file next to the report (or in plotlyjs_dir) and referenced
+            from the report instead of being loaded by the template. Useful when writing many reports in the same directory
+        * plotlyjs_dir
+            Shared directory where to write the plotly.js sidecar file when external_plotlyjs is True. By default the
+            file is written in the report directory
+        * lazy
+            If True the data of each plot is written in its own javascript file in a `<report name>_files` directory next to
+            the report and is only loaded when the plot scrolls into view. Recommended for very large reports.
+            The report directory works locally without server
+        """
+        self.logger.info("Generating HTML report")
+
+        # Directory for lazy loaded plot data files
+        if lazy:
+            lazy_dir = "{}_files".format(os.path.splitext(outfile)[0])
+            mkdir(lazy_dir, exist_ok=True)
+
+        # Parse configuration file
+        self.logger.info("\tParsing html config file")
+        config_dict = self._get_config(config_file)
+        self.logger.debug(config_dict)
+
+        # Loop over configuration file and get the figures of the pycoQC functions defined
+        plots = list()
+        titles = list()
+        for method_name, method_args in config_dict.items ():
+            if skip_coverage_plot and method_name == "alignment_coverage":
+                self.logger.info("\tSkipping method {}".format(method_name))
+                continue
+            try:
+                self.logger.info("\tRunning method {}".format(method_name))
+                self.logger.debug ("\t{} ({})".format(method_name, method_args))
+
+                # Store plot title for HTML title and remove from data passed to plotly
+                plot_title = method_args["plot_title"]
+                method_args["plot_title"]=""
+
+                # Get figure and render plot
+                fig = self._get_figure(method_name, method_args)
+                if lazy:
+                    data_fn = os.path.join(lazy_dir, "plot_{:02}_{}.js".format(len(plots)+1, method_name))
+                    plot = self._lazy_plot_div(fig, data_fn, outfile, compact)
+                else:
+                    plot = self._plot_div(fig, compact)
+
+                plots.append(plot)
+                titles.append(plot_title)
+
+            except AttributeError as E:
+                self.logger.info("\t\t{} is not a valid plotting method".format(method_name))
+                self.logger.info("\t\t{}".format(E))
+
+            except pycoQCError as E:
+                self.logger.info("\t\t{}".format(E))
+
+        # Load HTML template for Jinja
+        self.logger.info("\tLoading HTML template")
+        template = self._get_jinja_template(template_file)
+
+        # Set a subtitle for the HTML report
+        report_subtitle="Generated on {} with {} {}".format( datetime.datetime.now().strftime("%d/%m/%y"), package_name, package_version)
+
+        # Define source files list
+        src_files = ""
+        for name, files_list in self._get_src_files().items():
+            if files_list:
+                src_files += "<h4>Source {} files</h4><ul>".format(name)
+                for f in files_list:
+                    f = os.path.abspath(f)
+                    src_files += "<li>{}</li>".format(f)
+                src_files += "</ul>"
+
+        # Write plotly.js as a shared sidecar file or pass it to the template
+        if external_plotlyjs:
+            self.logger.info("\tWriting plotly.js sidecar file")
+            plotlyjs = ""
+            plotlyjs_src = self._write_plotlyjs(outfile, plotlyjs_dir)
+        else:
+            plotlyjs = self._get_plotlyjs()[0]
+            plotlyjs_src = ""
+
+        # Render plots
+        self.logger.info("\tRendering plots in d3js")
+        rendering = template.render(
+            plots=plots,
+            titles=titles,
+            plotlyjs=plotlyjs,
+            plotlyjs_src=plotlyjs_src,
+            report_title=report_title,
+            report_subtitle=report_subtitle,
+            src_files=src_files)
+
+        # Write to HTML file
+        self.logger.info("\tWriting to HTML file")
+        mkbasedir(outfile, exist_ok=True)
+        with open(outfile, "w") as fp:
+            fp.write(rendering)
+
+    def json_report(self,
+        outfile:str):
+        """"""
+        self.logger.info("Generating JSON report")
+        self.logger.info("\tRunning summary_stats_dict method")
+        res_dict = self._get_summary_stats()
+
+        self.logger.info("\tWriting to JSON file")
+        mkbasedir(outfile, exist_ok=True)
+        with open (outfile, "w") as fp:
+            json.dump(res_dict, fp, indent=2)
+
+    #~~~~~~~~~~~~~~PRIVATE FUNCTION~~~~~~~~~~~~~~#
+
+    def _get_figure(self, method_name, method_args):
+        """
+        Rebuild the figure of a plotting method from the plot ready data saved in the aggregate file. The arguments defining the
+        saved data cannot be changed and are ignored with a warning if they differ from the saved values
+        """
+        try:
+            plot = self.aggregate["plots"][method_name]
+        except KeyError:
+            raise pycoQCError ("{} is not available in the aggregate file".format(method_name))
+
+        method_args = dict(plot["args"], **method_args)
+        ignored_args = []
+        for arg_name, saved_val in plot["data_args"].items():
+            if arg_name in method_args and method_args[arg_name] != saved_val:
+                ignored_args.append("{}={} (saved {})".format(arg_name, method_args[arg_name], saved_val))
+            method_args[arg_name] = saved_val
+        if ignored_args:
+            self.logger.warning("WARNING: {} arguments cannot be changed from an aggregate file and are ignored: {}. Regenerate the aggregate file with pycoQC to apply them".format(
+                method_name, ", ".join(ignored_args)))
+
+        self.plotter.saved_plot_data = plot
+        return getattr(self.plotter, method_name)(**method_args)
+
+    def _get_src_files(self):
+        """"""
+        return self.aggregate["src_files"]
+
+    def _get_summary_stats(self):
+        """"""
+        return self.aggregate["summary_stats"]
+
+    def _read_aggregate(self, aggregate_file):
+        """Read and validate an aggregate file"""
+        opener = gzip.open if aggregate_file.endswith(".gz") else open
+        try:
+            with opener(aggregate_file, "rt") as fp:
+                aggregate = json.load(fp)
+        except (FileNotFoundError, IOError, json.JSONDecodeError) as E:
+            raise pycoQCError ("Cannot read aggregate file {}: {}".format(aggregate_file, E))
+
+        if not isinstance(aggregate, dict) or aggregate.get("format") != AGGREGATE_FORMAT:
+            raise pycoQCError ("{} is not a valid pycoQC aggregate file".format(aggregate_file))
+        if aggregate.get("version", 0) != AGGREGATE_VERSION:
+            raise pycoQCError ("Aggregate file version {} is not supported by {} {}. Supported version: {}. Regenerate the aggregate file with pycoQC".format(
+                aggregate.get("version"), package_name, package_version, AGGREGATE_VERSION))
+
+        self.logger.debug ("\tAggregate file version {} generated with {} {}".format(
+            aggregate["version"], package_name, aggregate.get("package_version")))
+        return aggregate
+
+    def _write_aggregate(self, aggregate, outfile):
+        """Write an aggregate dict to a json file, gzip compressed if the file name ends with .gz"""
+        aggregate = dict(format=AGGREGATE_FORMAT, version=AGGREGATE_VERSION, package_version=package_version, **aggregate)
+        opener = gzip.open if outfile.endswith(".gz") else open
+        mkbasedir(outfile, exist_ok=True)
+        # Write in a temporary file first to never leave a truncated aggregate file behind
+        tmp_fn = "{}.{}.tmp".format(outfile, os.getpid())
+        try:
+            with opener(tmp_fn, "wt") as fp:
+                json.dump(aggregate, fp, default=self._json_default, separators=(",", ":"))
+            os.replace(tmp_fn, outfile)
+        finally:
+            if os.path.isfile(tmp_fn):
+                os.remove(tmp_fn)
+
+    def _get_plotlyjs(self):
+        """Read the plotly.js bundle shipped with plotly and its version without importing plotly"""
+        plotly_dir = importlib.util.find_spec("plotly").submodule_search_locations[0]
+        with open(os.path.join(plotly_dir, "package_data", "plotly.min.js")) as fp:
+            plotlyjs = fp.read()
+        m = re.search(r"plotly\.js v(\S+)", plotlyjs[:500])
+        version = m.group(1) if m else "latest"
+        return (plotlyjs, version)
+
+    def _write_plotlyjs(self, outfile, plotlyjs_dir=""):
+        """Write the plotly.js bundle once in the asset directory and return its path relative to the report"""
+        plotlyjs, version = self._get_plotlyjs()
+        report_dir = os.path.dirname(os.path.abspath(outfile))
+        asset_dir = os.path.abspath(plotlyjs_dir) if plotlyjs_dir else report_dir
+        asset_fn = os.path.join(asset_dir, "plotly-{}.min.js".format(version))
+
+        # The bundle is versioned so an existing file can be reused as is
+        if os.path.isfile(asset_fn):
+            self.logger.debug("\t\tReusing existing plotly.js file {}".format(asset_fn))
+        else:
+            self.logger.debug("\t\tWriting plotly.js file {}".format(asset_fn))
+            mkdir(asset_dir, exist_ok=True)
+            # Write in a temporary file first to be safe with concurrent reports
+            tmp_fn = "{}.{}.tmp".format(asset_fn, uuid.uuid4().hex)
+            with open(tmp_fn, "w") as fp:
+                fp.write(plotlyjs)
+            os.replace(tmp_fn, asset_fn)
+
+        return os.path.relpath(asset_fn, report_dir).replace(os.sep, "/")
+
+    def _plot_div(self, fig, compact=False):
+        """Render a figure in a html div, optionally with compact binary encoded data"""
+        data, layout, height = self._plot_json(fig, compact=compact)
+        div_id = str(uuid.uuid4())
+        return (
+            '<div>\n'
+            '<div id="{id}" class="plotly-graph-div" style="height:{height}; width:100%;"></div>\n'
+            '<script type="text/javascript">{decoder}\n'
+            'Plotly.newPlot("{id}", pycoQC_decode({data}), pycoQC_decode({layout}), {{"responsive":true}});\n'
+            '</script>\n'
+            '</div>').format(id=div_id, height=height, decoder=COMPACT_DECODER_JS, data=data, layout=layout)
+
+    def _lazy_plot_div(self, fig, data_fn, outfile, compact=False):
+        """Write the figure data in a separate javascript file and return a html div loading it when displayed"""
+        data, layout, height = self._plot_json(fig, compact=compact)
+        if height == "100%":
+            height = "{}px".format(LAZY_DEFAULT_HEIGHT)
+        div_id = str(uuid.uuid4())
+
+        # Write data file
+        with open(data_fn, "w") as fp:
+            fp.write('pycoQC_lazy_render("{}", {}, {});\n'.format(div_id, data, layout))
+
+        src = os.path.relpath(os.path.abspath(data_fn), os.path.dirname(os.path.abspath(outfile))).replace(os.sep, "/")
+        return (
+            '<div>\n'
+            '<div id="{id}" class="plotly-graph-div" style="height:{height}; width:100%;"></div>\n'
+            '<script type="text/javascript">{decoder}{loader}\n'
+            'pycoQC_lazy_observe("{id}", {src});\n'
+            '</script>\n'
+            '</div>').format(id=div_id, height=height, decoder=COMPACT_DECODER_JS, loader=LAZY_LOADER_JS, src=json.dumps(src))
+
+    def _plot_json(self, fig, compact=False):
+        """Serialise the data and layout of a figure or figure dict to JSON and define the height of the plot div"""
+        if hasattr(fig, "to_dict"):
+            fig = fig.to_dict()
+        data = fig.get("data", [])
+        layout = fig.get("layout", {})
+        if compact:
+            data = self._compact_encode(data)
+            layout = self._compact_encode(layout)
+
+        # Define plot div height as in plotly.offline
+        height = layout.get("height")
+        height = "{}px".format(height) if height else "100%"
+
+        json_dump = lambda o: json.dumps(o, default=self._json_default, separators=(",", ":"))
+        return (json_dump(data), json_dump(layout), height)
+
+    @staticmethod
+    def _json_default(obj):
+        """Serialise numpy and pandas objects found in figures"""
+        if isinstance(obj, np.ndarray) or hasattr(obj, "tolist"):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+    def _compact_encode(self, obj):
+        """Recursively replace numerical arrays by base64 typed arrays and round short float arrays"""
+        if isinstance(obj, dict):
+            return {k: self._compact_encode(v) for k, v in obj.items()}
+
+        if isinstance(obj, (list, tuple)):
+            # Treat numerical lists and matrices as arrays
+            if obj and not any(isinstance(i, (str, bool, dict)) or i is None for i in obj):
+                try:
+                    arr = np.array(obj)
+                    if arr.dtype.kind in "iuf":
+                        return self._compact_encode(arr)
+                except ValueError:
+                    pass
+            return [self._compact_encode(i) for i in obj]
+
+        if isinstance(obj, np.ndarray):
+            if obj.dtype.kind not in "iuf" or obj.ndim == 0:
+                return obj
+            # Encode higher dimension arrays (eg restyle args z=[z2d]) slice by slice
+            if obj.ndim > 2:
+                return [self._compact_encode(i) for i in obj]
+            # Quantise 2D matrices on uint8 levels spanning the matrix range
+            if obj.ndim == 2 and obj.size >= COMPACT_MIN_ARRAY_LEN:
+                return self._quantise_2D(obj)
+            # Encode long 1D arrays as float32 or int32 typed arrays
+            if obj.size >= COMPACT_MIN_ARRAY_LEN:
+                if obj.dtype.kind in "iu" and np.abs(obj).max() < 2**31:
+                    return {"dtype":"i4", "bdata":base64.b64encode(obj.astype("<i4").tobytes()).decode("ascii")}
+                return {"dtype":"f4", "bdata":base64.b64encode(obj.astype("<f4").tobytes()).decode("ascii")}
+            # Round short float arrays to the precision of the display
+            if obj.dtype.kind == "f":
+                return [None if np.isnan(i) else float("{:.{}g}".format(i, COMPACT_SIG_DIGITS)) for i in obj.ravel()] if obj.ndim == 1 else obj
+            return obj
+
+        return obj
+
+    def _quantise_2D(self, z):
+        """Quantise a 2D matrix to uint8 levels and encode as a base64 typed array"""
+        z = z.astype(np.float64)
+        nan = np.isnan(z)
+        if nan.all():
+            z_min, z_max = 0.0, 0.0
+        else:
+            z_min, z_max = float(np.nanmin(z)), float(np.nanmax(z))
+        scale = (z_max-z_min)/COMPACT_Z_LEVELS if z_max > z_min else 1.0
+        q = np.rint((np.where(nan, z_min, z)-z_min)/scale).astype("<u1")
+        q[nan] = COMPACT_Z_LEVELS+1
+        return {
+            "dtype":"u1",
+            "bdata":base64.b64encode(q.tobytes()).decode("ascii"),
+            "shape":"{}, {}".format(*z.shape),
+            "scale":scale,
+            "offset":z_min,
+            "nan":COMPACT_Z_LEVELS+1}
+
+    def _get_config(self, config_file=None):
+        """"""
+        # First, try to read provided configuration file if given
+        if config_file:
+            self.logger.debug ("\tTry to read provided config file")
+            try:
+                with open(config_file, 'r') as cf:
+                    return json.load(cf)
+            except (FileNotFoundError, IOError, json.JSONDecodeError):
+                self.logger.debug ("\t\tConfiguration file not found, non-readable or invalid")
+
+        # Last use the default harcoded config_dict
+        self.logger.debug ("\tRead default configuration file")
+        config_file = os.path.join(TEMPLATES_DIR, "pycoQC_config.json")
+        with open(config_file, 'r') as cf:
+            return json.load(cf)
+
+    def _get_jinja_template(self, template_file=None):
+        """"""
+        # First, try to read provided configuration file if given
+        if template_file:
+            self.logger.debug("\tTry to load provided jinja template file")
+            try:
+                with open(template_file) as fp:
+                    template = jinja2.Template(fp.read())
+                    return template
+            except (FileNotFoundError, IOError, jinja2.exceptions.TemplateNotFound, jinja2.exceptions.TemplateSyntaxError):
+                self.logger.debug ("\t\tFile not found, non-readable or invalid")
+
+        # Last use the default harcoded config_dict
+        self.logger.debug ("\tRead default jinja template")
+        env = jinja2.Environment (
+            loader=jinja2.PackageLoader('pycoQC', 'templates'),
+            autoescape=jinja2.select_autoescape(["html"]))
+        template = env.get_template('spectre.html.j2')
+        return template
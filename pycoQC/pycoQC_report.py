@@ -3,29 +3,27 @@
 
 #~~~~~~~~~~~~~~IMPORTS~~~~~~~~~~~~~~#
 # Standard library imports
-import json
-from pkg_resources import resource_filename
 import datetime
 import os
+import inspect
 
 # Third party imports
 import plotly.offline as py
-import jinja2
 
 # Local imports
 from pycoQC.common import *
 from pycoQC.pycoQC_parse import pycoQC_parse
 from pycoQC.pycoQC_plot import pycoQC_plot
-from pycoQC import __version__ as package_version
-from pycoQC import __name__ as package_name
+from pycoQC.pycoQC_render import pycoQC_render
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~MAIN CLASS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
-class pycoQC_report ():
+class pycoQC_report (pycoQC_render):
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~INIT METHOD~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
     def __init__ (self,
         parser:pycoQC_parse,
         plotter:pycoQC_plot,
+        groupby:str=None,
         verbose:bool=False,
         quiet:bool=False):
         """
@@ -33,6 +31,8 @@ class pycoQC_report ():
             A pycoQC_parse object
         * plotter
             A pycoQC_plot object
+        * groupby
+            Field to group the reads by in all the plots supporting it (barcode or run_id), unless defined in the configuration file
         * verbose
             Increase verbosity
         * quiet
@@ -50,54 +50,48 @@ class pycoQC_report ():
         if not isinstance(plotter, pycoQC_plot):
             raise pycoQCError ("{} is not a valid pycoQC_plot object".format(plotter))
         self.plotter = plotter
+        self.groupby = groupby
+
+        # Figures and plot ready data computed for the html report and the aggregate file, by method name
+        self.plots = OrderedDict()
 
     def __repr__(self):
         return "[{}]\n".format(self.__class__.__name__)
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PUBLIC METHODS~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
-    def html_report( self,
+    def aggregate_report(self,
         outfile:str,
         config_file:str="",
-        template_file:str="",
-        report_title:str="PycoQC report",
         skip_coverage_plot:bool=False):
-        """"""
-        self.logger.info("Generating HTML report")
+        """
+        Save the plot ready data of all the plotting methods and their arguments in a versioned aggregate file. The html and
+        json reports can then be regenerated from this file only with pycoQC_render, without the raw input files
+        * outfile
+            Path to an output aggregate file. The file is gzip compressed if the name ends with .gz
+        * config_file
+            Path to a JSON configuration file. The methods of the file are saved with the same arguments as in the html report,
+            followed by the other methods of the default configuration
+        * skip_coverage_plot
+            If True the coverage plot is not saved
+        """
+        self.logger.info("Generating aggregate file")
 
-        # Parse configuration file
-        self.logger.info("\tParsing html config file")
+        # Methods already computed for the html report with the same arguments are reused
         config_dict = self._get_config(config_file)
-        self.logger.debug(config_dict)
+        for method_name, method_args in self._get_config().items():
+            config_dict.setdefault(method_name, method_args)
 
-        # Loop over configuration file and run the pycoQC functions defined
-        plots = list()
-        titles = list()
+        plots = OrderedDict()
         for method_name, method_args in config_dict.items ():
             if skip_coverage_plot and method_name == "alignment_coverage":
                 self.logger.info("\tSkipping method {}".format(method_name))
                 continue
             try:
                 self.logger.info("\tRunning method {}".format(method_name))
-                self.logger.debug ("\t{} ({})".format(method_name, method_args))
-
-                # Store plot title for HTML title and remove from data passed to plotly
-                plot_title = method_args["plot_title"]
                 method_args["plot_title"]=""
-
-                # Get method and generate plot
-                method = getattr(self.plotter, method_name)
-                fig = method(**method_args)
-                plot = py.plot(
-                    fig,
-                    output_type='div',
-                    include_plotlyjs=False,
-                    image_width='',
-                    image_height='',
-                    show_link=False,
-                    auto_open=False)
-
-                plots.append(plot)
-                titles.append(plot_title)
+                self._get_figure(method_name, method_args)
+                plot = self.plots[method_name]
+                plots[method_name] = OrderedDict ((("args", plot["args"]), ("data_args", plot["data_args"]), ("data", plot["data"])))
 
             except AttributeError as E:
                 self.logger.info("\t\t{} is not a valid plotting method".format(method_name))
@@ -106,90 +100,59 @@ class pycoQC_report ():
             except pycoQCError as E:
                 self.logger.info("\t\t{}".format(E))
 
-        # Load HTML template for Jinja
-        self.logger.info("\tLoading HTML template")
-        template = self._get_jinja_template(template_file)
-
-        # Set a subtitle for the HTML report
-        report_subtitle="Generated on {} with {} {}".format( datetime.datetime.now().strftime("%d/%m/%y"), package_name, package_version)
-
-        # Define source files list
-        src_files = ""
-        for files_list, name in (
-            (self.parser.summary_files_list,"summary"),
-            (self.parser.barcode_files_list,"barcode"),
-            (self.parser.bam_file_list,"bam")):
-
-            if files_list:
-                src_files += "<h4>Source {} files</h4><ul>".format(name)
-                for f in files_list:
-                    f = os.path.abspath(f)
-                    src_files += "<li>{}</li>".format(f)
-                src_files += "</ul>"
-
-        # Render plots
-        self.logger.info("\tRendering plots in d3js")
-        rendering = template.render(
-            plots=plots,
-            titles=titles,
-            plotlyjs=py.get_plotlyjs(),
-            report_title=report_title,
-            report_subtitle=report_subtitle,
-            src_files=src_files)
-
-        # Write to HTML file
-        self.logger.info("\tWriting to HTML file")
-        mkbasedir(outfile, exist_ok=True)
-        with open(outfile, "w") as fp:
-            fp.write(rendering)
-
-    def json_report(self,
-        outfile:str):
-        """"""
-        self.logger.info("Generating JSON report")
         self.logger.info("\tRunning summary_stats_dict method")
-        res_dict = self.plotter.summary_stats_dict ()
+        aggregate = OrderedDict()
+        aggregate["date"] = datetime.datetime.now().strftime("%d/%m/%y")
+        aggregate["src_files"] = OrderedDict((name, [os.path.abspath(f) for f in files_list]) for name, files_list in self._get_src_files().items())
+        aggregate["counter"] = self.parser.counter
+        aggregate["summary_stats"] = self._get_summary_stats()
+        aggregate["plots"] = plots
 
-        self.logger.info("\tWriting to JSON file")
-        mkbasedir(outfile, exist_ok=True)
-        with open (outfile, "w") as fp:
-            json.dump(res_dict, fp, indent=2)
+        self.logger.info("\tWriting to aggregate file")
+        self._write_aggregate(aggregate, outfile)
 
     #~~~~~~~~~~~~~~PRIVATE FUNCTION~~~~~~~~~~~~~~#
 
-    def _get_config(self, config_file=None):
+    def _get_figure(self, method_name, method_args):
+        """
+        Get method and generate plot. The figure is kept in self.plots with its plot ready data, so that a method called again
+        with the same arguments, for the html report and the aggregate file, is only computed once
+        """
+        method = getattr(self.plotter, method_name)
+        if self.groupby and "groupby" in inspect.signature(method).parameters and not "groupby" in method_args:
+            method_args = dict(method_args, groupby=self.groupby)
+
+        plot = self.plots.get(method_name)
+        if plot is None or plot["args"] != method_args:
+            fig = method(**method_args)
+            plot = OrderedDict ((("args", dict(method_args)), ("figure", fig)))
+            plot.update(self.plotter.last_plot_data)
+            self.plots[method_name] = plot
+        else:
+            self.logger.info("\t\tReusing figure")
+        return plot["figure"]
+
+    def _get_src_files(self):
         """"""
-        # First, try to read provided configuration file if given
-        if config_file:
-            self.logger.debug ("\tTry to read provided config file")
-            try:
-                with open(config_file, 'r') as cf:
-                    return json.load(cf)
-            except (FileNotFoundError, IOError, json.JSONDecodeError):
-                self.logger.debug ("\t\tConfiguration file not found, non-readable or invalid")
-
-        # Last use the default harcoded config_dict
-        self.logger.debug ("\tRead default configuration file")
-        config_file = resource_filename("pycoQC", "templates/pycoQC_config.json")
-        with open(config_file, 'r') as cf:
-            return json.load(cf)
-
-    def _get_jinja_template(self, template_file=None):
+        return OrderedDict((
+            ("summary", self.parser.summary_files_list or [self.parser.fast5_dir]),
+            ("barcode", self.parser.barcode_files_list),
+            ("bam", self.parser.bam_file_list)))
+
+    def _get_summary_stats(self):
         """"""
-        # First, try to read provided configuration file if given
-        if template_file:
-            self.logger.debug("\tTry to load provided jinja template file")
-            try:
-                with open(template_file) as fp:
-                    template = jinja2.Template(fp.read())
-                    return template
-            except (FileNotFoundError, IOError, jinja2.exceptions.TemplateNotFound, jinja2.exceptions.TemplateSyntaxError):
-                self.logger.debug ("\t\tFile not found, non-readable or invalid")
-
-        # Last use the default harcoded config_dict
-        self.logger.debug ("\tRead default jinja template")
-        env = jinja2.Environment (
-            loader=jinja2.PackageLoader('pycoQC', 'templates'),
-            autoescape=jinja2.select_autoescape(["html"]))
-        template = env.get_template('spectre.html.j2')
-        return template
+        return self.plotter.summary_stats_dict()
+
+    def _plot_div(self, fig, compact=False):
+        """Render a plotly figure in a html div"""
+        if compact:
+            return super()._plot_div(fig, compact=True)
+
+        return py.plot(
+            fig,
+            output_type='div',
+            include_plotlyjs=False,
+            image_width='',
+            image_height='',
+            show_link=False,
+            auto_open=False)
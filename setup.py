@@ -40,5 +40,6 @@ setup(
         'console_scripts': [
             'pycoQC=pycoQC.__main__:main_pycoQC',
             'Fast5_to_seq_summary=pycoQC.__main__:main_Fast5_to_seq_summary',
-            'Barcode_split=pycoQC.__main__:main_Barcode_split']}
+            'Barcode_split=pycoQC.__main__:main_Barcode_split',
+            'pycoQC_render=pycoQC.__main__:main_pycoQC_render']}
 )
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""Equivalence of the pandas and polars backends of pycoQC_parse on the bundled example files"""
+
+# Standard library imports
+import os
+
+# Third party imports
+import pytest
+import pandas as pd
+
+# Local imports
+from pycoQC.pycoQC_parse import pycoQC_parse
+
+pytest.importorskip("polars")
+pytest.importorskip("pyarrow")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "docs", "pycoQC", "data")
+
+def data_fn (fn):
+    return os.path.join(DATA_DIR, fn)
+
+SUMMARY_FILES = [
+    "Albacore-1.2.1_basecall-1D-DNA_sequencing_summary.txt.gz",
+    "Albacore-1.2.3_basecall-1D-RNA_sequencing_summary.txt.gz",
+    "Albacore-1.7.0_basecall-1D-DNA_sequencing_summary.txt.gz",
+    "Albacore-2.1.10_basecall-1D-DNA_sequencing_summary.txt.gz",
+    "Albacore-2.1.10_basecall-1D-RNA_sequencing_summary.txt.gz",
+    "Albacore-2.3.1_basecall-1D-RNA_sequencing_summary.txt.gz",
+    "Guppy-2.1.3_basecall-1D-DNA_sequencing_summary.txt.gz",
+    "Guppy-2.1.3_basecall-1D-RNA_sequencing_summary.txt.gz",
+    "Guppy-basecall-1D-DNA_sequencing_summary.txt.gz"]
+
+OPTION_CASES = {
+    "guppy_barcode_file": dict(
+        summary_file = data_fn("Guppy-2.1.3_basecall-1D-DNA_sequencing_summary.txt.gz"),
+        barcode_file = data_fn("Guppy-2.1.3_basecall-1D_DNA_barcoding_summary.txt.gz")),
+    "guppy_barcode_file_min_barcode_percent": dict(
+        summary_file = data_fn("Guppy-2.1.3_basecall-1D-DNA_sequencing_summary.txt.gz"),
+        barcode_file = data_fn("Guppy-2.1.3_basecall-1D_DNA_barcoding_summary.txt.gz"),
+        min_barcode_percent = 10),
+    "deepbinner_barcode_file": dict(
+        summary_file = data_fn("Guppy-basecall-1D-DNA_sequencing_summary.txt.gz"),
+        barcode_file = data_fn("Guppy-basecall-1D-DNA_deepbinner_barcoding_summary.txt.gz")),
+    "albacore_barcode_min_barcode_percent": dict(
+        summary_file = data_fn("Albacore-1.7.0_basecall-1D-DNA_sequencing_summary.txt.gz"),
+        min_barcode_percent = 10),
+    "albacore_runid_list": dict(
+        summary_file = data_fn("Albacore-2.1.10_basecall-1D-RNA_sequencing_summary.txt.gz"),
+        runid_list = ["5074e0cd71f372314c30ca5158aab2172d915023", "17b317b994031430f350cda1dc13a72f66572ece"]),
+    "albacore_filter_calibration": dict(
+        summary_file = data_fn("Albacore-1.7.0_basecall-1D-DNA_sequencing_summary.txt.gz"),
+        filter_calibration = True),
+    "same_file_twice_filter_duplicated": dict(
+        summary_file = [
+            data_fn("Guppy-basecall-1D-DNA_sequencing_summary.txt.gz"),
+            data_fn("Guppy-basecall-1D-DNA_sequencing_summary.txt.gz")],
+        filter_duplicated = True),
+    "two_albacore_files_filter_duplicated": dict(
+        summary_file = [
+            data_fn("Albacore-1.7.0_basecall-1D-DNA_sequencing_summary.txt.gz"),
+            data_fn("Albacore-2.1.10_basecall-1D-DNA_sequencing_summary.txt.gz")],
+        filter_duplicated = True),
+    "two_albacore_files": dict(
+        summary_file = [
+            data_fn("Albacore-1.7.0_basecall-1D-DNA_sequencing_summary.txt.gz"),
+            data_fn("Albacore-2.1.10_basecall-1D-DNA_sequencing_summary.txt.gz")])}
+
+def assert_backends_equivalent (**kwargs):
+    """
+    Parse with both backends and compare the counters and the cleaned reads. Both backends sort the reads by start_time, but
+    the order of reads with the same start_time can differ, so the frames are compared after ordering the ties by read_id
+    """
+    pd_parser = pycoQC_parse(backend="pandas", quiet=True, **kwargs)
+    pl_parser = pycoQC_parse(backend="polars", quiet=True, **kwargs)
+
+    assert pl_parser.counter == pd_parser.counter
+
+    pd_df, pl_df = pd_parser.reads_df, pl_parser.reads_df
+    assert pl_df.index.name == pd_df.index.name
+    assert list(pl_df.columns) == list(pd_df.columns)
+    assert list(pl_df["start_time"]) == list(pd_df["start_time"])
+
+    sort_ties = lambda df: df.reset_index().sort_values(["start_time", df.index.name], kind="stable").reset_index(drop=True)
+    pd.testing.assert_frame_equal(sort_ties(pl_df), sort_ties(pd_df))
+
+@pytest.mark.parametrize("summary_fn", SUMMARY_FILES)
+def test_summary_file (summary_fn):
+    assert_backends_equivalent(summary_file=data_fn(summary_fn))
+
+@pytest.mark.parametrize("case", list(OPTION_CASES))
+def test_options (case):
+    assert_backends_equivalent(**OPTION_CASES[case])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""Equivalence of text and columnar summary files in pycoQC_parse, including the reads discarded while reading columnar files"""
+
+# Standard library imports
+import os
+
+# Third party imports
+import pytest
+import numpy as np
+import pandas as pd
+
+# Local imports
+from pycoQC.pycoQC_parse import pycoQC_parse
+
+pytest.importorskip("pyarrow")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "docs", "pycoQC", "data")
+
+RNA_RUNIDS = ["5074e0cd71f372314c30ca5158aab2172d915023", "17b317b994031430f350cda1dc13a72f66572ece"]
+
+@pytest.fixture(scope="module")
+def summary_files (tmp_path_factory):
+    """Write the same summary data as text, parquet and feather files. NA values and a second run_id are added to the DNA file"""
+    tmp_dir = tmp_path_factory.mktemp("summary")
+    rna_df = pd.read_csv(os.path.join(DATA_DIR, "Albacore-2.1.10_basecall-1D-RNA_sequencing_summary.txt.gz"), sep="\t")
+    dna_df = pd.read_csv(os.path.join(DATA_DIR, "Albacore-1.7.0_basecall-1D-DNA_sequencing_summary.txt.gz"), sep="\t")
+    dna_df.loc[::3, "run_id"] = "other"
+    dna_df.loc[5::7, "sequence_length_template"] = np.nan
+    dna_df.loc[11::13, "channel"] = np.nan
+
+    files = {}
+    for name, df in (("rna", rna_df), ("dna", dna_df)):
+        files[name] = {}
+        for ext in ("txt", "parquet", "feather"):
+            fn = str(tmp_dir/"{}.{}".format(name, ext))
+            if ext == "txt":
+                df.to_csv(fn, sep="\t", index=False)
+            elif ext == "parquet":
+                df.to_parquet(fn)
+            else:
+                df.to_feather(fn)
+            files[name][ext] = fn
+    return files
+
+@pytest.mark.parametrize("name,kwargs", [
+    ("rna", {}),
+    ("rna", {"runid_list":RNA_RUNIDS}),
+    ("dna", {}),
+    ("dna", {"runid_list":["other"], "filter_calibration":True})])
+@pytest.mark.parametrize("ext", ["parquet", "feather"])
+def test_columnar_counters (summary_files, name, kwargs, ext):
+    text_parser = pycoQC_parse(summary_files[name]["txt"], quiet=True, **kwargs)
+    columnar_parser = pycoQC_parse(summary_files[name][ext], quiet=True, **kwargs)
+
+    assert columnar_parser.counter == text_parser.counter
+    pd.testing.assert_frame_equal(columnar_parser.reads_df.sort_index(), text_parser.reads_df.sort_index(), check_dtype=False)